@@ -0,0 +1,331 @@
+#!/usr/bin/python
+# BLE 광고 주기를 상태(시작 직후, 알람 중, 연결됨)에 맞춰 바꿈
+# 사용법(발견 시간, 시간당 광고 횟수 시뮬레이션):
+#   python Advertising.py [--scan-window 30 --scan-interval 300] [--low-power]
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+# 광고 주기(ms). 애플 액세서리 설계 지침에서 권장하는 값
+FAST_INTERVAL = (20, 30)       # 앱을 연 직후 / 알람이 울리는 중: 빨리 발견되게
+IDLE_INTERVAL = (417, 546)     # 평소
+LOW_POWER_INTERVAL = (1022, 1285) # --low-power 또는 연결된 동안
+FAST_PERIOD = 30.0             # 시작/연결 끊김 후 빠르게 광고하는 시간(초)
+ALARM_WINDOW = 600.0           # 알람이 최대 밝기가 된 뒤에도 빠르게 광고하는 시간(초)
+ADV_DELAY = 0.010              # 블루투스 규격의 광고마다 붙는 무작위 지연 (0~10ms)
+RETRY_DELAY = 1.0              # 다시 등록하다 실패하면 이만큼 뒤 재시도, 실패할 때마다 두 배(초)
+MAX_RETRY_DELAY = 60.0
+
+# 연결 주기(1.25ms 단위). 업로드 같은 대량 쓰기가 빨리 끝나도록 짧게 요청
+CONNECTION_INTERVAL = (6, 12)
+DEBUGFS = '/sys/kernel/debug/bluetooth/hci0'
+
+LEGACY_ADV_SIZE = 31
+
+
+def compact_uuids(uuids, local_name):
+    # 31바이트 광고에 들어가는 만큼만 서비스 UUID 를 넣음 (flags 3바이트는 BlueZ 가 추가)
+    free = LEGACY_ADV_SIZE - 3
+    if local_name:
+        free -= 2 + len(local_name.encode('utf-8'))
+    chosen = []
+    for uuid in uuids:
+        size = 2 if len(uuid) == 4 else 16
+        # 같은 크기의 UUID 목록은 길이/종류 2바이트를 한 번만 씀
+        header = 0 if any(len(u) == len(uuid) for u in chosen) else 2
+        if header + size <= free:
+            chosen.append(uuid)
+            free -= header + size
+    return chosen
+
+
+def mean_interval(interval):
+    return (interval[0] + interval[1]) / 2000.0 + ADV_DELAY / 2
+
+
+class AdvertisingManager:
+    # 광고 객체(Advertisement)의 주기를 바꾸고 BlueZ 에 다시 등록함
+    # reply_handler/error_handler 는 처음 등록할 때만 부름. 주기를 바꾸며 다시 등록하다
+    # 실패하면 데몬을 멈추지 않고 기록한 뒤 점점 길게 기다리며 재시도함
+    def __init__(self, ad_manager, advertisement, low_power=False, schedule=None,
+                 reply_handler=None, error_handler=None, clock=time.monotonic):
+        self.ad_manager = ad_manager
+        self.advertisement = advertisement
+        self.idle_interval = LOW_POWER_INTERVAL if low_power else IDLE_INTERVAL
+        self.schedule = schedule or self.schedule_timer
+        self.reply_handler = reply_handler
+        self.error_handler = error_handler
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connected = set()
+        self.fast_until = clock() + FAST_PERIOD
+        self.alarm_from = 0.0
+        self.alarm_until = 0.0
+        self.interval = None
+        self.registered = False
+        self.changed_at = clock()
+        self.time_in = {} # 주기별 광고한 시간(초), 시간당 광고 횟수 계산용
+        self.registrations = 0
+        self.failures = 0 # 연속으로 실패한 재등록 수
+        self.retry_pending = False
+        self.stopped = False
+
+    def schedule_timer(self, seconds, callback):
+        timer = threading.Timer(seconds, callback)
+        timer.daemon = True
+        timer.start()
+
+    def wanted_interval(self, now):
+        if self.alarm_from <= now < self.alarm_until:
+            return FAST_INTERVAL
+        if self.connected:
+            return LOW_POWER_INTERVAL
+        if now < self.fast_until:
+            return FAST_INTERVAL
+        return self.idle_interval
+
+    def update(self):
+        with self.lock:
+            now = self.clock()
+            interval = self.wanted_interval(now)
+            # 빠른 광고가 시작하거나 끝나는 시각에 다시 확인
+            ends = [t for t in (self.fast_until, self.alarm_from, self.alarm_until) if t > now]
+            if interval == self.interval and self.registered:
+                return
+            if self.interval is not None:
+                self.time_in[self.interval] = self.time_in.get(self.interval, 0.0) + now - self.changed_at
+            self.changed_at = now
+            self.interval = interval
+            # BlueZ 는 등록할 때만 속성을 읽으므로 주기를 바꾸려면 다시 등록해야 함
+            # 메인 루프 안에서 불리므로 기다리지 않음. BlueZ 는 받은 순서대로 처리
+            if self.registered:
+                self.ad_manager.UnregisterAdvertisement(self.advertisement.get_path(),
+                                                        reply_handler=self.unregistered,
+                                                        error_handler=self.unregistered)
+            self.advertisement.set_interval(*interval)
+            first = self.registrations == 0
+            self.ad_manager.RegisterAdvertisement(
+                    self.advertisement.get_path(), {},
+                    reply_handler=self.reply_handler if first else self.reregistered,
+                    error_handler=self.error_handler if first else self.reregister_failed)
+            self.registered = True
+            self.registrations += 1
+            print('Advertising every {}-{} ms'.format(*interval))
+        if ends:
+            self.schedule(min(ends) - now + 0.01, self.update)
+
+    def unregistered(self, error=None):
+        if error is not None:
+            print('Failed to unregister advertisement: {}'.format(error))
+
+    def reregistered(self):
+        with self.lock:
+            self.failures = 0
+
+    def reregister_failed(self, error):
+        # 예: 알람 때문에 빠른 주기로 바꾸는 중 BlueZ 가 잠시 거절함. 다음 update 가 다시 등록
+        with self.lock:
+            self.registered = False
+            self.failures += 1
+            delay = min(RETRY_DELAY * 2 ** min(self.failures - 1, 16), MAX_RETRY_DELAY)
+            print('Failed to re-register advertisement: {}, retrying in {:.0f} s'.format(error, delay))
+            if self.retry_pending:
+                return
+            self.retry_pending = True
+        self.schedule(delay, self.retry)
+
+    def retry(self):
+        with self.lock:
+            self.retry_pending = False
+            if self.stopped:
+                return
+        self.update()
+
+    def start(self):
+        self.prefer_connection_interval(*CONNECTION_INTERVAL)
+        self.update()
+
+    def device_changed(self, device, connected):
+        # org.bluez.Device1 의 Connected 속성이 바뀔 때 호출
+        if connected:
+            self.connected.add(device)
+        else:
+            self.connected.discard(device)
+            # 연결이 끊기면 바로 다시 연결할 수 있게 잠시 빠르게 광고
+            self.fast_until = self.clock() + FAST_PERIOD
+        self.update()
+
+    def alarm_started(self, fire_at, full):
+        # fire_at: 알람이 울리기 시작하는 시각, full: 최대 밝기가 되는 시각 (time.monotonic 기준)
+        # 예약만 된 동안은 평소 주기로 광고하고 fire_at 부터 빠르게 광고함
+        self.alarm_from = fire_at
+        self.alarm_until = full + ALARM_WINDOW
+        self.update()
+
+    def alarm_stopped(self):
+        self.alarm_from = 0.0
+        self.alarm_until = 0.0
+        self.update()
+
+    def prefer_connection_interval(self, min_interval, max_interval):
+        # 주변기기 쪽에서는 D-Bus 로 연결 주기를 요청할 수 없어서 커널 기본값을 바꿈 (root 필요)
+        try:
+            with open(DEBUGFS + '/conn_min_interval', 'w') as f:
+                f.write(str(min_interval))
+            with open(DEBUGFS + '/conn_max_interval', 'w') as f:
+                f.write(str(max_interval))
+            print('Connection interval {:.2f}-{:.2f} ms'.format(min_interval * 1.25,
+                                                               max_interval * 1.25))
+        except OSError as e:
+            print('Cannot set connection interval: {}'.format(e))
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            if self.registered:
+                self.ad_manager.UnregisterAdvertisement(self.advertisement.get_path())
+                self.registered = False
+            if self.interval is not None:
+                now = self.clock()
+                self.time_in[self.interval] = self.time_in.get(self.interval, 0.0) + now - self.changed_at
+                self.changed_at = now
+
+    def report(self):
+        total = sum(self.time_in.values())
+        if total <= 0:
+            return
+        count = sum(seconds / mean_interval(interval) for interval, seconds in self.time_in.items())
+        print('Advertising: {:.0f} advertisements/hour, {} registrations'.format(
+                count * 3600 / total, self.registrations))
+
+
+class SimulatedBlueZ:
+    # LEAdvertisingManager1 대신 쓰는 가짜. 가상 시계로 하루를 빠르게 돌려 봄
+    # fail_every: 이 횟수의 등록마다 한 번 거절함 (0 이면 거절하지 않음)
+    def __init__(self, fail_every=0):
+        self.now = 0.0
+        self.timers = []
+        self.log = [] # (시각, 주기 또는 None)
+        self.fail_every = fail_every
+        self.registers = 0
+        self.rejected = 0
+
+    def clock(self):
+        return self.now
+
+    def schedule(self, seconds, callback):
+        self.timers.append((self.now + seconds, callback))
+
+    def run_until(self, until):
+        while True:
+            due = [t for t in self.timers if t[0] <= until]
+            if not due:
+                break
+            timer = min(due, key=lambda t: t[0])
+            self.timers.remove(timer)
+            self.now = timer[0]
+            timer[1]()
+        self.now = until
+
+    def RegisterAdvertisement(self, path, options, reply_handler=None, error_handler=None):
+        # D-Bus 처럼 응답은 메인 루프에서 나중에 옴
+        self.registers += 1
+        if self.fail_every and self.registers > 1 and (self.registers - 1) % self.fail_every == 0:
+            self.rejected += 1
+            if error_handler is not None:
+                self.schedule(0.0, lambda: error_handler('org.bluez.Error.Failed'))
+            return
+        self.log.append((self.now, self.advertisement.min_interval, self.advertisement.max_interval))
+        if reply_handler is not None:
+            self.schedule(0.0, reply_handler)
+
+    def UnregisterAdvertisement(self, path, reply_handler=None, error_handler=None):
+        self.log.append((self.now, None, None))
+
+
+class SimulatedAdvertisement:
+    def __init__(self):
+        self.min_interval = None
+        self.max_interval = None
+
+    def get_path(self):
+        return '/org/bluez/example/advertisement0'
+
+    def set_interval(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+
+def discovery_time(interval, scan_window, scan_interval, rng):
+    # 스캐너가 scan_interval 마다 scan_window 동안 듣는다고 보고 첫 광고를 받는 시각
+    phase = rng.uniform(0, scan_interval)
+    t = rng.uniform(0, mean_interval(interval))
+    while True:
+        if (t + phase) % scan_interval < scan_window:
+            return t
+        t += rng.uniform(interval[0], interval[1]) / 1000.0 + rng.uniform(0, ADV_DELAY)
+
+
+def simulate(scan_window, scan_interval, runs, low_power, fail_every=0, seed=1):
+    rng = random.Random(seed)
+    for name, interval in (('fast', FAST_INTERVAL), ('idle', IDLE_INTERVAL),
+                           ('low power', LOW_POWER_INTERVAL)):
+        times = sorted(discovery_time(interval, scan_window, scan_interval, rng)
+                       for _ in range(runs))
+        print('{:>9} {:>4}-{:<4} ms: discovery {:.2f} s median, {:.2f} s p95, '
+              '{:.0f} advertisements/hour'.format(
+                name, interval[0], interval[1], times[len(times) // 2],
+                times[int(len(times) * 0.95)], 3600 / mean_interval(interval)))
+
+    # 하루: 시작, 저녁에 앱으로 5분 연결하며 아침 7시 알람(30분 페이드)을 예약, 울린 뒤 앱으로 끔
+    bluez = SimulatedBlueZ(fail_every)
+    bluez.advertisement = SimulatedAdvertisement()
+    quit = [] # 처음 등록이 실패했을 때만 데몬이 멈춤
+    manager = AdvertisingManager(bluez, bluez.advertisement, low_power,
+                                 schedule=bluez.schedule, clock=bluez.clock,
+                                 error_handler=quit.append)
+    manager.prefer_connection_interval = lambda min_interval, max_interval: None
+    manager.start()
+    events = [(2 * 3600, manager.device_changed, ('phone', True)),
+              (2 * 3600 + 60, manager.alarm_started, (10 * 3600, 10 * 3600 + 1800)),
+              (2 * 3600 + 300, manager.device_changed, ('phone', False)),
+              (10 * 3600 + 1900, manager.device_changed, ('phone', True)),
+              (10 * 3600 + 1905, manager.alarm_stopped, ()),
+              (10 * 3600 + 1960, manager.device_changed, ('phone', False))]
+    for at, handler, args in events:
+        bluez.run_until(at)
+        handler(*args)
+    bluez.run_until(24 * 3600)
+    # 마지막으로 BlueZ 가 받아들인 주기가 지금 원하는 주기여야 함 (거절된 뒤에도 회복)
+    registered = [entry for entry in bluez.log if entry[1] is not None][-1][1:]
+    recovered = registered == manager.wanted_interval(bluez.now)
+    manager.stop()
+    manager.report()
+    if fail_every:
+        print('{} of {} registrations rejected, daemon {}, advertising {}'.format(
+                bluez.rejected, bluez.registers, 'stopped' if quit else 'kept running',
+                'recovered' if recovered else 'STUCK'))
+    return not quit and recovered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scan-window', default=30, type=float, help="" +
+                        "phone scan window in ms (default: 30)")
+    parser.add_argument('--scan-interval', default=300, type=float, help="" +
+                        "phone scan interval in ms (default: 300)")
+    parser.add_argument('--runs', default=2000, type=int, help="simulated " +
+                        "discoveries per interval (default: 2000)")
+    parser.add_argument('--low-power', action='store_true', help="use the " +
+                        "low power interval when idle")
+    parser.add_argument('--fail-every', default=0, type=int, help="let " +
+                        "BlueZ reject every Nth registration after the " +
+                        "first, 0=never (default: 0)")
+    args = parser.parse_args()
+
+    ok = simulate(args.scan_window / 1000.0, args.scan_interval / 1000.0, args.runs,
+                  args.low_power, args.fail_every)
+    sys.exit(0 if ok else 1)
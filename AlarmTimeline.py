@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# 알람을 예약할 때 미리 계산/준비해 두고, 울릴 때는 시계만 기다림
+# 사용법(울리는 시각 오차 측정): python AlarmTimeline.py Alarm/alarm.wav [--runs 5] [--delay 5]
+
+import argparse
+import threading
+import time
+import wave
+from LEDController import FRAME_INTERVAL
+from NetworkAudio import is_stream
+
+PREOPEN = 3.0 # 울리기 이만큼 전에 장치를 열고 오디오/LED 스레드에 넘김(초)
+
+
+def frame_table(start, seconds, source, target):
+    # FRAME_INTERVAL 격자의 (시각 목록, 색 목록). 마지막 항목이 목표 색
+    count = max(1, int(round(seconds / FRAME_INTERVAL)))
+    times = [start + seconds * i / count for i in range(count + 1)]
+    colors = [tuple(int(s + (t - s) * i / count) for s, t in zip(source, target))
+              for i in range(count + 1)]
+    return times, colors
+
+
+class AlarmTimeline:
+    def __init__(self, player, ledController, clock):
+        self.player = player
+        self.ledController = ledController
+        self.clock = clock
+        self.cancel_event = threading.Event()
+        self.timer_thread = None
+        self.frames = None
+        self.fire_at = None
+
+    def schedule(self, delay, seconds, r, g, b, file_path, volume, fade=False):
+        # 프레임 표는 예약할 때 계산하고, 오디오 디코딩은 타이머 스레드가 바로 시작함
+        # (BLE 쓰기를 처리하는 GLib 메인 루프를 막지 않음)
+        self.cancel()
+        self.fire_at = self.clock.now() + delay
+        # 알람은 꺼진 상태에서 시작하므로 검은색부터 계산
+        self.frames = frame_table(self.fire_at, seconds, (0, 0, 0), (r, g, b))
+        self.cancel_event.clear()
+        self.timer_thread = threading.Thread(target=self.run,
+                                             args=(seconds, file_path, volume, fade))
+        self.timer_thread.daemon = True
+        self.timer_thread.start()
+
+    def prepare(self, file_path):
+        # 소리를 준비하지 못하면 빛만 울림. 소리를 낼 수 있으면 True
+        if not file_path:
+            print("No alarm sound, lighting only")
+            return False
+        if is_stream(file_path):
+            return True # 스트림은 미리 디코딩하지 않고 울릴 때 받음
+        try:
+            self.player.prepare_music(file_path)
+            return True
+        except (OSError, EOFError, wave.Error) as e:
+            print(f"Cannot prepare alarm sound {file_path}: {e}, lighting only")
+            self.player.prepare_music(None)
+            return False
+
+    def run(self, seconds, file_path, volume, fade):
+        fire_at = self.fire_at
+        sound = self.prepare(file_path)
+        if self.clock.wait_until(fire_at - PREOPEN, self.cancel_event):
+            return
+        # 장치를 미리 열고, 시작 시각과 함께 넘겨서 울릴 때는 각 스레드가 시계만 기다림
+        if sound:
+            self.player.preopen(0 if fade else volume)
+        self.ledController.warm_up()
+        self.ledController.start()
+        self.ledController.play_table(*self.frames)
+        if sound:
+            self.player.start()
+            if fade: # 밝기와 볼륨을 함께 올림
+                self.player.update_music(file_path, volume, fire_at, seconds)
+            else: # 빛이 최대 밝기가 되는 순간 소리 시작
+                self.player.update_music(file_path, volume, fire_at + seconds)
+        print(f"Alarm armed {max(0.0, fire_at - self.clock.now()):.1f} s before it fires")
+
+    def cancel(self):
+        if self.timer_thread is not None:
+            self.cancel_event.set()
+            if self.timer_thread is not threading.current_thread():
+                self.timer_thread.join()
+            self.timer_thread = None
+        self.frames = None
+
+
+class FirstFrame:
+    # LEDController.capture 자리에 넣어 fire_at 이후 처음 내보낸 프레임 시각을 기록
+    def __init__(self, fire_at):
+        self.fire_at = fire_at
+        self.shown_at = None
+
+    def led_frame(self, now, pin, frame):
+        if self.shown_at is None and now >= self.fire_at - 0.001:
+            self.shown_at = now
+
+
+def summary(name, values):
+    mean = sum(values) / len(values)
+    jitter = (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5
+    return f"{name} {mean * 1000:.1f} ms avg, {max(values) * 1000:.1f} ms max, {jitter * 1000:.2f} ms jitter"
+
+
+def benchmark(path, runs, delay, seconds):
+    # 이전 방식(울릴 때 turnAlarmOn 처럼 모든 것을 시작)과 미리 준비한 방식을 비교
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController
+    from MediaClock import MediaClock
+    clock = MediaClock.getInstance()
+    player = AudioPlayer.getInstance()
+    ledController = LEDController.getInstance()
+    timeline = AlarmTimeline(player, ledController, clock)
+
+    for mode in ('on demand', 'compiled'):
+        light, sound = [], []
+        for _ in range(runs):
+            fire_at = clock.now() + delay
+            probe = FirstFrame(fire_at)
+            ledController.capture = probe
+            if mode == 'compiled':
+                timeline.schedule(delay, seconds, 255, 128, 0, path, 80, True)
+            else:
+                clock.wait_until(fire_at)
+                start = clock.now()
+                ledController.start()
+                ledController.fade_to(255, 128, 0, start, start + seconds)
+                player.start()
+                player.update_music(path, 80, start, seconds)
+            clock.wait_until(fire_at + seconds)
+            light.append(probe.shown_at - fire_at)
+            sound.append(player.start_at + player.last_start_offset - fire_at)
+            timeline.cancel()
+            player.stop()
+            player.prepare_music(None)
+            ledController.capture = None
+            ledController.stop()
+        print(f"{mode}: {summary('first light', light)}; {summary('first sound', sound)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help="alarm WAV file")
+    parser.add_argument('--runs', default=5, type=int, help="alarms per " +
+                        "mode (default: 5)")
+    parser.add_argument('--delay', default=5, type=float, help="seconds " +
+                        "from scheduling to firing (default: 5)")
+    parser.add_argument('--seconds', default=2, type=float, help="fade " +
+                        "length in seconds (default: 2)")
+    args = parser.parse_args()
+
+    benchmark(args.path, args.runs, args.delay, args.seconds)
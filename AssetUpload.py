@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# BLE 로 알람/음악 파일을 받아 디스크에 바로 씀
+# 사용법(가상 BLE 링크에서 처리량과 최대 메모리): python AssetUpload.py bench [--size 1000000 --mtu 185]
+
+import argparse
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+OP_BEGIN = 0x01 # 'name,kind,size,crc32(hex)'
+OP_DATA = 0x02  # offset(uint32 LE) + 데이터
+OP_END = 0x03
+OP_ABORT = 0x04 # [1 이면 부분 파일도 지움]
+
+STATUS_OK = 0x00
+STATUS_RESEND = 0x01 # offset 이 맞지 않음. ack 의 offset 부터 다시 보내야 함
+STATUS_ERROR = 0x02
+
+ACK_WINDOW = 8 # 이 개수의 조각마다 한 번씩 ack
+READ_CHUNK = 4096
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+# 지금 쓰고 있는 부분 파일. 두 클라이언트가 같은 파일을 동시에 올리면 서로 섞이므로 막음
+open_parts = set()
+open_parts_lock = threading.Lock()
+
+class UploadError(Exception):
+    pass
+
+
+class AssetUpload:
+    # BLE 로 받은 알람/음악 파일을 조각 단위로 바로 디스크에 씀 (전체를 메모리에 올리지 않음)
+    # 클라이언트(기기)마다 하나씩 만들어 씀
+    def __init__(self, directories):
+        self.directories = directories # 종류 -> 폴더, 예: {'alarm': './Alarm'}
+        self.listeners = []
+        self.reset()
+
+    def reset(self):
+        self.file = None
+        self.name = None
+        self.path = None
+        self.part_path = None
+        self.size = 0
+        self.crc = 0
+        self.expected_crc = 0
+        self.offset = 0
+        self.chunks = 0
+        self.started = 0.0
+
+    def add_listener(self, listener):
+        # 업로드가 끝나면 listener(path) 로 알려서 캐시 등을 갱신하게 함
+        self.listeners.append(listener)
+
+    def ack(self, status):
+        return struct.pack('<BI', status, self.offset)
+
+    def handle(self, value, mtu=23):
+        # 클라이언트가 보낸 메시지를 처리하고 ack 를 반환 (보낼 필요가 없으면 None)
+        if not value:
+            raise UploadError("Empty upload message")
+        op = value[0]
+        if op == OP_BEGIN:
+            return self.begin(bytes(value[1:]).decode('utf-8'), mtu)
+        if op == OP_DATA:
+            return self.data(value)
+        if op == OP_END:
+            return self.end()
+        if op == OP_ABORT:
+            self.abort(len(value) > 1 and value[1] == 1)
+            return self.ack(STATUS_OK)
+        raise UploadError(f"Unknown upload opcode: {op}")
+
+    def begin(self, header, mtu):
+        name, kind, size, crc = header.split(',')
+        if not NAME_PATTERN.match(name) or kind not in self.directories:
+            raise UploadError(f"Invalid upload target: {name} ({kind})")
+        self.close()
+        self.reset()
+        directory = self.directories[kind]
+        os.makedirs(directory, exist_ok=True)
+        part_path = os.path.join(directory, f'.{name}.wav.{crc.lower()}.part')
+        with open_parts_lock:
+            if part_path in open_parts:
+                raise UploadError(f"{name} is being uploaded by another client")
+            open_parts.add(part_path)
+        self.name = name
+        self.size = int(size)
+        self.expected_crc = int(crc, 16)
+        self.path = os.path.join(directory, f'{name}.wav')
+        self.part_path = part_path
+
+        # 같은 파일의 이전 업로드가 남아 있으면 이어서 받음
+        self.file = open(self.part_path, 'a+b')
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(READ_CHUNK)
+            if not chunk:
+                break
+            self.crc = zlib.crc32(chunk, self.crc)
+            self.offset += len(chunk)
+        if self.offset > self.size:
+            self.file.truncate(0)
+            self.crc = 0
+            self.offset = 0
+        self.started = time.monotonic()
+        print(f"Upload of {name} starting at {self.offset}/{self.size}")
+        # ATT 헤더(3) + opcode(1) + offset(4) 를 뺀 만큼이 한 조각의 최대 크기
+        return struct.pack('<BIH', STATUS_OK, self.offset, max(1, mtu - 8))
+
+    def data(self, value):
+        if self.file is None:
+            raise UploadError("Upload not started")
+        offset = struct.unpack_from('<I', value, 1)[0]
+        if offset != self.offset:
+            # 중복이거나 빠진 조각: 받은 곳까지 알려서 그 뒤부터 다시 보내게 함
+            return self.ack(STATUS_RESEND)
+        chunk = memoryview(value)[5:]
+        if self.offset + len(chunk) > self.size:
+            raise UploadError("Upload exceeds declared size")
+        self.file.write(chunk)
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.offset += len(chunk)
+        self.chunks += 1
+        if self.chunks % ACK_WINDOW == 0 or self.offset == self.size:
+            return self.ack(STATUS_OK)
+        return None
+
+    def end(self):
+        if self.file is None:
+            raise UploadError("Upload not started")
+        if self.offset != self.size or self.crc != self.expected_crc:
+            # 잘못 받은 부분 파일에서 이어 받으면 계속 실패하므로 지우고 처음부터 받게 함
+            print(f"Upload of {self.name} failed: {self.offset}/{self.size} bytes, crc {self.crc:08x}")
+            self.abort(True)
+            return self.ack(STATUS_ERROR)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.close()
+        # 다 받은 뒤에만 원래 이름으로 바꿔서 재생 중인 파일이 반쯤 쓰인 상태가 되지 않게 함
+        os.replace(self.part_path, self.path)
+        elapsed = time.monotonic() - self.started
+        if elapsed > 0:
+            print(f"Uploaded {self.path}: {self.size / 1024 / elapsed:.1f} KB/s")
+        ack = self.ack(STATUS_OK)
+        for listener in self.listeners:
+            listener(self.path)
+        self.reset()
+        return ack
+
+    def abort(self, discard=False):
+        # 부분 파일은 남겨두어 나중에 이어 받을 수 있게 함. discard 이면 지움
+        part_path = self.part_path
+        self.close()
+        if discard and part_path is not None:
+            try:
+                os.remove(part_path)
+            except FileNotFoundError:
+                pass
+        self.reset()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            with open_parts_lock:
+                open_parts.discard(self.part_path)
+
+
+def bench(size, mtu, interval, packets, loss, seed=1):
+    # 가상 BLE 링크: 연결 이벤트(interval 초)마다 packets 개의 write-without-response 를
+    # 보내고, 그중 loss 비율만큼 잃어버림. ack 알림은 같은 이벤트에 돌아온다고 봄
+    # 처리량은 링크 시간 기준, 메모리는 받는 쪽(AssetUpload)의 파이썬 할당 최대값
+    import tempfile
+    import tracemalloc
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.bin')
+        crc = 0
+        with open(source, 'wb') as f:
+            for start in range(0, size, 1 << 16):
+                chunk = rng.randbytes(min(1 << 16, size - start))
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+        upload = AssetUpload({'music': directory})
+        tracemalloc.start()
+        cpu = time.process_time()
+        header = f'bench,music,{size},{crc:08x}'.encode('utf-8')
+        status, acked, chunk_size = struct.unpack('<BIH', upload.handle(bytes([OP_BEGIN]) + header, mtu))
+        window = 2 * ACK_WINDOW * chunk_size # 보내고 ack 를 기다리는 최대 바이트
+        sent = acked
+        events = 0
+        resent = 0
+        stalled = 0
+        with open(source, 'rb') as f:
+            while acked < size:
+                events += 1
+                progress = False
+                for _ in range(packets):
+                    if sent >= size or sent - acked >= window:
+                        break
+                    f.seek(sent)
+                    chunk = f.read(chunk_size)
+                    message = struct.pack('<BI', OP_DATA, sent) + chunk
+                    sent += len(chunk)
+                    if rng.random() < loss:
+                        continue
+                    ack = upload.handle(message, mtu)
+                    if ack is not None:
+                        status, offset = struct.unpack('<BI', ack)
+                        if status == STATUS_RESEND:
+                            resent += sent - offset
+                            sent = offset
+                        acked = max(acked, offset)
+                        progress = True
+                stalled = 0 if progress else stalled + 1
+                if stalled >= 4:
+                    # ack 가 오지 않으면 마지막 ack 부터 다시 보냄 (받는 쪽이 RESEND 로 맞춰 줌)
+                    resent += sent - acked
+                    sent = acked
+                    stalled = 0
+        status = upload.handle(bytes([OP_END]), mtu)[0]
+        cpu = time.process_time() - cpu
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(os.path.join(directory, 'bench.wav'), 'rb') as f:
+            received = zlib.crc32(f.read()) == crc
+    seconds = events * interval
+    print(f"{size / 1024:.0f} KB, MTU {mtu} ({chunk_size} B chunks), {packets} packets per "
+          f"{interval * 1000:.1f} ms event, {loss:.0%} loss: {size / 1024 / seconds:.1f} KB/s "
+          f"over the simulated link, {resent / 1024:.1f} KB resent, {cpu * 1000:.0f} ms CPU")
+    print(f"Peak receiver memory {peak / 1024:.1f} kB for a {size / 1024:.0f} KB file, "
+          f"file {'matches' if received else 'DIFFERS'}")
+    # 조각 단위로 쓰므로 최대 메모리는 파일 크기와 상관없이 작아야 함
+    return status == STATUS_OK and received and peak < 64 * 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--size', default=1000000, type=int, help="upload " +
+                        "size in bytes (default: 1000000)")
+    parser.add_argument('--mtu', default=185, type=int, help="negotiated " +
+                        "ATT MTU (default: 185)")
+    parser.add_argument('--interval', default=15, type=float, help="" +
+                        "connection interval in ms (default: 15)")
+    parser.add_argument('--packets', default=4, type=int, help="writes per " +
+                        "connection event (default: 4)")
+    parser.add_argument('--loss', default=0.01, type=float, help="fraction " +
+                        "of writes lost (default: 0.01)")
+    args = parser.parse_args()
+
+    sys.exit(0 if bench(args.size, args.mtu, args.interval / 1000, args.packets,
+                        args.loss) else 1)
\ No newline at end of file
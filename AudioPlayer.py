@@ -1,16 +1,90 @@
-import alsaaudio
+import importlib
 import wave
 import threading
 import time
+from MediaClock import MediaClock
+from NetworkAudio import NetworkSource, BUFFER_PERIODS, is_stream
+from Preprocess import loop_points
+
+PRE_ROLL = 0.5 # 예약 재생 시 장치를 미리 열어두는 시간(초)
+MAX_PRELOAD = 32 * 1024 * 1024 # 메모리에 올려 둘 최대 PCM 크기(바이트). 넘는 부분은 파일에서 읽음
+
+# alsaaudio 는 처음 사용할 때 불러와서 데몬 시작(광고 등록)을 늦추지 않음
+alsaaudio = None
+
+def load_alsaaudio():
+    global alsaaudio
+    if alsaaudio is None:
+        alsaaudio = importlib.import_module('alsaaudio')
+    return alsaaudio
+
+class PreparedAudio:
+    # wave.Wave_read 와 같은 방식으로 읽히는, 미리 디코딩해 메모리에 올려 둔 PCM
+    def __init__(self, path, max_bytes=MAX_PRELOAD):
+        self.path = path
+        with wave.open(path, 'rb') as f:
+            self.channels = f.getnchannels()
+            self.rate = f.getframerate()
+            self.sampwidth = f.getsampwidth()
+            self.nframes = f.getnframes()
+            self.frame_size = self.channels * self.sampwidth
+            self.data = f.readframes(min(self.nframes, max_bytes // self.frame_size))
+        self.preloaded = len(self.data) // self.frame_size
+        self.pos = 0
+        self.tail = None # 메모리에 없는 뒷부분을 읽을 때만 파일을 엶
+
+    def getnchannels(self):
+        return self.channels
+
+    def getframerate(self):
+        return self.rate
+
+    def getsampwidth(self):
+        return self.sampwidth
+
+    def getnframes(self):
+        return self.nframes
+
+    def tell(self):
+        return self.pos
+
+    def setpos(self, pos):
+        self.pos = pos
+
+    def rewind(self):
+        self.pos = 0
+
+    def readframes(self, count):
+        if self.pos < self.preloaded:
+            end = min(self.pos + count, self.preloaded)
+            data = self.data[self.pos * self.frame_size:end * self.frame_size]
+            self.pos = end
+            return data
+        if self.tail is None:
+            self.tail = wave.open(self.path, 'rb')
+        if self.tail.tell() != self.pos:
+            self.tail.setpos(self.pos)
+        data = self.tail.readframes(count)
+        self.pos += len(data) // self.frame_size
+        return data
+
+    def close(self):
+        # 메모리의 PCM 은 다시 재생할 수 있도록 남겨 둠
+        if self.tail is not None:
+            self.tail.close()
+            self.tail = None
+
 
 class AudioPlayer:
     _instance = None
+    _lock = threading.Lock()
 
     @staticmethod
     def getInstance():
-        if AudioPlayer._instance is None:
-            return AudioPlayer()
-        else:
+        # 여러 스레드가 동시에 불러도 하나만 만들고, 만든 것을 계속 돌려줌
+        with AudioPlayer._lock:
+            if AudioPlayer._instance is None:
+                AudioPlayer._instance = AudioPlayer()
             return AudioPlayer._instance
 
     def __init__(self):
@@ -18,96 +92,374 @@ class AudioPlayer:
             raise Exception("AudioPlayer is a Singleton Class")
         else:
             self.output = None
+            self.output_params = None
             self.wave_file = None
-            self.mixer = alsaaudio.Mixer('PCM')
+            self.mixer = None
             self.is_playing = False
             self.playback_thread = None
             self.update_event = threading.Event()
             self.audio_lock = threading.Lock()
             self.audio_file_path = None
             self.volume = 0
+            self.start_at = None
+            self.fade_in = 0
+            self.last_start_offset = None
+            self.clock = MediaClock.getInstance()
+            self.stop_event = threading.Event()
+            # 재생 위치(프레임)와 재시작 시 이어서 재생할 위치
+            self.position = 0
+            self.resume_position = 0
+            self.failure = None
+            self.on_failure = None
+            # 재생이 끝난 뒤 PCM 장치를 열어둘 시간(초). 0이면 바로 닫음
+            self.idle_timeout = 0
+            self.idle_timer = None
+            # 재생 중인 PCM 주기를 받아보는 콜백 목록 (tap(view, channels, rate))
+            self.taps = []
+            # ALSA 버퍼 = period_size x periods 프레임. 클수록 끊김에 강하고 지연은 늘어남
+            self.period_size = 2048
+            self.periods = 4
+            self.underruns = 0
+            self.realtime = None # Realtime 설정을 넣으면 재생 스레드에 적용
+            self.prepared = None # 알람용으로 미리 디코딩해 둔 PreparedAudio
+            self.stream_periods = BUFFER_PERIODS # 네트워크 재생의 지터 버퍼 크기(주기)
 
     def start(self):
         if not self.is_playing:
             self.is_playing = True
+            self.stop_event.clear()
+            # stop() 이 남긴 신호로 이전 곡을 다시 재생하지 않도록 지움
+            self.update_event.clear()
             self.playback_thread = threading.Thread(target=self.run)
             self.playback_thread.daemon = True
             self.playback_thread.start()
-    
+
     def run(self):
-        while self.is_playing:
-            self.update_event.wait()
-            with self.audio_lock:
-                self.play(self.audio_file_path, self.volume)
-            self.update_event.clear()
+        if self.realtime is not None:
+            self.realtime.apply('Audio')
+        try:
+            while self.is_playing:
+                self.update_event.wait()
+                self.update_event.clear()
+                if not self.is_playing:
+                    break
+                # 재생하는 동안에는 잠금을 잡지 않아 다른 명령이 기다리지 않음
+                with self.audio_lock:
+                    music_path, volume = self.audio_file_path, self.volume
+                self.play(music_path, volume)
+        except Exception as e:
+            # is_playing 은 그대로 두어 감시자가 실패로 판단하고 재시작하게 함
+            print(f"Audio thread failed: {e}")
+            self.failure = e
+            if self.on_failure is not None:
+                self.on_failure(self)
 
-    def update_music(self, music_path, volume):
+    def update_music(self, music_path, volume, start_at=None, fade_in=0):
+        # start_at: 첫 샘플이 스피커로 나와야 하는 미디어 시계 시각
+        # fade_in: start_at 부터 volume 까지 볼륨을 올리는 시간(초)
         with self.audio_lock:
             self.audio_file_path = music_path
             self.volume = volume
+            self.start_at = start_at
+            self.fade_in = fade_in
+            self.resume_position = 0
         self.update_event.set()
 
+    def add_tap(self, tap):
+        # 재생 스레드가 순회하는 중에도 안전하도록 목록을 통째로 교체
+        self.taps = self.taps + [tap]
+
+    def remove_tap(self, tap):
+        self.taps = [t for t in self.taps if t is not tap]
+
+    def prepare_music(self, music_path):
+        # 시각이 중요한 재생(알람)을 위해 PCM 을 미리 메모리에 올려 둠. None 이면 해제
+        prepared = PreparedAudio(music_path) if music_path else None
+        with self.audio_lock:
+            self.prepared = prepared
+
+    def preopen(self, level):
+        # 재생 중이 아니면 준비해 둔 파일 형식으로 장치를 미리 열고 믹서를 맞춰 둠
+        with self.audio_lock:
+            prepared = self.prepared
+            if prepared is None or self.is_playing:
+                return
+            self.open_output(prepared.getnchannels(), prepared.getframerate(),
+                             prepared.getsampwidth())
+            self.get_mixer().setvolume(level)
+
+    def open_music(self, music_path):
+        prepared = self.prepared
+        if prepared is not None and prepared.path == music_path:
+            prepared.rewind()
+            return prepared
+        if is_stream(music_path):
+            # 미디어 서버에서 받아 재생. 받는 스레드가 버퍼를 미리 채워 둠
+            return NetworkSource(music_path, self.period_size, self.stream_periods)
+        return wave.open(music_path, 'rb')
+
+    def get_mixer(self):
+        if self.mixer is None:
+            self.mixer = load_alsaaudio().Mixer('PCM')
+        return self.mixer
+
+    def warm_up(self):
+        # 백그라운드에서 미리 모듈과 믹서를 준비해 첫 명령의 지연을 줄임
+        try:
+            self.get_mixer()
+        except Exception as e:
+            print(f"Audio warm-up failed: {e}")
+
+    def open_output(self, channels, rate, sampwidth=2):
+        # 같은 설정으로 열려 있는 장치는 다시 열지 않고 재사용
+        self.cancel_idle_timer()
+        params = (channels, rate, sampwidth)
+        if self.output is not None and self.output_params == params:
+            return
+        self.close_output()
+        load_alsaaudio()
+        # 파일의 샘플 형식 그대로 엶 (Preprocess.py 로 변환한 파일은 항상 S16_LE)
+        formats = {
+            1: alsaaudio.PCM_FORMAT_U8,
+            2: alsaaudio.PCM_FORMAT_S16_LE,
+            3: alsaaudio.PCM_FORMAT_S24_3LE,
+            4: alsaaudio.PCM_FORMAT_S32_LE,
+        }
+        try:
+            self.output = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device='sysdefault:CARD=Audio',
+                                        channels=channels, rate=rate, format=formats[sampwidth],
+                                        periodsize=self.period_size, periods=self.periods)
+        except TypeError:
+            # 생성자 인자를 받지 않는 이전 pyalsaaudio
+            self.output = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device='sysdefault:CARD=Audio')
+            self.output.setchannels(channels)
+            self.output.setrate(rate)
+            self.output.setformat(formats[sampwidth])
+            self.output.setperiodsize(self.period_size)
+        self.output_params = params
+
+    def close_output(self):
+        if self.output is not None:
+            print("Closing PCM output")
+            self.output.close()
+            self.output = None
+            self.output_params = None
+
+    def cancel_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+
+    def release_output(self):
+        # 유휴 시간이 지나면 한 번만 실행되고, 이후에는 아무 타이머도 남지 않음
+        with self.audio_lock:
+            self.idle_timer = None
+            if not self.is_playing:
+                self.close_output()
+
+    def queued_frames(self):
+        # ALSA 버퍼에 쌓여 아직 재생되지 않은 프레임 수. 알 수 없는 버전이면 None
+        # (pyalsaaudio 의 PCM 은 delay() 가 없고 avail()/info() 만 있음)
+        delay = getattr(self.output, 'delay', None)
+        if delay is not None:
+            return delay()
+        avail = getattr(self.output, 'avail', None)
+        info = getattr(self.output, 'info', None)
+        if avail is not None and info is not None:
+            return max(0, info()['buffer_size'] - avail())
+        return None
+
+    def output_delay(self, rate):
+        # ALSA 버퍼에 쌓여 아직 재생되지 않은 시간(초). 지원하지 않는 버전이면 0
+        queued = self.queued_frames()
+        return 0.0 if queued is None else queued / rate
+
+    def is_underrun(self):
+        # 쓰기 직전에 장치가 XRUN 상태이거나 버퍼가 비어 있었으면 언더런
+        state = getattr(self.output, 'state', None)
+        xrun = getattr(alsaaudio, 'PCM_STATE_XRUN', None)
+        if state is not None and xrun is not None and state() == xrun:
+            return True
+        queued = self.queued_frames()
+        return queued is not None and queued <= 0
+
+    def write_silence(self, start_at, channels, rate, sampwidth=2):
+        # 첫 샘플이 정확히 start_at 에 들리도록 남은 시간만큼 무음을 채움
+        frames = int(round((start_at - self.clock.now() - self.output_delay(rate)) * rate))
+        frame_size = channels * sampwidth
+        silence = (b'\x80' if sampwidth == 1 else b'\x00') * (self.period_size * frame_size)
+        while frames > 0 and self.is_playing:
+            count = min(frames, self.period_size)
+            self.output.write(silence[:count * frame_size])
+            frames -= count
+        self.last_start_offset = self.clock.now() + self.output_delay(rate) - start_at
+        print(f"Audio start offset: {self.last_start_offset * 1000:.1f} ms")
+
     def play(self, music_path, volume):
         # 오디오 파일 열기
         try:
-            self.wave_file = wave.open(music_path, 'rb')
-            self.output = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device='sysdefault:CARD=Audio')
-            self.output.setchannels(self.wave_file.getnchannels())
-            self.output.setrate(self.wave_file.getframerate())
-            self.output.setformat(alsaaudio.PCM_FORMAT_S16_LE)
-            self.output.setperiodsize(2048)
+            self.wave_file = self.open_music(music_path)
+            self.open_output(self.wave_file.getnchannels(), self.wave_file.getframerate(),
+                             self.wave_file.getsampwidth())
         except Exception as e:
             print(f"Error opening audio file: {e}")
             self.is_playing = False
             return  # 함수 종료
 
-        self.mixer.setvolume(volume)  # 볼륨 설정
+        if self.wave_file.getnframes() == 0:
+            # 빈 파일은 되감기만 반복하며 CPU를 점유하므로 바로 종료
+            print("Audio file has no frames")
+            self.stop()
+            return
+        if 0 < self.resume_position < self.wave_file.getnframes():
+            self.wave_file.setpos(self.resume_position)
+        # Preprocess.py 가 미리 찾아 둔 반복 구간 (영점 교차에서 끊어 이음새 잡음이 없음)
+        loop = None if is_stream(music_path) else loop_points(music_path)
+        if loop is None or loop[0] >= loop[1]:
+            loop = (0, self.wave_file.getnframes())
+        loop_start, loop_end = loop
+
+        channels = self.wave_file.getnchannels()
+        rate = self.wave_file.getframerate()
+        sampwidth = self.wave_file.getsampwidth()
+        period_size = self.period_size
+        period_time = period_size / rate
+        # 버퍼 상태를 읽을 수 있으면 쓰기 직전에 비어 있었는지로 언더런을 셈
+        check_underrun = (hasattr(self.output, 'state') or hasattr(self.output, 'delay')
+                          or hasattr(self.output, 'avail'))
+        written = False
+        start_at = self.start_at
+        fade_in = self.fade_in
+        level = 0 if fade_in > 0 else volume
+        self.get_mixer().setvolume(level)  # 볼륨 설정
 
-        while self.is_playing:
-            data = self.wave_file.readframes(2048)
+        if start_at is not None:
+            # 장치는 미리 열어둔 채 기다렸다가 시작 시각에 맞춰 재생
+            if self.clock.wait_until(start_at - PRE_ROLL, self.stop_event):
+                self.stop()
+                return
+            try:
+                self.write_silence(start_at, channels, rate, sampwidth)
+            except alsaaudio.ALSAAudioError as e:
+                print(f"ALSA Audio error: {e}")
+                self.stop()
+                return
+        else:
+            start_at = self.clock.now()
+
+        # 새 곡이 지정되면(update_event) 루프를 빠져나가 run 에서 다시 재생
+        while self.is_playing and not self.update_event.is_set():
+            self.position = self.wave_file.tell()
+            count = min(period_size, loop_end - self.position)
+            data = self.wave_file.readframes(count) if count > 0 else b''
             if not data:
                 print("End of audio file reached. Rewinding...")
-                self.wave_file.rewind()  # 파일의 처음으로 되돌리기
+                self.wave_file.setpos(loop_start)  # 반복 구간의 처음으로 되돌리기
                 continue  # 루프를 계속하여 다시 재생
 
+            if fade_in > 0 and level < volume:
+                # 볼륨도 LED 와 같은 시계를 기준으로 올림
+                progress = (self.clock.now() - start_at) / fade_in
+                target = int(volume * min(1.0, max(0.0, progress)))
+                if target != level:
+                    level = target
+                    self.mixer.setvolume(level)
+
             try:
                 if not self.is_playing:
                     break
-                self.output.write(data)
+                if check_underrun and written and self.is_underrun():
+                    self.underruns += 1
+                written = True
+                while self.output.write(data) == 0 and self.is_playing:
+                    # 버퍼가 가득 찬 경우 한 주기만큼 쉬고 같은 데이터를 다시 씀
+                    time.sleep(period_time)
+                if self.taps and sampwidth == 2:
+                    # 복사 없이 같은 S16 버퍼를 넘김. 탭은 절대 블록되면 안 됨
+                    view = memoryview(data)
+                    for tap in self.taps:
+                        tap(view, channels, rate)
             except alsaaudio.ALSAAudioError as e:
+                # 장치 오류는 스레드 밖으로 올려 감시자가 같은 위치에서 재시작하게 함
                 print(f"ALSA Audio error: {e}")
-                self.stop()
-                break
+                raise
+
+        if self.is_playing:
+            # 다른 곡으로 바뀌는 경우: 장치는 열어둔 채 파일만 닫음
+            self.wave_file.close()
+            self.wave_file = None
+            return
 
         # 재생 종료 후 자원 정리
         self.stop()
 
+    def is_failed(self):
+        return self.is_playing and (self.playback_thread is None or not self.playback_thread.is_alive())
+
+    def snapshot(self):
+        return {
+            'path': self.audio_file_path,
+            'position': self.position,
+            'volume': self.volume,
+            'playing': self.is_playing,
+        }
+
+    def restore(self, snapshot):
+        # 죽은 재생 스레드의 자원을 정리하고 저장된 위치부터 다시 재생
+        self.cancel_idle_timer()
+        try:
+            self.close_output()
+        except alsaaudio.ALSAAudioError:
+            self.output = None
+            self.output_params = None
+        if self.wave_file is not None:
+            self.wave_file.close()
+            self.wave_file = None
+        self.failure = None
+        self.is_playing = False
+        self.playback_thread = None
+        if snapshot['playing'] and snapshot['path']:
+            with self.audio_lock:
+                self.audio_file_path = snapshot['path']
+                self.volume = snapshot['volume']
+                self.start_at = None
+                self.fade_in = 0
+                self.resume_position = snapshot['position']
+            self.start()
+            self.update_event.set()
+
     def set_volume(self, vol):
-        if self.mixer:
-            self.mixer.setvolume(vol)
-            print(f'Volume adjusted to {vol}')
-        else:
-            print("Audio is not playing.")
+        self.volume = vol
+        self.get_mixer().setvolume(vol)
+        print(f'Volume adjusted to {vol}')
 
     def stop(self):
         if self.is_playing:
             self.is_playing = False
+            self.stop_event.set()
             self.update_event.set()
 
             if self.output is not None:
-                print("Closing PCM output")
-                self.output.close()
-                time.sleep(0.2)
-                self.output = None
+                if self.idle_timeout > 0:
+                    # 곧 다시 재생될 수 있으므로 장치는 유휴 시간 동안만 열어둠
+                    self.cancel_idle_timer()
+                    self.idle_timer = threading.Timer(self.idle_timeout, self.release_output)
+                    self.idle_timer.daemon = True
+                    self.idle_timer.start()
+                else:
+                    self.close_output()
+                    time.sleep(0.2)
 
             if self.wave_file is not None:
                 print("Closing wave file")
                 self.wave_file.close()
                 time.sleep(0.2)
                 self.wave_file = None
-            
+
             if self.playback_thread is not None:
-                self.playback_thread.join()
+                # 재생 스레드 안에서 호출된 경우 자기 자신을 join 할 수 없음
+                if self.playback_thread is not threading.current_thread():
+                    self.playback_thread.join()
                 self.playback_thread = None
 
             print("Audio stopped")
\ No newline at end of file
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# 사용법(주기당 분석 비용): python AudioReactive.py bench [--period-sizes 512,1024,2048,4096]
+#        (분석이 느려도 오디오가 밀리지 않는지): python AudioReactive.py selftest
+#            [--track ./Alarm/GM.wav] [--analysis-delay 0.2]
+
+import argparse
+import colorsys
+import importlib
+import queue
+import sys
+import threading
+import time
+
+np = None # numpy 는 분석 스레드가 처음 돌 때 불러옴
+
+class AudioReactive:
+    # 재생 중인 음악을 분석해서 LED 밝기(RMS)와 색상(스펙트럼 중심)을 바꿈
+    def __init__(self, player, ledController, zone=None, max_periods=4, frame_interval=0.05):
+        self.player = player
+        self.ledController = ledController
+        self.zone = zone
+        self.frame_interval = frame_interval
+        self.periods = queue.Queue(max_periods)
+        self.dropped = 0
+        self.is_running = False
+        self.analysis_thread = None
+        self.window = None
+        self.level = 0.0
+        self.hue = 0.0
+
+    def start(self):
+        if not self.is_running:
+            self.is_running = True
+            self.analysis_thread = threading.Thread(target=self.run)
+            self.analysis_thread.daemon = True
+            self.analysis_thread.start()
+            self.player.add_tap(self.feed)
+            self.ledController.start()
+
+    def feed(self, view, channels, rate):
+        # 오디오 스레드에서 호출됨. 큐가 가득 차면 기다리지 않고 버림
+        try:
+            self.periods.put_nowait((view, channels, rate))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        last = 0.0
+        while self.is_running:
+            item = self.periods.get()
+            if item is None:
+                break
+            level, hue = self.analyse(*item)
+            # 한 프레임 안에 여러 주기가 오면 부드럽게 섞기만 하고 LED는 한 번만 갱신
+            self.level = 0.6 * self.level + 0.4 * level
+            self.hue = 0.8 * self.hue + 0.2 * hue
+            now = time.monotonic()
+            if now - last >= self.frame_interval:
+                last = now
+                r, g, b = colorsys.hsv_to_rgb(self.hue, 1.0, self.level)
+                self.ledController.update_color(r * 255, g * 255, b * 255, -1, self.zone)
+
+    def analyse(self, view, channels, rate):
+        global np
+        if np is None:
+            np = importlib.import_module('numpy')
+        samples = np.frombuffer(view, dtype='<i2')
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1)
+        else:
+            samples = samples.astype(np.float32)
+        if len(samples) == 0:
+            return 0.0, self.hue
+        samples /= 32768.0
+
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        if self.window is None or len(self.window) != len(samples):
+            self.window = np.hanning(len(samples)).astype(np.float32)
+        spectrum = np.abs(np.fft.rfft(samples * self.window))
+        total = spectrum.sum()
+        if total <= 0:
+            return 0.0, self.hue
+        freqs = np.fft.rfftfreq(len(samples), 1.0 / rate)
+        centroid = float((spectrum * freqs).sum() / total)
+
+        # 50Hz~5kHz 스펙트럼 중심을 로그 스케일로 빨강(0)~파랑(0.66)에 대응
+        hue = np.log10(max(centroid, 50.0) / 50.0) / 2.0 * 0.66
+        return min(1.0, rms * 4.0), min(0.66, float(hue))
+
+    def stop(self):
+        if self.is_running:
+            self.is_running = False
+            self.player.remove_tap(self.feed)
+            try:
+                self.periods.put_nowait(None)
+            except queue.Full:
+                pass
+            if self.analysis_thread is not None:
+                self.analysis_thread.join(1.0)
+                self.analysis_thread = None
+
+
+def bench(period_sizes, iterations, rate=44100, channels=2):
+    # 음악 대신 여러 주파수가 섞인 S16 신호로 analyse 한 번의 시간을 잼
+    global np
+    np = importlib.import_module('numpy')
+    reactive = AudioReactive(None, None)
+    for period_size in period_sizes:
+        t = np.arange(period_size) / rate
+        mono = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 3000 * t)
+        data = (np.repeat(mono, channels) * 32767).astype('<i2').tobytes()
+        view = memoryview(data)
+        reactive.analyse(view, channels, rate) # 창 함수와 numpy 를 미리 준비
+        start = time.perf_counter()
+        for _ in range(iterations):
+            reactive.analyse(view, channels, rate)
+        cost = (time.perf_counter() - start) / iterations
+        period_time = period_size / rate
+        print(f"{period_size:>5} frames ({period_time * 1000:.1f} ms): {cost * 1e6:.0f} us "
+              f"per period, {cost / period_time * 100:.2f}% of real time")
+
+
+def play_for(player, path, seconds):
+    # 재생하는 동안 장치에 쓴 (시각, 프레임 수) 기록을 돌려줌
+    player.start()
+    player.update_music(path, 50)
+    deadline = time.monotonic() + seconds
+    while player.output is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    output = player.output
+    time.sleep(max(0.0, deadline - time.monotonic()))
+    player.stop()
+    return output.writes if output is not None else []
+
+
+def cadence(writes):
+    # 첫 버퍼를 채운 뒤의 초당 프레임 수와 가장 긴 쓰기 간격
+    steady = writes[len(writes) // 4:]
+    if len(steady) < 2:
+        return 0.0, 0.0
+    frames = sum(count for _, count in steady[1:])
+    gap = max(b[0] - a[0] for a, b in zip(steady, steady[1:]))
+    return frames / (steady[-1][0] - steady[0][0]), gap
+
+
+def selftest(path, seconds, analysis_delay):
+    # 분석이 주기보다 훨씬 느려도 재생 속도와 쓰기 간격이 그대로이고 주기만 버려지는지 확인
+    from Components import use_fake_backends, PacedPCM
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController
+    use_fake_backends(PacedPCM)
+    player = AudioPlayer.getInstance()
+    ledController = LEDController.getInstance()
+
+    rate, gap = cadence(play_for(player, path, seconds))
+    print(f"Without analysis: {rate:.0f} frames/sec, longest write gap {gap * 1000:.1f} ms")
+
+    reactive = AudioReactive(player, ledController)
+    analyse = reactive.analyse
+    def slow_analyse(view, channels, rate):
+        time.sleep(analysis_delay)
+        return analyse(view, channels, rate)
+    reactive.analyse = slow_analyse
+    reactive.start()
+    tapped_rate, tapped_gap = cadence(play_for(player, path, seconds))
+    reactive.stop()
+    ledController.stop()
+    print(f"With {analysis_delay * 1000:.0f} ms analysis: {tapped_rate:.0f} frames/sec, "
+          f"longest write gap {tapped_gap * 1000:.1f} ms, {reactive.dropped} periods dropped")
+
+    # 쓰기 간격이 반 주기 넘게 늘어나면 분석이 재생을 붙잡은 것
+    ok = (rate > 0 and abs(tapped_rate - rate) / rate < 0.02
+          and tapped_gap < gap + player.period_size / rate / 2 and reactive.dropped > 0)
+    print("Audio throughput is unaffected" if ok else "Analysis slowed down audio")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['bench', 'selftest'])
+    parser.add_argument('--period-sizes', default='512,1024,2048,4096', help="" +
+                        "period sizes in frames for bench (default: 512,1024,2048,4096)")
+    parser.add_argument('--iterations', default=500, type=int, help="" +
+                        "analyses per period size (default: 500)")
+    parser.add_argument('--track', default='./Alarm/GM.wav', help="WAV " +
+                        "played by selftest (default: ./Alarm/GM.wav)")
+    parser.add_argument('--seconds', default=5, type=float, help="playback " +
+                        "time per selftest run (default: 5)")
+    parser.add_argument('--analysis-delay', default=0.2, type=float, help="" +
+                        "extra seconds the selftest analyser takes per period " +
+                        "(default: 0.2)")
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        bench([int(n) for n in args.period_sizes.split(',')], args.iterations)
+    else:
+        sys.exit(0 if selftest(args.track, args.seconds, args.analysis_delay) else 1)
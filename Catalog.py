@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import wave
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None # 없으면 업로드 알림(update_file)으로만 갱신
+
+KINDS = {'alarm': 'Alarm', 'music': 'SleepMusic'}
+PROCESSED_DIR = './Processed'
+MANIFEST_PATH = os.path.join(PROCESSED_DIR, 'manifest.json')
+IDS_PATH = os.path.join(PROCESSED_DIR, 'ids.json')
+PAGE_SIZE = 10
+
+class Track:
+    def __init__(self, id, kind, name, path, duration, format, loudness):
+        self.id = id
+        self.kind = kind
+        self.name = name
+        self.path = path
+        self.duration = duration
+        self.format = format
+        self.loudness = loudness
+
+    def line(self):
+        loudness = '' if self.loudness is None else f'{self.loudness:.1f}'
+        return f'{self.id},{self.name},{self.kind},{self.duration:.1f},{self.format},{loudness}'
+
+
+class Catalog:
+    # 재생 가능한 트랙 목록. 시작할 때 한 번 만들고 이후에는 바뀐 파일만 갱신
+    def __init__(self, root='.'):
+        self.root = root
+        self.catalog_lock = threading.Lock()
+        self.by_id = {}
+        self.by_name = {}
+        self.ids = {}
+        self.next_id = 1
+        self.watch_thread = None
+        self.inotify = None
+        self.load()
+
+    def load(self):
+        with self.catalog_lock:
+            self.by_id = {}
+            self.by_name = {}
+        try:
+            with open(os.path.join(self.root, IDS_PATH)) as f:
+                self.ids = json.load(f)
+        except (OSError, ValueError):
+            self.ids = {}
+        self.next_id = max(self.ids.values(), default=0) + 1
+        known = len(self.ids)
+
+        try:
+            with open(os.path.join(self.root, MANIFEST_PATH)) as f:
+                manifest = json.load(f).get('tracks', {})
+        except (OSError, ValueError):
+            manifest = {}
+
+        processed = set()
+        for source, entry in manifest.items():
+            kind = self.kind_of(source)
+            if kind is None or not os.path.exists(entry['output']):
+                continue
+            # 같은 이름의 원본이 여럿이면 Preprocess.py 가 변환본 이름에 확장자를 붙임
+            name = os.path.splitext(os.path.basename(entry['output']))[0]
+            self.add(kind, name, entry['output'], entry['duration'],
+                     f"{entry['rate']}/{entry['channels']}/{entry['format']}", entry['loudness'])
+            processed.add((kind, name))
+
+        # 아직 변환하지 않은 원본 파일은 WAV 헤더만 읽어서 추가
+        for kind, directory in KINDS.items():
+            path = os.path.join(self.root, directory)
+            if not os.path.isdir(path):
+                continue
+            for entry in sorted(os.listdir(path)):
+                name, ext = os.path.splitext(entry)
+                if ext.lower() == '.wav' and not entry.startswith('.') and (kind, name) not in processed:
+                    self.update_file(os.path.join(path, entry))
+        if len(self.ids) != known:
+            self.save_ids()
+        print(f"Catalog loaded: {len(self.by_id)} tracks")
+
+    def kind_of(self, path):
+        directory = os.path.basename(os.path.dirname(os.path.normpath(path)))
+        for kind, name in KINDS.items():
+            if name == directory:
+                return kind
+        return None
+
+    def track_id(self, kind, name):
+        key = f'{kind}/{name}'
+        if key not in self.ids:
+            self.ids[key] = self.next_id
+            self.next_id += 1
+        return self.ids[key]
+
+    def save_ids(self):
+        os.makedirs(os.path.join(self.root, PROCESSED_DIR), exist_ok=True)
+        path = os.path.join(self.root, IDS_PATH)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.ids, f)
+        os.replace(path + '.tmp', path)
+
+    def add(self, kind, name, path, duration, format, loudness=None):
+        with self.catalog_lock:
+            track = Track(self.track_id(kind, name), kind, name, path, duration, format, loudness)
+            self.by_id[track.id] = track
+            self.by_name[(kind, name)] = track
+        return track
+
+    def remove(self, kind, name):
+        with self.catalog_lock:
+            track = self.by_name.pop((kind, name), None)
+            if track is not None:
+                self.by_id.pop(track.id, None)
+
+    def update_file(self, path):
+        # 파일 하나가 생기거나 바뀌었을 때 그 항목만 다시 읽음
+        # (새로 올린 원본은 Preprocess.py 를 다시 돌리기 전까지 원본으로 재생)
+        kind = self.kind_of(path)
+        name, ext = os.path.splitext(os.path.basename(path))
+        if kind is None or ext.lower() != '.wav' or name.startswith('.'):
+            return None
+        try:
+            with wave.open(path, 'rb') as w:
+                duration = w.getnframes() / w.getframerate()
+                sample = 'U8' if w.getsampwidth() == 1 else f'S{8 * w.getsampwidth()}_LE'
+                format = f'{w.getframerate()}/{w.getnchannels()}/{sample}'
+        except (OSError, EOFError, wave.Error) as e:
+            print(f"Skipping {path}: {e}")
+            return None
+        is_new = f'{kind}/{name}' not in self.ids
+        track = self.add(kind, name, path, duration, format)
+        if is_new:
+            self.save_ids()
+        return track
+
+    def get(self, track_id):
+        return self.by_id.get(track_id)
+
+    def find(self, kind, name):
+        return self.by_name.get((kind, name))
+
+    def page(self, number):
+        # "페이지/전체페이지" 다음 줄부터 한 줄에 트랙 하나씩
+        tracks = sorted(self.by_id.values(), key=lambda t: t.id)
+        pages = max(1, (len(tracks) + PAGE_SIZE - 1) // PAGE_SIZE)
+        rows = tracks[number * PAGE_SIZE:(number + 1) * PAGE_SIZE]
+        return '\n'.join([f'{number}/{pages}'] + [t.line() for t in rows]).encode('utf-8')
+
+    def watch(self):
+        # inotify 로 폴더를 지켜보며 다시 훑지 않고 바뀐 파일만 반영
+        if inotify_simple is None or self.watch_thread is not None:
+            return
+        flags = inotify_simple.flags
+        self.inotify = inotify_simple.INotify()
+        self.watches = {}
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+        for directory in list(KINDS.values()) + [PROCESSED_DIR]:
+            path = os.path.join(self.root, directory)
+            if os.path.isdir(path):
+                self.watches[self.inotify.add_watch(path, mask)] = path
+        self.watch_thread = threading.Thread(target=self.run)
+        self.watch_thread.daemon = True
+        self.watch_thread.start()
+
+    def run(self):
+        flags = inotify_simple.flags
+        while True:
+            for event in self.inotify.read():
+                path = os.path.join(self.watches.get(event.wd, ''), event.name)
+                if os.path.normpath(path) == os.path.normpath(os.path.join(self.root, MANIFEST_PATH)):
+                    if event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                        self.load() # Preprocess.py 가 다시 돌았음
+                elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    kind = self.kind_of(path)
+                    track = self.find(kind, os.path.splitext(event.name)[0])
+                    if track is not None and track.path == path:
+                        self.remove(kind, track.name)
+                else:
+                    self.update_file(path)
\ No newline at end of file
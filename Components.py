@@ -0,0 +1,404 @@
+#!/usr/bin/python
+# 데몬의 구성요소(오디오, LED, 타이머, 감시자 ...)를 한 곳에서 만들고 시작/정지
+# 사용법(자원 누수 확인): python Components.py soak [--cycles 100000]
+#        (쉬는 동안의 전력): python Components.py idle [--seconds 60]
+#        (시작 시간): python Components.py startup [--timeout 10]
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+# 데몬이 시작할 때 불러오면 안 되는 무거운 표준 모듈 (쓸 때만 불러옴)
+DEFERRED_MODULES = ('http.server', 'socketserver', 'multiprocessing', 'concurrent.futures')
+
+
+def resource_usage():
+    # 스레드 수, 열린 파일 디스크립터 수, 상주 메모리(바이트). 읽을 수 없으면 None
+    usage = {'threads': threading.active_count(), 'fds': None, 'rss': None}
+    try:
+        usage['fds'] = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            usage['rss'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def context_switches():
+    # 이 프로세스의 모든 스레드가 문맥 전환된 횟수 (깨어난 횟수에 가까움)
+    switches = 0
+    try:
+        tasks = os.listdir('/proc/self/task')
+    except OSError:
+        return 0
+    for task in tasks:
+        try:
+            with open(f'/proc/self/task/{task}/status') as status:
+                for line in status:
+                    if 'ctxt_switches:' in line:
+                        switches += int(line.split(':')[1])
+        except OSError:
+            pass
+    return switches
+
+
+def format_usage(usage):
+    rss = '?' if usage['rss'] is None else usage['rss'] // 1024
+    return f"{usage['threads']} threads, {usage['fds']} fds, {rss} kB RSS"
+
+
+class Container:
+    # 이름으로 등록한 구성요소를 처음 쓸 때 한 번만 만들고, 만든 순서의 역순으로 정지
+    # 정지한 구성요소는 잊으므로 다음 get 에서 다시 만듦
+    def __init__(self):
+        self.lock = threading.RLock() # 만드는 중에 다른 구성요소를 get 할 수 있음
+        self.factories = {}
+        self.instances = {}
+        self.created = []
+
+    def register(self, name, factory, start=None, stop='stop'):
+        # start/stop: 시작/정지할 때 부를 메서드 이름 (None 이면 부르지 않음)
+        with self.lock:
+            self.factories[name] = (factory, start, stop)
+
+    def get(self, name):
+        with self.lock:
+            instance = self.instances.get(name)
+            if instance is None:
+                factory, start, _ = self.factories[name]
+                instance = factory()
+                self.instances[name] = instance
+                self.created.append(name)
+                if start is not None:
+                    getattr(instance, start)()
+            return instance
+
+    def stop_all(self):
+        with self.lock:
+            stopping = [(name, self.instances.pop(name)) for name in reversed(self.created)]
+            self.created = []
+        for name, instance in stopping:
+            stop = self.factories[name][2]
+            if stop is None:
+                continue
+            try:
+                getattr(instance, stop)()
+            except Exception as e:
+                print(f"Failed to stop {name}: {e}")
+
+    def report(self):
+        return f"{len(self.instances)} components, {format_usage(resource_usage())}"
+
+
+class FakePCM:
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class PacedPCM(FakePCM):
+    # 실제 장치처럼 버퍼(periodsize x periods)가 차 있으면 재생 속도에 맞춰 기다림
+    # pyalsaaudio 처럼 delay() 는 없고 avail()/info() 로 남은 양을 알려 줌
+    def __init__(self, *args, **kwargs):
+        FakePCM.__init__(self)
+        self.rate = kwargs.get('rate', 44100)
+        self.channels = kwargs.get('channels', 2)
+        self.buffer_size = kwargs.get('periodsize', 2048) * kwargs.get('periods', 4)
+        self.ends_at = time.monotonic() # 버퍼에 쓴 소리가 모두 나오는 시각
+        self.writes = [] # (시각, 프레임 수)
+        self.underruns = 0
+
+    def setchannels(self, channels):
+        self.channels = channels
+
+    def setrate(self, rate):
+        self.rate = rate
+
+    def setformat(self, format):
+        pass
+
+    def setperiodsize(self, period_size):
+        self.buffer_size = period_size * 4
+
+    def queued(self):
+        return max(0.0, self.ends_at - time.monotonic()) * self.rate
+
+    def avail(self):
+        return int(self.buffer_size - self.queued())
+
+    def info(self):
+        return {'buffer_size': self.buffer_size}
+
+    def write(self, data):
+        frames = len(data) // (2 * self.channels)
+        now = time.monotonic()
+        if self.writes and self.ends_at < now:
+            self.underruns += 1
+        self.ends_at = max(self.ends_at, now)
+        while self.buffer_size - self.queued() < frames:
+            time.sleep(0.002)
+        self.ends_at += frames / self.rate
+        self.writes.append((time.monotonic(), frames))
+        return frames
+
+
+class FakeMixer:
+    def __init__(self, *args):
+        self.level = 0
+
+    def setvolume(self, level):
+        self.level = level
+
+
+class FakeNeoPixel(list):
+    def __init__(self, pin, count, auto_write=True, pixel_order=None):
+        list.__init__(self, [(0, 0, 0)] * count)
+
+    def show(self):
+        pass
+
+    def deinit(self):
+        pass
+
+
+def use_fake_backends(pcm=FakePCM):
+    # 하드웨어 없이 돌릴 수 있도록 지연 로딩되는 모듈 자리에 가짜를 넣음
+    # pcm=PacedPCM 이면 오디오가 실제 재생 속도로 나감
+    import types
+    import AudioPlayer
+    import LEDController
+    alsaaudio = types.SimpleNamespace(
+        PCM=pcm, Mixer=FakeMixer, ALSAAudioError=OSError, PCM_PLAYBACK=0,
+        PCM_FORMAT_U8=1, PCM_FORMAT_S16_LE=2, PCM_FORMAT_S24_3LE=3, PCM_FORMAT_S32_LE=4)
+    AudioPlayer.alsaaudio = alsaaudio
+    LEDController.board = types.SimpleNamespace(D18='D18', D21='D21')
+    LEDController.neopixel = types.SimpleNamespace(NeoPixel=FakeNeoPixel, RGB='RGB', GRB='GRB')
+
+
+def soak(cycles, track_every, path):
+    # RaemIoT.py 처럼 Container 로 구성요소를 만들고 stop_all 로 정지하기를 반복해도
+    # 스레드, fd, 메모리가 늘지 않는지 확인
+    use_fake_backends()
+    from AlarmTimeline import AlarmTimeline
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController
+    from MediaClock import MediaClock
+    from SleepTimer import SleepTimer
+    from Supervisor import Supervisor
+    clock = MediaClock.getInstance()
+    components = Container()
+
+    def make_supervisor():
+        supervisor = Supervisor(0)
+        supervisor.watch('audio', components.get('audio'))
+        supervisor.watch('led', components.get('led'))
+        return supervisor
+
+    components.register('audio', AudioPlayer.getInstance)
+    components.register('led', LEDController.getInstance)
+    components.register('sleepTimer',
+            lambda: SleepTimer(components.get('audio'), components.get('led'), clock),
+            stop='cancel')
+    components.register('alarmTimeline',
+            lambda: AlarmTimeline(components.get('audio'), components.get('led'), clock),
+            stop='cancel')
+    components.register('supervisor', make_supervisor, start='start')
+
+    warm_up = min(1000, cycles // 10)
+    baseline = None
+    start = time.monotonic()
+    for i in range(cycles):
+        player = components.get('audio')
+        ledController = components.get('led')
+        components.get('supervisor')
+        ledController.start()
+        ledController.update_color(i % 256, 0, 255 - i % 256, -1)
+        player.start()
+        player.set_volume(i % 100)
+        if path and i % track_every == 0:
+            # 알람과 수면 타이머도 걸어 둔 채로 정지 (둘 다 스레드를 가짐)
+            components.get('alarmTimeline').schedule(60, 1, 255, 0, 0, path, 50)
+            components.get('sleepTimer').start(1)
+            player.update_music(path, 50)
+            time.sleep(0.05) # 파일과 장치를 실제로 열 때까지 재생
+        components.stop_all()
+        if i + 1 == warm_up:
+            baseline = resource_usage()
+            print(f"After {warm_up} cycles: {format_usage(baseline)}")
+    final = resource_usage()
+    elapsed = time.monotonic() - start
+    print(f"After {cycles} cycles ({elapsed:.0f} s): {format_usage(final)}")
+    if baseline is None:
+        return True
+    growth = (final['rss'] or 0) - (baseline['rss'] or 0)
+    ok = final['threads'] <= baseline['threads'] and final['fds'] <= baseline['fds'] \
+        and growth < 4 * 1024 * 1024
+    print(f"RSS growth {growth // 1024} kB: " + ("resource use is flat" if ok else "resources leak"))
+    return ok
+
+
+def idle(seconds, path, watchdog):
+    # --low-power 에서 명령을 처리한 뒤 쉬는 동안의 깨어남 횟수와 CPU 시간
+    # 목표는 둘 다 0 에 가까운 것: 타이머도, 열린 장치도, 켜진 스트립도 없어야 함
+    use_fake_backends()
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController
+    from Supervisor import Supervisor
+    player = AudioPlayer.getInstance()
+    ledController = LEDController.getInstance()
+    supervisor = Supervisor(watchdog)
+    supervisor.watch('audio', player)
+    supervisor.watch('led', ledController)
+    supervisor.start()
+    player.idle_timeout = 1
+
+    # 명령 몇 개: 1초 페이드 인, 잠깐 재생, 페이드 아웃
+    ledController.start()
+    ledController.update_color(255, 128, 0, 10)
+    if path:
+        player.start()
+        player.update_music(path, 50)
+    time.sleep(1.0)
+    player.stop()
+    ledController.update_color(0, 0, 0, 10)
+    time.sleep(2.0) # 페이드 아웃과 장치를 닫는 유휴 시간이 지나도록 기다림
+
+    start, cpu, switches = time.monotonic(), time.process_time(), context_switches()
+    time.sleep(seconds)
+    elapsed = time.monotonic() - start
+    # 이 스레드가 sleep 에서 깨어난 1회는 빼고 셈
+    wakeups = max(0, context_switches() - switches - 1)
+    cpu = time.process_time() - cpu
+    print(f"Idle {elapsed:.0f} s: {wakeups / elapsed:.2f} wakeups/sec, "
+          f"{cpu * 3600 / elapsed:.3f} CPU sec per idle hour, "
+          f"PCM {'open' if player.output is not None else 'closed'}, "
+          f"{len(ledController.strips)} strips on")
+    supervisor.stop()
+    ledController.stop()
+
+
+def import_times(modules):
+    # python -X importtime 으로 modules 를 불러오는 데 걸린 시간. {모듈: 자신의 시간(us)}, 오류
+    import re
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import ' + ', '.join(modules)],
+                            cwd=here, capture_output=True, text=True)
+    times = {}
+    error = None
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \| ( *)(\S+)', line)
+        if match:
+            times[match.group(3)] = int(match.group(1))
+        elif line.strip():
+            error = line.strip()
+    return times, error if result.returncode else None
+
+
+def daemon_imports(path='RaemIoT.py'):
+    # RaemIoT.py 가 맨 위에서 불러오는 모듈 (프로젝트 모듈, 표준 라이브러리가 아닌 외부 패키지)
+    import ast
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, path)) as f:
+        tree = ast.parse(f.read())
+    nodes = []
+    for node in tree.body:
+        # try: import ... except ImportError: 로 고른 모듈도 포함
+        nodes.extend(node.body if isinstance(node, ast.Try) else [node])
+    local, external = [], []
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module != '__future__':
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            package = name.split('.')[0]
+            if os.path.exists(os.path.join(here, name + '.py')):
+                local.append(name)
+            elif package not in sys.stdlib_module_names and package not in external:
+                external.append(package)
+    return local, external
+
+
+def startup(timeout):
+    # 데몬을 불러오는 시간(-X importtime)과 실행해서 광고가 등록될 때까지의 시간
+    import re
+    import subprocess
+    local, external = daemon_imports()
+    times, error = import_times(local)
+    if error:
+        print(f"Importing the daemon modules failed: {error}")
+        return False
+    slowest = sorted(times.items(), key=lambda item: -item[1])[:5]
+    print(f"Daemon modules: {len(times)} imported in {sum(times.values()) / 1000:.1f} ms; slowest " +
+          ', '.join(f"{name} {us / 1000:.1f} ms" for name, us in slowest))
+    for name in external:
+        module_times, error = import_times([name])
+        if error:
+            print(f"{name}: not installed")
+        else:
+            print(f"{name}: {sum(module_times.values()) / 1000:.1f} ms")
+    loaded = [name for name in DEFERRED_MODULES if name in times]
+    print("Deferred modules loaded at start-up: " + (', '.join(loaded) or 'none'))
+
+    # 광고 등록은 BlueZ 가 있어야 하므로 없으면 건너뜀
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.monotonic()
+    daemon = subprocess.Popen([sys.executable, '-u', 'RaemIoT.py', '--timeout', str(timeout)],
+                              cwd=here, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True)
+    registered = None
+    last = ''
+    for line in daemon.stdout:
+        match = re.match(r'Advertisement registered ([\d.]+)s after start', line)
+        if match:
+            registered = float(match.group(1))
+            print(f"Advertisement registered {registered:.2f} s after exec "
+                  f"({time.monotonic() - start:.2f} s wall clock)")
+            break
+        if line.strip():
+            last = line.strip()
+    daemon.stdout.close()
+    daemon.wait()
+    if registered is None:
+        print(f"No advertisement registered (BlueZ not available?): {last}")
+    return not loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['soak', 'idle', 'startup'])
+    parser.add_argument('--cycles', default=100000, type=int, help="" +
+                        "start/update/stop cycles (default: 100000)")
+    parser.add_argument('--track', default='./Alarm/alarm.wav', help="WAV " +
+                        "played every --track-every cycles, ''=never " +
+                        "(default: ./Alarm/alarm.wav)")
+    parser.add_argument('--track-every', default=1000, type=int, help="" +
+                        "cycles between track plays (default: 1000)")
+    parser.add_argument('--seconds', default=60, type=float, help="idle " +
+                        "time to measure (default: 60)")
+    parser.add_argument('--watchdog', default=0, type=int, help="supervisor " +
+                        "check interval while idle, 0=off (default: 0)")
+    parser.add_argument('--timeout', default=10, type=int, help="startup: " +
+                        "seconds the daemon advertises before it exits (default: 10)")
+    args = parser.parse_args()
+
+    if args.command == 'idle':
+        idle(args.seconds, args.track, args.watchdog)
+    elif args.command == 'startup':
+        sys.exit(0 if startup(args.timeout) else 1)
+    else:
+        sys.exit(0 if soak(args.cycles, args.track_every, args.track) else 1)
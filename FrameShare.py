@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# LEDController 가 가진 스트립에 다른 프로그램이 프레임을 보내는 공유 메모리
+# 사용법(프레임 생산 속도 측정): python FrameShare.py D18 --seconds 5 [--rate 60]
+
+import argparse
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+# 배치: 헤더 + 슬롯 2개. 슬롯 = 슬롯 헤더 + 픽셀 x 3 바이트 (스트립 바이트 순서 그대로)
+# 헤더: 픽셀 수(I)
+# 슬롯 헤더: 순번(I) 게시 시각(d, time.monotonic). 순번이 홀수이면 생산자가 쓰는 중
+# (seqlock: 읽는 쪽은 복사 전후의 순번이 같고 짝수일 때만 받아들임)
+HEADER = struct.Struct('<I4x')
+SLOT = struct.Struct('<I4xd')
+STALE_AFTER = 2.0 # 이 시간 동안 새 프레임이 없으면 생산자가 멈춘 것으로 봄
+
+
+def share_name(pin):
+    return f'raem_led_{pin}'
+
+
+def slot_size(pixels):
+    # 순번을 4바이트 경계에 두어 한 번에 읽고 쓰이게 함
+    return SLOT.size + (pixels * 3 + 7) // 8 * 8
+
+
+def attach(name):
+    # 붙기만 하는 쪽에서 종료할 때 resource_tracker 가 공유 메모리를 지우지 않도록 함
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError: # 3.13 이전
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class FrameShare:
+    # 컨트롤러 쪽. 공유 메모리를 만들고 가장 최근에 게시된 프레임을 읽음
+    def __init__(self, pin, pixels):
+        self.pin = pin
+        self.pixels = pixels
+        size = HEADER.size + 2 * slot_size(pixels)
+        try:
+            self.shm = shared_memory.SharedMemory(name=share_name(pin), create=True, size=size)
+        except FileExistsError:
+            # 이전 실행이 지우지 못하고 남긴 것: 지우고 새로 만듦
+            stale = shared_memory.SharedMemory(name=share_name(pin))
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=share_name(pin), create=True, size=size)
+        HEADER.pack_into(self.shm.buf, 0, pixels)
+        for slot in range(2):
+            SLOT.pack_into(self.shm.buf, HEADER.size + slot * slot_size(pixels), 0, 0.0)
+        self.seen = 0
+        self.frame = None
+        self.published = 0.0
+        self.received = 0
+        self.torn = 0 # 복사하는 동안 생산자가 덮어써서 버린 횟수
+
+    def read(self):
+        # 새 프레임이 있으면 복사해 두고, 생산자가 멈췄으면 None
+        buf = self.shm.buf
+        newest = None
+        for slot in range(2):
+            offset = HEADER.size + slot * slot_size(self.pixels)
+            sequence, published = SLOT.unpack_from(buf, offset)
+            if sequence % 2 == 0 and sequence != 0 and (newest is None or published > newest[2]):
+                newest = (offset, sequence, published)
+        if newest is not None and newest[1] != self.seen:
+            offset, sequence, published = newest
+            start = offset + SLOT.size
+            frame = bytes(buf[start:start + self.pixels * 3])
+            # 복사 전후의 순번이 같아야 그동안 아무도 쓰지 않은 것
+            if struct.unpack_from('<I', buf, offset)[0] == sequence:
+                self.frame = frame
+                self.seen = sequence
+                self.published = published
+                self.received += 1
+            else:
+                self.torn += 1
+        if self.frame is None or time.monotonic() - self.published > STALE_AFTER:
+            return None
+        return self.frame
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameProducer:
+    # 생산자 쪽. back() 에 직접 쓰고 publish() 로 게시함 (복사 없음)
+    def __init__(self, pin):
+        self.shm = attach(share_name(pin))
+        self.pixels = HEADER.unpack_from(self.shm.buf, 0)[0]
+        self.slots = [HEADER.size + slot * slot_size(self.pixels) for slot in range(2)]
+        sequences = [SLOT.unpack_from(self.shm.buf, offset)[0] for offset in self.slots]
+        # 이전 생산자가 남긴 순번에 이어서 씀 (쓰다 멈춘 홀수 슬롯은 게시된 것이 아님)
+        self.sequence = (max(sequences) + 1) // 2 * 2
+        published = [sequence if sequence % 2 == 0 else -1 for sequence in sequences]
+        self.front = published.index(max(published))
+        self.writing = False
+
+    def back(self):
+        # 게시되지 않은 슬롯을 쓰는 중(홀수)으로 표시한 뒤 넘김
+        offset = self.slots[1 - self.front]
+        if not self.writing:
+            self.writing = True
+            struct.pack_into('<I', self.shm.buf, offset, self.sequence + 1)
+        start = offset + SLOT.size
+        return self.shm.buf[start:start + self.pixels * 3]
+
+    def publish(self):
+        if not self.writing:
+            self.back().release()
+        self.front = 1 - self.front
+        self.sequence += 2
+        offset = self.slots[self.front]
+        # 시각을 먼저 쓰고 순번(짝수)을 마지막에 써서 읽는 쪽이 완성된 슬롯만 보게 함
+        struct.pack_into('<d', self.shm.buf, offset + 8, time.monotonic())
+        struct.pack_into('<I', self.shm.buf, offset, self.sequence)
+        self.writing = False
+
+    def close(self):
+        self.shm.close()
+
+
+def benchmark(pin, seconds, rate):
+    producer = FrameProducer(pin)
+    pixels = producer.pixels
+    interval = 1.0 / rate if rate > 0 else 0
+    start = time.monotonic()
+    frames = 0
+    while time.monotonic() - start < seconds:
+        # 한 픽셀짜리 빛이 스트립을 따라 움직임
+        back = producer.back()
+        back[:] = bytes(pixels * 3)
+        lit = frames % pixels * 3
+        back[lit:lit + 3] = b'\x40\x40\x40'
+        back.release()
+        producer.publish()
+        frames += 1
+        if interval:
+            time.sleep(max(0, start + frames * interval - time.monotonic()))
+    elapsed = time.monotonic() - start
+    producer.close()
+    print(f"Published {frames} frames of {pixels} pixels in {elapsed:.1f} s: {frames / elapsed:.0f} frames/sec")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pin', help="strip pin shared by RaemIoT.py " +
+                        "--share-frames, e.g. D18")
+    parser.add_argument('--seconds', default=5, type=float, help="run " +
+                        "for this many seconds (default: 5)")
+    parser.add_argument('--rate', default=0, type=float, help="frames per " +
+                        "second to publish, 0=as fast as possible (default: 0)")
+    args = parser.parse_args()
+
+    benchmark(args.pin, args.seconds, args.rate)
@@ -1,81 +1,379 @@
+#!/usr/bin/python
+# 사용법(렌더 시간 측정): python LEDController.py [--zones 1,2,4,8] [--pixels 30,150,300]
+
+import argparse
+import bisect
+import importlib
 import threading
 import time
-import board
-import neopixel
+from MediaClock import MediaClock
+from Realtime import IntervalStats
+
+# board/neopixel 은 처음 스트립을 열 때 불러와서 데몬 시작을 늦추지 않음
+board = None
+neopixel = None
+
+def load_neopixel():
+    global board, neopixel
+    if neopixel is None:
+        board = importlib.import_module('board')
+        neopixel = importlib.import_module('neopixel')
+    return neopixel
+
+FRAME_INTERVAL = 0.1
+SHARE_IDLE_POLL = 0.25 # 공유 프레임을 쓰는 생산자가 없을 때 확인하는 간격
+
+class LEDZone:
+    # 하나의 스트립(pin) 안의 픽셀 구간과 그 구간의 페이드 상태
+    def __init__(self, name, pin, start, count, pixel_order='GRB'):
+        self.name = name
+        self.pin = pin
+        self.start = start
+        self.count = count
+        self.pixel_order = pixel_order.upper()
+        self.order = tuple('RGB'.index(c) for c in self.pixel_order)
+        self.color = (0.0, 0.0, 0.0)
+        self.source = (0.0, 0.0, 0.0)
+        self.target = (0.0, 0.0, 0.0)
+        self.fade_start = 0.0
+        self.fade_end = 0.0
+        self.table = None # 미리 계산한 (시각 목록, 색 목록)
+
+    def fade_to(self, r, g, b, start, end):
+        # start~end(미디어 시계 기준) 동안 현재 색에서 목표 색으로 변경
+        self.table = None
+        self.source = self.color
+        self.target = (r, g, b)
+        self.fade_start = start
+        self.fade_end = end
+        if end <= start: # 바로 변경
+            self.color = self.target
+
+    def play_table(self, times, colors):
+        # 프레임마다 계산하지 않고 표에서 색을 찾음. times[0] 전까지는 지금 색 유지
+        self.source = self.color
+        self.target = tuple(colors[-1])
+        self.fade_start = times[0]
+        self.fade_end = times[-1]
+        self.table = (times, colors)
+
+    def advance(self, now):
+        # 현재 시각의 색을 계산하고 다음에 그려야 할 시각을 반환 (페이드가 끝났으면 None)
+        if self.table is not None:
+            times, colors = self.table
+            if now < times[0]:
+                return times[0]
+            i = bisect.bisect_right(times, now) - 1
+            self.color = tuple(colors[i])
+            if i + 1 < len(times):
+                return times[i + 1]
+            self.table = None
+            return None
+        if now >= self.fade_end:
+            self.color = self.target
+            return None
+        if now < self.fade_start:
+            return self.fade_start
+        progress = (now - self.fade_start) / (self.fade_end - self.fade_start)
+        self.color = tuple(s + (t - s) * progress for s, t in zip(self.source, self.target))
+        # 프레임은 시작 시각 기준 격자에 맞춰 그려서 누적 오차가 없게 함
+        frame = int((now - self.fade_start) / FRAME_INTERVAL) + 1
+        if self.fade_start + frame * FRAME_INTERVAL <= now:
+            frame += 1 # 격자 위의 시각에서 반올림 오차로 같은 시각을 돌려주지 않게 함
+        return min(self.fade_end, self.fade_start + frame * FRAME_INTERVAL)
+
+    def pixel(self):
+        # 스트립에는 바이트 순서 그대로 쓰고, 색 순서는 구간마다 여기서 맞춤
+        color = tuple(int(c) for c in self.color)
+        return tuple(color[i] for i in self.order)
+
+    def end(self):
+        return self.start + self.count
+
+    def snapshot(self):
+        return (self.color, self.source, self.target, self.fade_start, self.fade_end)
+
+    def restore(self, snapshot):
+        self.color, self.source, self.target, self.fade_start, self.fade_end = snapshot
+
 
 class LEDController:
     _instance = None
+    _lock = threading.Lock()
 
     @staticmethod
-    def getInstance() :
-        if LEDController._instance is None:
-            return LEDController()
-        else :
+    def getInstance():
+        # 여러 스레드가 동시에 불러도 하나만 만들고, 만든 것을 계속 돌려줌
+        with LEDController._lock:
+            if LEDController._instance is None:
+                LEDController._instance = LEDController()
             return LEDController._instance
-        
+
     def __init__(self):
         if LEDController._instance is not None:
             raise Exception("LEDController is a Singleton Class")
         else:
-            self.red = 0.0
-            self.green = 0.0
-            self.blue = 0.0
-            self.steps = 0
             self.is_running = False
             self.light_thread = None
             self.update_event = threading.Event()
             self.light_lock = threading.Lock()
-    
+            self.zones = {}
+            self.strips = {}
+            self.clock = MediaClock.getInstance()
+            self.failure = None
+            self.on_failure = None
+            self.capture = None # TraceWriter 를 넣으면 내보내는 프레임을 모두 기록
+            self.realtime = None # Realtime 설정을 넣으면 렌더 스레드에 적용
+            self.frame_stats = IntervalStats() # 페이드 중 프레임 간격 (지터 측정용)
+            self.shares = {} # pin -> FrameShare, 다른 프로그램이 보내는 프레임
+            self.share_interval = 0.0
+            self.add_zone('all', 'D18', 0, 30)
+
+    def add_zone(self, name, pin, start, count, pixel_order='GRB'):
+        with self.light_lock:
+            self.zones[name] = LEDZone(name, pin, start, count, pixel_order)
+
+    def configure_zones(self, specs):
+        # specs: "name:pin:start:count[:order]" 문자열 목록. 기본 구간을 대체함
+        with self.light_lock:
+            self.zones = {}
+        for spec in specs:
+            fields = spec.split(':')
+            order = fields[4] if len(fields) > 4 else 'GRB'
+            self.add_zone(fields[0], fields[1], int(fields[2]), int(fields[3]), order)
+
+    def share_frames(self, fps=30):
+        # 스트립마다 공유 메모리 프레임을 열어 두고, 생산자가 있으면 fps 로 합성해 내보냄
+        from FrameShare import FrameShare # multiprocessing 은 공유할 때만 불러옴
+        with self.light_lock:
+            lengths = {}
+            for zone in self.zones.values():
+                lengths[zone.pin] = max(lengths.get(zone.pin, 0), zone.end())
+            for pin, length in lengths.items():
+                if pin not in self.shares:
+                    self.shares[pin] = FrameShare(pin, length)
+            self.share_interval = 1.0 / fps
+        self.update_event.set()
+
+    def unshare_frames(self):
+        with self.light_lock:
+            for share in self.shares.values():
+                print(f"Shared frames on {share.pin}: {share.received} received, {share.torn} torn copies dropped")
+                share.close()
+            self.shares = {}
+
     def start(self):
         if not self.is_running:
             self.is_running = True
             self.light_thread = threading.Thread(target=self.run)
             self.light_thread.daemon = True
             self.light_thread.start()
-    
+
     def run(self):
-        while self.is_running:
-            self.update_event.wait()
+        # 모든 구간을 하나의 루프에서 그림. 페이드 중일 때만 프레임마다 깨어남
+        if self.realtime is not None:
+            self.realtime.apply('LED')
+        try:
+            while self.is_running:
+                self.update_event.wait(SHARE_IDLE_POLL if self.shares else None)
+                self.update_event.clear()
+                while self.is_running:
+                    now = self.clock.now()
+                    self.frame_stats.add(now)
+                    with self.light_lock:
+                        deadline = self.render(now)
+                    if deadline is None:
+                        self.frame_stats.reset_gap()
+                        break
+                    if self.clock.wait_until(deadline, self.update_event):
+                        self.update_event.clear()
+            # 종료 직전에 마지막 상태(보통 꺼짐)를 반영
             with self.light_lock:
-                self.controllerLED(self.red, self.green, self.blue, self.steps)
-            self.update_event.clear()
-
-    def controllerLED(self, r, g, b, steps):
-        if steps > -1 : # -1이 아니면 점진적으로 켜짐
-            stepRed = r/steps
-            stepGreen = g/steps
-            stepBlue = b/steps
-
-            currentRed, currentGreen, currentBlue = 0.0000, 0.0000, 0.0000
-            for _ in range(steps):
-                currentRed += stepRed
-                currentGreen += stepGreen
-                currentBlue += stepBlue
-
-                pixels=neopixel.NeoPixel(board.D18, 30)
-                pixels.fill((currentRed, currentGreen, currentBlue))
-                pixels.show()
-
-                time.sleep(0.1)
-
-        else: # -1이면 바로 켜짐
-            pixels=neopixel.NeoPixel(board.D18, 30)
-            pixels.fill((r, g, b))
-            pixels.show()
-    
-
-    def update_color(self, r, g, b, steps):
+                self.render(self.clock.now())
+        except Exception as e:
+            # is_running 은 그대로 두어 감시자가 실패로 판단하고 재시작하게 함
+            print(f"LED thread failed: {e}")
+            self.failure = e
+            if self.on_failure is not None:
+                self.on_failure(self)
+
+    def warm_up(self):
+        try:
+            load_neopixel()
+        except Exception as e:
+            print(f"LED warm-up failed: {e}")
+
+    def get_strip(self, pin, length):
+        strip = self.strips.get(pin)
+        if strip is None or len(strip) < length:
+            if strip is not None:
+                strip.deinit()
+            load_neopixel()
+            strip = neopixel.NeoPixel(getattr(board, pin), length,
+                                      auto_write=False, pixel_order=neopixel.RGB)
+            self.strips[pin] = strip
+        return strip
+
+    def render(self, now):
+        deadline = None
+        frames = {}
+        for zone in self.zones.values():
+            next_frame = zone.advance(now)
+            if next_frame is not None and (deadline is None or next_frame < deadline):
+                deadline = next_frame
+            frame = frames.get(zone.pin)
+            if frame is None:
+                frame = frames[zone.pin] = []
+            if len(frame) < zone.end():
+                frame.extend([(0, 0, 0)] * (zone.end() - len(frame)))
+            frame[zone.start:zone.end()] = [zone.pixel()] * zone.count
+
+        # 다른 프로그램이 보낸 프레임은 채널마다 더 밝은 쪽을 씀
+        for pin, share in self.shares.items():
+            shared = share.read()
+            if shared is None:
+                continue
+            frame = frames[pin]
+            for i in range(min(len(frame), len(shared) // 3)):
+                pixel = frame[i]
+                frame[i] = (max(pixel[0], shared[3 * i]), max(pixel[1], shared[3 * i + 1]),
+                            max(pixel[2], shared[3 * i + 2]))
+            next_frame = now + self.share_interval
+            if deadline is None or next_frame < deadline:
+                deadline = next_frame
+
+        # 스트립마다 한 프레임을 한 번에 내보냄
+        for pin, frame in frames.items():
+            dark = not any(any(pixel) for pixel in frame)
+            if dark and pin not in self.strips:
+                continue # 이미 꺼져 있는 스트립은 건드리지 않음
+            strip = self.get_strip(pin, len(frame))
+            strip[0:len(frame)] = frame
+            strip.show()
+            if self.capture is not None:
+                self.capture.led_frame(now, pin, frame)
+            if dark:
+                # 완전히 꺼진 뒤에는 스트립 드라이버를 해제해 전력을 아낌
+                strip.deinit()
+                del self.strips[pin]
+        return deadline
+
+    def colors(self):
+        # 구간별 목표 색 (페이드 중이면 도착할 색)
+        with self.light_lock:
+            return {name: zone.target for name, zone in self.zones.items()}
+
+    def is_failed(self):
+        return self.is_running and (self.light_thread is None or not self.light_thread.is_alive())
+
+    def snapshot(self):
+        with self.light_lock:
+            return {name: zone.snapshot() for name, zone in self.zones.items()}
+
+    def restore(self, snapshot):
+        # 스트립을 다시 열고, 페이드는 절대 시각 기준이라 하던 지점부터 이어짐
+        with self.light_lock:
+            for pin, strip in list(self.strips.items()):
+                try:
+                    strip.deinit()
+                except Exception:
+                    pass
+            self.strips = {}
+            for name, state in snapshot.items():
+                if name in self.zones:
+                    self.zones[name].restore(state)
+        self.failure = None
+        self.is_running = False
+        self.light_thread = None
+        self.start()
+        self.update_event.set()
+
+    def update_color(self, r, g, b, steps, zone=None):
+        # steps 는 0.1초 단위 프레임 수. -1이면 바로 켜짐
+        start = self.clock.now()
+        self.fade_to(r, g, b, start, start + max(steps, 0) * FRAME_INTERVAL, zone)
+
+    def zone_targets(self, zone):
+        # light_lock 을 잡은 채로 호출
+        if zone is None:
+            return list(self.zones.values())
+        if zone in self.zones:
+            return [self.zones[zone]]
+        print(f"Unknown LED zone: {zone}")
+        return []
+
+    def fade_to(self, r, g, b, start, end, zone=None):
         with self.light_lock:
-            self.red = r
-            self.green = g
-            self.blue = b
-            self.steps = steps
+            for target in self.zone_targets(zone):
+                target.fade_to(r, g, b, start, end)
         self.update_event.set()  # 색상이 업데이트되었음을 알림
 
+    def play_table(self, times, colors, zone=None):
+        # times 는 미디어 시계 시각, colors 는 그 시각부터 보여줄 (r, g, b)
+        with self.light_lock:
+            for target in self.zone_targets(zone):
+                target.play_table(times, colors)
+        self.update_event.set()
+
     def stop(self):
         self.update_color(0,0,0,-1) # 먼저 불 끄기
         self.is_running = False
         self.update_event.set()  # 스레드를 종료하기 위해 이벤트 설정
         if self.light_thread:
             self.light_thread.join()
-            self.light_thread = None
\ No newline at end of file
+            self.light_thread = None
+
+
+def benchmark(zone_counts, pixel_counts, frames, hardware):
+    # 모든 구간이 페이드 중일 때 한 프레임(합성 + 스트립마다 show)을 그리는 시간
+    global board, neopixel
+    if not hardware:
+        import types
+        from Components import FakeNeoPixel
+        board = types.SimpleNamespace(D18='D18', D21='D21')
+        neopixel = types.SimpleNamespace(NeoPixel=FakeNeoPixel, RGB='RGB', GRB='GRB')
+    ledController = LEDController.getInstance()
+    clock = ledController.clock
+    for count in zone_counts:
+        for pixels in pixel_counts:
+            # 구간을 두 스트립에 번갈아 나눠 둠
+            specs = []
+            offsets = {'D18': 0, 'D21': 0}
+            for i in range(count):
+                pin = 'D18' if i % 2 == 0 else 'D21'
+                specs.append(f'z{i}:{pin}:{offsets[pin]}:{pixels}')
+                offsets[pin] += pixels
+            ledController.configure_zones(specs)
+            start = clock.now()
+            for i, zone in enumerate(ledController.zones.values()):
+                zone.fade_to(255, 64 * (i % 4), 0, start, start + 3600)
+            times = []
+            for _ in range(frames):
+                before = time.perf_counter()
+                ledController.render(clock.now())
+                times.append(time.perf_counter() - before)
+            times.sort()
+            mean = sum(times) / len(times)
+            print(f"{count:>2} zones x {pixels:>3} pixels: {mean * 1000:.3f} ms avg, "
+                  f"{times[int(len(times) * 0.99)] * 1000:.3f} ms p99 "
+                  f"({mean / FRAME_INTERVAL * 100:.1f}% of a frame)")
+    ledController.configure_zones([])
+    for strip in ledController.strips.values():
+        strip.deinit()
+    ledController.strips = {}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zones', default='1,2,4,8', help="zone counts " +
+                        "to measure (default: 1,2,4,8)")
+    parser.add_argument('--pixels', default='30,150,300', help="pixels per " +
+                        "zone to measure (default: 30,150,300)")
+    parser.add_argument('--frames', default=200, type=int, help="frames " +
+                        "per configuration (default: 200)")
+    parser.add_argument('--hardware', action='store_true', help="push " +
+                        "frames to the real strips instead of fake ones")
+    args = parser.parse_args()
+
+    benchmark([int(n) for n in args.zones.split(',')],
+              [int(n) for n in args.pixels.split(',')], args.frames, args.hardware)
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# 사용법(가상 시계로 빛과 소리의 시작 오차 측정): python MediaClock.py selftest
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+class MediaClock:
+    # LED 렌더러와 오디오 출력이 함께 쓰는 단조 증가 시계 (단위: 초)
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def getInstance():
+        with MediaClock._lock:
+            if MediaClock._instance is None:
+                MediaClock._instance = MediaClock()
+            return MediaClock._instance
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        # 테스트에서는 clock/sleep 에 가상 시계를 넣어 오차를 측정할 수 있음
+        self.clock = clock
+        self.sleep = sleep
+
+    def now(self):
+        return self.clock()
+
+    def wait_until(self, deadline, event=None):
+        # deadline 까지 기다림. event 가 먼저 설정되면 True 를 반환
+        remaining = deadline - self.clock()
+        if event is not None:
+            if event.is_set():
+                return True
+            if remaining <= 0:
+                return False
+            if self.sleep is time.sleep:
+                return event.wait(remaining)
+            self.sleep(remaining)
+            return event.is_set()
+        if remaining > 0:
+            self.sleep(remaining)
+        return False
+
+
+class SimulatedClock:
+    # MediaClock(clock.now, clock.sleep) 으로 넣는 가상 시계. sleep 은 시각만 옮김
+    # overshoot 를 주면 실제 스케줄러처럼 깨어나는 시각이 0~overshoot 초 늦어짐
+    def __init__(self, start=1000.0, overshoot=0.0, seed=1):
+        self.time = start
+        self.overshoot = overshoot
+        self.rng = random.Random(seed)
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += max(0.0, seconds) + self.rng.uniform(0, self.overshoot)
+
+
+class SimulatedPCM:
+    # 가상 시계로 재생되는 ALSA 장치. use_delay 면 delay(), 아니면 avail()/info() 만 있음
+    def __init__(self, clock, rate, channels, buffer_size, use_delay):
+        self.clock = clock
+        self.rate = rate
+        self.frame_size = channels * 2
+        self.buffer_size = buffer_size
+        self.ends_at = clock.now() # 버퍼에 쓴 소리가 모두 나오는 시각
+        if use_delay:
+            self.delay = lambda: int(self.queued())
+
+    def queued(self):
+        return max(0.0, self.ends_at - self.clock.now()) * self.rate
+
+    def avail(self):
+        return int(self.buffer_size - self.queued())
+
+    def info(self):
+        return {'buffer_size': self.buffer_size}
+
+    def write(self, data):
+        frames = len(data) // self.frame_size
+        # 버퍼가 가득 차면 자리가 날 때까지 막힘 (가상 시계를 진행)
+        wait = (frames - self.avail()) / self.rate
+        if wait > 0:
+            self.clock.sleep(wait)
+        self.ends_at = max(self.ends_at, self.clock.now()) + frames / self.rate
+        return frames
+
+
+def light_times(zone, clock):
+    # 렌더 루프처럼 advance 가 돌려준 시각에 깨어나며 페이드의 첫 프레임과 최대 밝기가 된 시각
+    first_frame = full = None
+    deadline = clock.now()
+    while full is None:
+        clock.sleep(deadline - clock.now())
+        now = clock.now()
+        deadline = zone.advance(now)
+        if first_frame is None and now >= zone.fade_start:
+            first_frame = now
+        if zone.color == zone.target:
+            full = now
+        if deadline is None:
+            break
+    return first_frame, full
+
+
+def selftest(runs, overshoot, tolerance):
+    # 빛이 최대가 되는 순간 / 페이드의 첫 프레임에 첫 샘플이 나오는지 가상 시계로 확인
+    from AudioPlayer import AudioPlayer, PRE_ROLL
+    from LEDController import LEDZone
+    player = AudioPlayer.getInstance()
+    rate = 44100
+    worst = 0.0
+    for use_delay in (True, False):
+        for fade in (False, True):
+            offsets = []
+            for run in range(runs):
+                sim = SimulatedClock(overshoot=overshoot, seed=run)
+                clock = MediaClock(sim.now, sim.sleep)
+                player.clock = clock
+                start = clock.now() + 1.0
+                seconds = 2.0 + run * 0.37
+                zone = LEDZone('all', 'D18', 0, 30)
+                zone.fade_to(255, 128, 0, start, start + seconds)
+                first_frame, full = light_times(zone, sim)
+                start_at = start if fade else start + seconds
+                target = first_frame if fade else full
+
+                # AudioPlayer.play 처럼 PRE_ROLL 전에 장치를 열고 무음으로 시작 시각을 맞춤
+                sim.time = start_at - PRE_ROLL
+                player.output = SimulatedPCM(sim, rate, 2, player.period_size * player.periods, use_delay)
+                player.is_playing = True
+                player.write_silence(start_at, 2, rate)
+                first_sound = player.output.ends_at # 무음 다음 첫 샘플이 나오는 시각
+                player.is_playing = False
+                offsets.append(first_sound - target)
+                # 재생기가 스스로 잰 오차도 실제와 같아야 함
+                if abs(player.last_start_offset - (first_sound - start_at)) > 0.001:
+                    print(f"Reported offset {player.last_start_offset * 1000:.2f} ms, "
+                          f"actual {(first_sound - start_at) * 1000:.2f} ms")
+                    worst = float('inf')
+            player.output = None
+            player.clock = MediaClock.getInstance()
+            mean = sum(offsets) / len(offsets)
+            largest = max(abs(o) for o in offsets)
+            worst = max(worst, largest)
+            print(f"{'delay()' if use_delay else 'avail()'}, "
+                  f"{'sound with fade start' if fade else 'sound at full light'}: "
+                  f"{mean * 1000:+.2f} ms avg, {largest * 1000:.2f} ms max")
+    ok = worst <= tolerance
+    print("Light and sound aligned" if ok else "Light and sound are out of sync")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['selftest'])
+    parser.add_argument('--runs', default=20, type=int, help="simulated " +
+                        "alarms per case (default: 20)")
+    parser.add_argument('--overshoot', default=0.002, type=float, help="" +
+                        "maximum simulated wake-up lateness in seconds " +
+                        "(default: 0.002)")
+    parser.add_argument('--tolerance', default=0.005, type=float, help="" +
+                        "allowed light/sound offset in seconds (default: 0.005)")
+    args = parser.parse_args()
+
+    sys.exit(0 if selftest(args.runs, args.overshoot, args.tolerance) else 1)
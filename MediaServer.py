@@ -0,0 +1,90 @@
+# 시험용 미디어 서버. NetworkAudio.py serve/selftest 에서 씀
+# (데몬이 http.server/socketserver 를 불러오지 않도록 NetworkAudio 와 나눔)
+
+import http.server
+import math
+import os
+import random
+import socketserver
+import struct
+import threading
+import time
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    # 시험용 미디어 서버. Range 요청, keep-alive, 지연과 연결 끊김 주입을 지원
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.drop_every and server.requests % server.drop_every == 0:
+            self.close_connection = True # 응답 없이 연결을 끊음
+            return
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        data = server.files.get(self.path)
+        if data is None:
+            name = os.path.join(server.root or '', os.path.basename(self.path))
+            if server.root is None or not os.path.isfile(name):
+                self.send_error(404)
+                return
+            with open(name, 'rb') as f:
+                data = f.read()
+        start, end = 0, len(data) - 1
+        status = 200
+        if 'Range' in self.headers:
+            first, _, last = self.headers['Range'].partition('=')[2].partition('-')
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+    def address_string(self):
+        return str(self.client_address or 'unix')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixMediaServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def start_server(root=None, port=0, unix=None, latency=0.0, jitter=0.0, drop_every=0, files=None):
+    if unix:
+        if os.path.exists(unix):
+            os.unlink(unix)
+        server = UnixMediaServer(unix, MediaHandler)
+        url = f'unix:{unix}:'
+    else:
+        server = MediaServer(('127.0.0.1', port), MediaHandler)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.root = root
+    server.files = files or {}
+    server.latency = latency
+    server.jitter = jitter
+    server.drop_every = drop_every
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, url
+
+
+def sine_wav(seconds, rate=44100):
+    # 시험용 440Hz 스테레오 S16_LE
+    frames = b''.join(struct.pack('<hh', v, v) for v in
+                      (int(8000 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(int(seconds * rate))))
+    header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + len(frames), b'WAVE', b'fmt ', 16,
+                         1, 2, rate, rate * 4, 4, 16, b'data', len(frames))
+    return header + frames
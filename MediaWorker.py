@@ -0,0 +1,470 @@
+#!/usr/bin/python
+# 사용법(작업 프로세스를 죽였을 때 재시작): python MediaWorker.py selftest
+#        (한 프로세스 / 작업 프로세스 비교): python MediaWorker.py bench [--seconds 10]
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import socket
+import struct
+import sys
+import threading
+import time
+
+# 제어 프로세스(BLE)와 미디어 작업 프로세스(오디오, LED) 사이의 메시지
+# 메시지: 길이(I) + 요청번호(I) + 종류(B) + 메서드 이름 길이(B) + 이름 + 인자들
+# 인자  : 형식 문자 1바이트 + 값 (n=None, b=bool, i=int64, f=float64, s=문자열, j=JSON)
+FRAME = struct.Struct('<I')
+HEADER = struct.Struct('<IBB')
+NOTIFY = 0  # 응답 없이 실행
+CALL = 1    # 실행 후 결과를 돌려줌
+REPLY = 2
+ERROR = 3
+
+CALL_TIMEOUT = 5.0
+
+METHODS = {
+    'audio': {'start', 'stop', 'update_music', 'set_volume', 'cancel_idle_timer',
+              'close_output', 'prepare_music', 'preopen', 'snapshot', 'restore', 'get'},
+    'led': {'start', 'stop', 'update_color', 'fade_to', 'play_table', 'configure_zones', 'colors',
+            'snapshot', 'restore', 'get'},
+}
+READABLE = {'is_playing', 'audio_file_path', 'volume', 'underruns', 'is_running'}
+
+
+def encode_value(value):
+    if value is None:
+        return b'n'
+    if isinstance(value, bool):
+        return b'b' + bytes([value])
+    if isinstance(value, int):
+        return b'i' + struct.pack('<q', value)
+    if isinstance(value, float):
+        return b'f' + struct.pack('<d', value)
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        return b's' + struct.pack('<H', len(data)) + data
+    data = json.dumps(value).encode('utf-8')
+    return b'j' + struct.pack('<I', len(data)) + data
+
+
+def decode_values(data, offset):
+    values = []
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        offset += 1
+        if kind == b'n':
+            values.append(None)
+        elif kind == b'b':
+            values.append(bool(data[offset]))
+            offset += 1
+        elif kind == b'i':
+            values.append(struct.unpack_from('<q', data, offset)[0])
+            offset += 8
+        elif kind == b'f':
+            values.append(struct.unpack_from('<d', data, offset)[0])
+            offset += 8
+        elif kind == b's':
+            length = struct.unpack_from('<H', data, offset)[0]
+            values.append(data[offset + 2:offset + 2 + length].decode('utf-8'))
+            offset += 2 + length
+        elif kind == b'j':
+            length = struct.unpack_from('<I', data, offset)[0]
+            values.append(json.loads(data[offset + 4:offset + 4 + length]))
+            offset += 4 + length
+        else:
+            raise ValueError(f"Bad value type {kind!r}")
+    return values
+
+
+def send_message(sock, request_id, kind, name, args):
+    name = name.encode('utf-8')
+    body = HEADER.pack(request_id, kind, len(name)) + name + b''.join(encode_value(a) for a in args)
+    sock.sendall(FRAME.pack(len(body)) + body)
+
+
+def recv_exact(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        try:
+            chunk = sock.recv(length - len(data))
+        except OSError:
+            return None # 상대 프로세스가 죽었거나 소켓을 닫음
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    header = recv_exact(sock, FRAME.size)
+    if header is None:
+        return None
+    body = recv_exact(sock, FRAME.unpack(header)[0])
+    if body is None:
+        return None
+    request_id, kind, length = HEADER.unpack_from(body)
+    start = HEADER.size
+    name = body[start:start + length].decode('utf-8')
+    return request_id, kind, name, decode_values(body, start + length)
+
+
+def serve(kind, sock, settings):
+    # 작업 프로세스의 본체. 제어 프로세스가 보낸 메서드 호출을 차례로 실행
+    from Supervisor import Supervisor
+    from Realtime import Realtime
+    if settings.get('fake_backends'):
+        # selftest/bench: 장치 없이 가짜 PCM/스트립으로 돌림
+        from Components import use_fake_backends, PacedPCM
+        use_fake_backends(PacedPCM)
+    if kind == 'audio':
+        from AudioPlayer import AudioPlayer
+        target = AudioPlayer.getInstance()
+    else:
+        from LEDController import LEDController
+        target = LEDController.getInstance()
+    for name, value in settings.items():
+        if name == 'fake_backends':
+            continue
+        elif name == 'realtime':
+            target.realtime = Realtime(*value) if value else None
+        elif name == 'zones':
+            if value:
+                target.configure_zones(value)
+        elif name == 'share_fps':
+            if value:
+                target.share_frames(value)
+        else:
+            setattr(target, name, value)
+    # 작업 프로세스 안에서도 스레드가 죽으면 바로 재시작
+    supervisor = Supervisor(0)
+    supervisor.watch(kind, target)
+    supervisor.start()
+
+    while True:
+        message = recv_message(sock)
+        if message is None:
+            break
+        request_id, flags, name, args = message
+        try:
+            if name not in METHODS[kind]:
+                raise ValueError(f"Unknown method {name}")
+            if name == 'get':
+                if args[0] not in READABLE:
+                    raise ValueError(f"Unknown attribute {args[0]}")
+                result = getattr(target, args[0])
+            else:
+                result = getattr(target, name)(*args)
+        except Exception as e:
+            print(f"{kind} worker: {name} failed: {e}")
+            if flags == CALL:
+                send_message(sock, request_id, ERROR, name, [str(e)])
+            continue
+        if flags == CALL:
+            send_message(sock, request_id, REPLY, name, [result])
+    supervisor.stop()
+    target.stop()
+    if kind == 'led':
+        target.unshare_frames()
+
+
+class WorkerProxy:
+    # 제어 프로세스에서 AudioPlayer/LEDController 대신 쓰는 객체. 호출을 작업 프로세스로 보냄
+    def __init__(self, kind, settings):
+        self.kind = kind
+        self.settings = settings
+        self.process = None
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.on_failure = None
+        self.disconnected = False
+        self.last_snapshot = None
+        self.calls = 0
+        self.call_time = 0.0
+        self.call_max = 0.0
+        self.spawn()
+
+    def spawn(self):
+        # GLib/D-Bus 스레드가 있는 프로세스를 fork 하지 않도록 spawn 사용
+        context = multiprocessing.get_context('spawn')
+        parent, child = socket.socketpair()
+        self.process = context.Process(target=serve, args=(self.kind, child, self.settings))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.sock = parent
+        self.disconnected = False
+        reader = threading.Thread(target=self.read_replies, args=(parent,))
+        reader.daemon = True
+        reader.start()
+
+    def read_replies(self, sock):
+        while True:
+            message = recv_message(sock)
+            if message is None:
+                break
+            request_id, kind, name, values = message
+            waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter[1] = values[0] if values else None
+                waiter[2] = kind == ERROR
+                waiter[0].set()
+        # 작업 프로세스가 죽음: 기다리던 호출을 모두 풀고 감시자에게 알림
+        for waiter in list(self.pending.values()):
+            waiter[2] = True
+            waiter[0].set()
+        self.pending.clear()
+        if sock is self.sock:
+            self.disconnected = True
+            if self.on_failure is not None:
+                self.on_failure(self)
+
+    def notify(self, name, *args):
+        try:
+            with self.send_lock:
+                send_message(self.sock, 0, NOTIFY, name, args)
+        except OSError as e:
+            print(f"{self.kind} worker unavailable: {e}")
+
+    def call(self, name, *args):
+        request_id = next(self.request_ids)
+        waiter = [threading.Event(), None, False]
+        self.pending[request_id] = waiter
+        start = time.monotonic()
+        try:
+            with self.send_lock:
+                send_message(self.sock, request_id, CALL, name, args)
+        except OSError as e:
+            self.pending.pop(request_id, None)
+            raise RuntimeError(f"{self.kind} worker unavailable: {e}")
+        if not waiter[0].wait(CALL_TIMEOUT):
+            self.pending.pop(request_id, None)
+            raise RuntimeError(f"{self.kind} worker did not answer {name}")
+        elapsed = time.monotonic() - start
+        self.calls += 1
+        self.call_time += elapsed
+        self.call_max = max(self.call_max, elapsed)
+        if waiter[2]:
+            raise RuntimeError(f"{self.kind} worker: {name} failed: {waiter[1]}")
+        return waiter[1]
+
+    def latency(self):
+        # 평균/최대 왕복 시간(초)
+        return (self.call_time / self.calls if self.calls else 0.0), self.call_max
+
+    # 명령은 기다리지 않고 보냄
+    def start(self):
+        self.notify('start')
+
+    def update_music(self, music_path, volume, start_at=None, fade_in=0):
+        self.notify('update_music', music_path, volume, start_at, fade_in)
+
+    def set_volume(self, vol):
+        self.notify('set_volume', vol)
+
+    def cancel_idle_timer(self):
+        self.notify('cancel_idle_timer')
+
+    def close_output(self):
+        self.notify('close_output')
+
+    def update_color(self, r, g, b, steps, zone=None):
+        self.notify('update_color', r, g, b, steps, zone)
+
+    def fade_to(self, r, g, b, start, end, zone=None):
+        self.notify('fade_to', r, g, b, start, end, zone)
+
+    def play_table(self, times, colors, zone=None):
+        self.notify('play_table', list(times), [list(c) for c in colors], zone)
+
+    def prepare_music(self, music_path):
+        self.notify('prepare_music', music_path)
+
+    def preopen(self, level):
+        self.notify('preopen', level)
+
+    def configure_zones(self, specs):
+        self.notify('configure_zones', list(specs))
+
+    # 상태는 작업 프로세스에서 받아옴
+    def stop(self):
+        try:
+            self.call('stop')
+        except RuntimeError as e:
+            print(e)
+
+    def colors(self):
+        return {name: tuple(color) for name, color in self.call('colors').items()}
+
+    def get(self, name):
+        return self.call('get', name)
+
+    @property
+    def is_playing(self):
+        return self.get('is_playing')
+
+    @property
+    def audio_file_path(self):
+        return self.get('audio_file_path')
+
+    @property
+    def volume(self):
+        return self.get('volume')
+
+    @property
+    def underruns(self):
+        return self.get('underruns')
+
+    def add_tap(self, tap):
+        print("Audio taps are not available with worker processes")
+
+    def remove_tap(self, tap):
+        pass
+
+    def warm_up(self):
+        pass # 작업 프로세스가 시작하면서 이미 준비함
+
+    # Supervisor 가 작업 프로세스 자체를 감시할 때 쓰는 메서드
+    def is_failed(self):
+        # 소켓이 먼저 끊기고 프로세스는 아직 정리 중일 수 있으므로 둘 다 봄
+        return self.process is not None and (self.disconnected or not self.process.is_alive())
+
+    def snapshot(self):
+        # 죽은 뒤에는 마지막으로 받아 둔 상태 (한 번도 받지 않았으면 None, 상태 없이 재시작)
+        if self.process.is_alive() and not self.disconnected:
+            try:
+                self.last_snapshot = self.call('snapshot')
+            except RuntimeError:
+                pass
+        return self.last_snapshot
+
+    def restore(self, snapshot):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.spawn()
+        if snapshot is not None:
+            self.notify('restore', snapshot)
+
+    def close(self):
+        self.stop()
+        self.sock.close()
+        self.process.join(2.0)
+
+
+def selftest(limit):
+    # 작업 프로세스를 죽이고 감시자(주기적 확인 없음)가 상태 없이도 다시 띄우는지 확인
+    from Supervisor import Supervisor, wait_for
+    ok = True
+    for kind, settings in (('led', {'fake_backends': True, 'zones': ['main:D18:0:60']}),
+                           ('audio', {'fake_backends': True})):
+        proxy = WorkerProxy(kind, settings)
+        supervisor = Supervisor(0)
+        supervisor.watch(kind, proxy)
+        supervisor.start()
+        proxy.start()
+        process = proxy.process
+        killed = time.monotonic()
+        process.kill()
+        respawned = wait_for(lambda: proxy.process is not process and not proxy.is_failed(), limit)
+        elapsed = time.monotonic() - killed
+        try:
+            answered = proxy.get('is_running' if kind == 'led' else 'is_playing') is not None
+        except RuntimeError as e:
+            print(e)
+            answered = False
+        passed = respawned and answered and supervisor.restarts[kind] == 1
+        print(f"{kind} worker: killed, respawned in {elapsed * 1000:.0f} ms, "
+              f"{supervisor.restarts[kind]} restarts ({'ok' if passed else 'FAILED'})")
+        ok = ok and passed
+        supervisor.stop()
+        proxy.on_failure = None
+        proxy.close()
+    print("Worker restart passed" if ok else "Worker restart failed")
+    return ok
+
+
+def bench(path, seconds, cpu_threads, period_size, periods, rate=200):
+    # 같은 일(재생, LED 페이드, BLE 흉내 요청과 파이썬 계산 부하)을 한 프로세스와 작업 프로세스로 돌려
+    # 명령 왕복 시간과 오디오 언더런을 비교. 왕복 시간은 제어 스레드에서 colors() 를 부른 시간
+    from Components import use_fake_backends, PacedPCM
+    from Realtime import cpu_load
+    results = {}
+    for mode in ('single process', 'workers'):
+        if mode == 'workers':
+            player = WorkerProxy('audio', {'fake_backends': True, 'period_size': period_size,
+                                           'periods': periods})
+            ledController = WorkerProxy('led', {'fake_backends': True,
+                                                'zones': ['main:D18:0:60']})
+        else:
+            from AudioPlayer import AudioPlayer
+            from LEDController import LEDController
+            use_fake_backends(PacedPCM)
+            player = AudioPlayer.getInstance()
+            ledController = LEDController.getInstance()
+            ledController.configure_zones(['main:D18:0:60'])
+            player.period_size = period_size
+            player.periods = periods
+        stop = threading.Event()
+        threads = [threading.Thread(target=cpu_load, args=(stop,)) for _ in range(cpu_threads)]
+        for thread in threads:
+            thread.start()
+        ledController.start()
+        start = time.monotonic()
+        ledController.fade_to(255, 128, 0, start, start + seconds)
+        player.start()
+        player.update_music(path, 50)
+        underruns = player.underruns
+        latencies = []
+        i = 0
+        while time.monotonic() - start < seconds:
+            # GLib/D-Bus 스레드 흉내: 요청을 풀고(마샬링) 명령을 보냄
+            message = json.dumps({'device': f'/org/bluez/hci0/dev_{i % 8}', 'value': list(range(64))})
+            json.loads(message)
+            before = time.perf_counter()
+            ledController.colors()
+            latencies.append(time.perf_counter() - before)
+            i += 1
+            time.sleep(1.0 / rate)
+        underruns = player.underruns - underruns
+        player.stop()
+        ledController.stop()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if mode == 'workers':
+            player.close()
+            ledController.close()
+        latencies.sort()
+        results[mode] = (sum(latencies) / len(latencies), latencies[int(len(latencies) * 0.99)],
+                         latencies[-1], underruns)
+    for mode, (mean, p99, worst, underruns) in results.items():
+        print(f"{mode:>14}: command round trip {mean * 1000:.2f} ms avg, {p99 * 1000:.2f} ms p99, "
+              f"{worst * 1000:.2f} ms max; {underruns} audio underruns")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['selftest', 'bench'])
+    parser.add_argument('--limit', default=5.0, type=float, help="selftest: " +
+                        "seconds allowed from kill to a working worker (default: 5)")
+    parser.add_argument('--track', default='./Alarm/GM.wav', help="WAV " +
+                        "played during the bench (default: ./Alarm/GM.wav)")
+    parser.add_argument('--seconds', default=10, type=float, help="length " +
+                        "of each bench run (default: 10)")
+    parser.add_argument('--cpu-threads', default=2, type=int, help="busy " +
+                        "Python threads in the control process (default: 2)")
+    parser.add_argument('--period-size', default=256, type=int, help="" +
+                        "ALSA period size in frames; small to expose " +
+                        "underruns (default: 256)")
+    parser.add_argument('--periods', default=2, type=int, help="ALSA " +
+                        "periods per buffer (default: 2)")
+    args = parser.parse_args()
+
+    if args.command == 'selftest':
+        sys.exit(0 if selftest(args.limit) else 1)
+    bench(args.track, args.seconds, args.cpu_threads, args.period_size, args.periods)
@@ -0,0 +1,362 @@
+#!/usr/bin/python
+# 미디어 서버(HTTP 또는 유닉스 소켓 위의 HTTP)에서 WAV 를 받아 AudioPlayer 에 넘기는 소스
+# 사용법: python NetworkAudio.py serve ./SleepMusic [--port 8000 | --unix /tmp/media.sock]
+#        python NetworkAudio.py selftest [--latency 0.05 --jitter 0.1 --drop-every 20]
+
+import argparse
+import collections
+import http.client
+import socket
+import struct
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+HEADER_BYTES = 4096    # WAV 헤더를 찾으려고 처음 받는 크기
+CHUNK_PERIODS = 4      # Range 요청 한 번에 받는 주기 수
+BUFFER_PERIODS = 32    # 지터 버퍼 크기(주기). 이만큼 네트워크가 멈춰도 소리가 끊기지 않음
+PREFETCH_PERIODS = 8   # 재생을 시작하기 전에 채워 둘 주기 수
+PREFETCH_TIMEOUT = 5.0
+RETRY_DELAY = 0.2
+CLOSE_WAIT = 0.1       # close() 가 받는 스레드를 기다리는 최대 시간. 넘으면 데몬 스레드로 남겨 둠
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ConnectionPool:
+    # 서버별로 keep-alive 연결을 모아 두고 다시 씀
+    def __init__(self, timeout=5.0, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.opened = 0
+
+    def get(self, key):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+            self.opened += 1
+        if key[0] == 'unix':
+            return UnixHTTPConnection(key[1], self.timeout)
+        return http.client.HTTPConnection(key[1], key[2], timeout=self.timeout)
+
+    def put(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close_all(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+pool = ConnectionPool()
+
+
+def is_stream(path):
+    return path.startswith(('http://', 'unix:'))
+
+
+def split_url(url):
+    # http://host:port/path 또는 unix:/run/media.sock:/path
+    if url.startswith('unix:'):
+        socket_path, _, path = url[5:].partition(':')
+        return ('unix', socket_path), path or '/'
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return ('http', parts.hostname, parts.port or 80), path
+
+
+def parse_wav_header(data):
+    # ((채널, 샘플레이트, 샘플 크기), data 시작 위치, data 크기)
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError('not a WAV stream')
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, offset)
+        offset += 8
+        if chunk_id == b'fmt ':
+            tag, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', data, offset)
+            if tag not in (1, 0xFFFE):
+                raise ValueError('WAV stream is not PCM')
+            fmt = (channels, rate, bits // 8)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('WAV data before fmt chunk')
+            return fmt, offset, size
+        offset += size + (size & 1)
+    raise ValueError('WAV header not found')
+
+
+class NetworkSource:
+    # wave.Wave_read 처럼 읽히는 네트워크 소스. 받는 스레드가 지터 버퍼를 미리 채워 둠
+    def __init__(self, url, period_size=2048, buffer_periods=BUFFER_PERIODS,
+                 prefetch_periods=PREFETCH_PERIODS, connections=pool):
+        self.url = url
+        self.key, self.path = split_url(url)
+        self.connections = connections
+        self.requests = 0
+        self.reconnects = 0
+        self.stop_event = threading.Event()
+        self.active = None # 받는 중인 연결. close() 가 끊어서 응답을 기다리지 않게 함
+        (self.channels, self.rate, self.sampwidth), self.data_offset, self.data_size = \
+            parse_wav_header(self.fetch(0, HEADER_BYTES - 1))
+        self.frame_size = self.channels * self.sampwidth
+        self.nframes = self.data_size // self.frame_size
+        self.period_bytes = period_size * self.frame_size
+        self.period_time = period_size / self.rate
+        self.silence = (b'\x80' if self.sampwidth == 1 else b'\x00') * self.period_bytes
+        self.capacity = max(buffer_periods, CHUNK_PERIODS)
+        self.prefetch_periods = min(prefetch_periods, self.capacity)
+        self.buffer = collections.deque()
+        self.cond = threading.Condition()
+        self.generation = 0 # setpos 로 위치가 바뀌면 받던 조각을 버리기 위한 번호
+        self.fetch_pos = 0  # 다음에 받을 data 안의 바이트 위치
+        self.pos = 0
+        self.reads = 0
+        self.underruns = 0
+        self.occupancy_sum = 0
+        self.occupancy_min = None
+        self.fetch_thread = threading.Thread(target=self.run)
+        self.fetch_thread.daemon = True
+        self.fetch_thread.start()
+        self.wait_prefetch()
+
+    def fetch(self, start, end):
+        # keep-alive 연결로 Range 요청 한 번. 실패한 연결은 버림
+        self.requests += 1
+        connection = self.connections.get(self.key)
+        self.active = connection
+        try:
+            if self.stop_event.is_set():
+                raise OSError('stream closed')
+            connection.request('GET', self.path, headers={'Range': f'bytes={start}-{end}'})
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        finally:
+            self.active = None
+        if response.will_close:
+            connection.close()
+        else:
+            self.connections.put(self.key, connection)
+        if response.status == 200: # Range 를 지원하지 않는 서버
+            data = data[start:end + 1]
+        elif response.status != 206:
+            raise OSError(f"HTTP {response.status} for {self.url}")
+        return data
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.cond:
+                while len(self.buffer) + CHUNK_PERIODS > self.capacity and not self.stop_event.is_set():
+                    self.cond.wait()
+                generation = self.generation
+                offset = self.fetch_pos
+            if self.stop_event.is_set():
+                break
+            size = min(CHUNK_PERIODS * self.period_bytes, self.data_size - offset)
+            try:
+                start = self.data_offset + offset
+                data = self.fetch(start, start + size - 1)
+                if not data:
+                    raise OSError('empty response')
+            except (OSError, http.client.HTTPException) as e:
+                if self.stop_event.is_set():
+                    break
+                # 버퍼가 남아 있는 동안 같은 위치부터 다시 받으면 끊김 없이 이어짐
+                self.reconnects += 1
+                print(f"Stream {self.url}: {e}, reconnecting")
+                self.stop_event.wait(RETRY_DELAY)
+                continue
+            with self.cond:
+                if generation != self.generation:
+                    continue
+                for i in range(0, len(data), self.period_bytes):
+                    self.buffer.append(data[i:i + self.period_bytes])
+                # 끝까지 받으면 처음부터 이어 받음 (재생은 반복되므로)
+                self.fetch_pos = (offset + len(data)) % self.data_size
+                self.cond.notify_all()
+
+    def wait_prefetch(self):
+        deadline = time.monotonic() + PREFETCH_TIMEOUT
+        with self.cond:
+            while len(self.buffer) < self.prefetch_periods:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Stream {self.url}: prefetch timed out with {len(self.buffer)} periods")
+                    return
+                self.cond.wait(remaining)
+
+    def getnchannels(self):
+        return self.channels
+
+    def getframerate(self):
+        return self.rate
+
+    def getsampwidth(self):
+        return self.sampwidth
+
+    def getnframes(self):
+        return self.nframes
+
+    def tell(self):
+        return self.pos
+
+    def setpos(self, pos):
+        # 버퍼를 비우고 새 위치부터 다시 받음
+        with self.cond:
+            self.generation += 1
+            self.buffer.clear()
+            self.fetch_pos = pos * self.frame_size
+            self.pos = pos
+            self.cond.notify_all()
+        self.wait_prefetch()
+
+    def rewind(self):
+        # 받는 스레드가 이미 처음부터 이어 받고 있으므로 버퍼는 그대로 둠
+        pass
+
+    def readframes(self, count):
+        # 한 주기씩 돌려줌. 버퍼가 비면 한 주기만 기다리고, 그래도 없으면 무음으로 채움
+        with self.cond:
+            occupancy = len(self.buffer)
+            self.reads += 1
+            self.occupancy_sum += occupancy
+            if self.occupancy_min is None or occupancy < self.occupancy_min:
+                self.occupancy_min = occupancy
+            if not self.buffer:
+                self.cond.wait(self.period_time)
+            if not self.buffer:
+                self.underruns += 1
+                return self.silence
+            data = self.buffer.popleft()
+            self.cond.notify_all()
+        self.pos = (self.pos + len(data) // self.frame_size) % max(1, self.nframes)
+        return data
+
+    def report(self):
+        mean = self.occupancy_sum / self.reads if self.reads else 0.0
+        return (f"Stream {self.url}: buffer min {self.occupancy_min or 0} / avg {mean:.1f} "
+                f"of {self.capacity} periods, {self.underruns} underruns, "
+                f"{self.reconnects} reconnects, {self.requests} requests")
+
+    def close(self):
+        # 받던 요청은 소켓을 끊어서 멈춤. 서버가 응답하지 않아도 타임아웃까지 기다리지 않음
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        connection = self.active
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.fetch_thread is not threading.current_thread():
+            self.fetch_thread.join(CLOSE_WAIT)
+        print(self.report())
+
+
+def selftest(seconds, latency, jitter, drop_every, unix, period_size, buffer_periods):
+    # 지연/끊김을 넣은 서버에서 실시간 속도로 읽어 언더런이 없는지 확인
+    from MediaServer import start_server, sine_wav
+    server, url = start_server(unix=unix, latency=latency, jitter=jitter, drop_every=drop_every,
+                               files={'/test.wav': sine_wav(3.0)})
+    source = NetworkSource(url + '/test.wav', period_size, buffer_periods)
+    start = time.monotonic()
+    reads = 0
+    while time.monotonic() - start < seconds:
+        data = source.readframes(period_size)
+        if not data:
+            source.rewind()
+            continue
+        reads += 1
+        # ALSA 처럼 한 주기 분량을 쓸 때마다 그만큼 시간이 흐름
+        time.sleep(max(0.0, start + reads * source.period_time - time.monotonic()))
+    source.close()
+    # 서버가 응답하지 않는 중에 닫아도 바로 돌아와야 함
+    server.latency, server.jitter, server.drop_every = 0.0, 0.0, 0
+    stalled = NetworkSource(url + '/test.wav', period_size, buffer_periods)
+    server.latency = 2.0
+    for _ in range(CHUNK_PERIODS): # 버퍼에 자리가 나면 받는 스레드가 다음 조각을 요청함
+        stalled.readframes(period_size)
+    time.sleep(0.2)
+    before = time.monotonic()
+    stalled.close()
+    closed = time.monotonic() - before
+    server.shutdown()
+    pool.close_all()
+    print(f"Selftest: {pool.opened} connections opened for {source.requests} requests, "
+          f"close during a stalled request took {closed * 1000:.0f} ms")
+    return source.underruns == 0 and closed < CLOSE_WAIT + 0.05
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['serve', 'selftest'])
+    parser.add_argument('root', nargs='?', default='./SleepMusic', help="" +
+                        "folder served by 'serve' (default: ./SleepMusic)")
+    parser.add_argument('--port', default=8000, type=int, help="HTTP port " +
+                        "for 'serve' (default: 8000)")
+    parser.add_argument('--unix', default=None, help="listen on this unix " +
+                        "socket instead of TCP")
+    parser.add_argument('--latency', default=None, type=float, help="" +
+                        "injected delay per request in seconds (default: " +
+                        "0 for serve, 0.05 for selftest)")
+    parser.add_argument('--jitter', default=None, type=float, help="extra " +
+                        "random delay per request, up to this many seconds " +
+                        "(default: 0 for serve, 0.1 for selftest)")
+    parser.add_argument('--drop-every', default=None, type=int, help="drop " +
+                        "every Nth request without answering, 0=never " +
+                        "(default: 0 for serve, 20 for selftest)")
+    parser.add_argument('--seconds', default=10, type=float, help="selftest " +
+                        "length in seconds (default: 10)")
+    parser.add_argument('--period-size', default=2048, type=int, help="" +
+                        "frames per period (default: 2048)")
+    parser.add_argument('--buffer-periods', default=BUFFER_PERIODS, type=int,
+                        help="jitter buffer size in periods (default: " +
+                        f"{BUFFER_PERIODS})")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        from MediaServer import start_server
+        server, url = start_server(args.root, args.port, args.unix, args.latency or 0.0,
+                                   args.jitter or 0.0, args.drop_every or 0)
+        print(f"Serving {args.root} at {url}/<name>.wav")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        ok = selftest(args.seconds,
+                      0.05 if args.latency is None else args.latency,
+                      0.1 if args.jitter is None else args.jitter,
+                      20 if args.drop_every is None else args.drop_every,
+                      args.unix, args.period_size, args.buffer_periods)
+        print("No underruns" if ok else "Underruns detected")
+        sys.exit(0 if ok else 1)
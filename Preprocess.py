@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# 알람/음악 파일을 기기에서 바로 재생할 수 있는 형식으로 미리 변환
+# (장치 샘플레이트/채널, S16_LE, 음량 정규화, 앞뒤 무음 제거, 반복 구간)
+# 사용법: python Preprocess.py [--rate 48000] [--channels 2] [--jobs N]
+
+import argparse
+import array
+import hashlib
+import json
+import os
+
+SOURCE_DIRS = ['Alarm', 'SleepMusic']
+OUTPUT_DIR = './Processed'
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, 'manifest.json')
+EXTENSIONS = ('.wav', '.mp3', '.ogg', '.flac', '.m4a')
+
+TARGET_DBFS = -20.0
+SILENCE_THRESHOLD = -50.0
+HASH_CHUNK = 1 << 20
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'tracks': {}}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+_loops = {'mtime': None, 'points': {}}
+
+
+def loop_points(path, manifest_path=MANIFEST_PATH):
+    # 변환한 파일의 (반복 시작, 반복 끝) 프레임. 매니페스트에 없으면 None
+    # 매니페스트가 바뀐 경우에만 다시 읽음
+    try:
+        mtime = os.stat(manifest_path).st_mtime
+    except OSError:
+        return None
+    if mtime != _loops['mtime']:
+        tracks = load_manifest(manifest_path).get('tracks', {})
+        _loops['points'] = {os.path.normpath(entry['output']): (entry['loop_start'], entry['loop_end'])
+                            for entry in tracks.values() if 'loop_end' in entry}
+        _loops['mtime'] = mtime
+    return _loops['points'].get(os.path.normpath(path))
+
+
+def loop_end(segment):
+    # 끝에서 10ms 안쪽의 영점 교차 지점을 반복 끝으로 잡아 이음새의 잡음을 줄임
+    samples = array.array('h', segment.raw_data)
+    channels = segment.channels
+    frames = len(samples) // channels
+    search = max(1, segment.frame_rate // 100)
+    for frame in range(frames - 1, max(0, frames - search), -1):
+        before = samples[(frame - 1) * channels]
+        after = samples[frame * channels]
+        if before <= 0 <= after or after <= 0 <= before:
+            return frame
+    return frames
+
+
+def process_file(source, output, rate, channels):
+    # 작업 프로세스에서 실행됨
+    from pydub import AudioSegment
+    from pydub.silence import detect_leading_silence
+
+    segment = AudioSegment.from_file(source)
+    segment = segment.set_frame_rate(rate).set_channels(channels).set_sample_width(2)
+
+    start = detect_leading_silence(segment, SILENCE_THRESHOLD)
+    end = len(segment) - detect_leading_silence(segment.reverse(), SILENCE_THRESHOLD)
+    if end > start:
+        segment = segment[start:end]
+
+    gain = 0.0
+    if segment.dBFS != float('-inf'):
+        # 소리가 잘리지 않는 범위에서 목표 음량으로 맞춤
+        gain = min(TARGET_DBFS - segment.dBFS, -segment.max_dBFS)
+        segment = segment.apply_gain(gain)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp_path = output + '.tmp'
+    segment.export(tmp_path, format='wav')
+    os.replace(tmp_path, output)
+
+    return {
+        'output': output,
+        'rate': rate,
+        'channels': channels,
+        'format': 'S16_LE',
+        'frames': int(segment.frame_count()),
+        'duration': len(segment) / 1000.0,
+        'gain': round(gain, 2),
+        'loudness': round(segment.dBFS, 2),
+        'loop_start': 0,
+        'loop_end': loop_end(segment),
+    }
+
+
+def scan_sources(root='.'):
+    for directory in SOURCE_DIRS:
+        path = os.path.join(root, directory)
+        if not os.path.isdir(path):
+            continue
+        for entry in sorted(os.listdir(path)):
+            if entry.lower().endswith(EXTENSIONS) and not entry.startswith('.'):
+                yield directory, os.path.join(path, entry)
+
+
+def preprocess(rate=48000, channels=2, jobs=None):
+    # 데몬은 loop_points 만 쓰므로 변환할 때만 불러옴
+    import concurrent.futures
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = load_manifest()
+    old_tracks = manifest.get('tracks', {})
+    tracks = {}
+    pending = {}
+
+    sources = list(scan_sources())
+    stems = {}
+    for directory, source in sources:
+        key = (directory, os.path.splitext(os.path.basename(source))[0])
+        stems[key] = stems.get(key, 0) + 1
+
+    # 내용 해시가 같고 설정도 같으면 다시 변환하지 않음
+    for directory, source in sources:
+        name, ext = os.path.splitext(os.path.basename(source))
+        if stems[(directory, name)] > 1:
+            # x.wav 와 x.mp3 처럼 이름이 같으면 확장자를 붙여 서로 덮어쓰지 않게 함
+            name = f'{name}_{ext[1:].lower()}'
+        output = os.path.join(OUTPUT_DIR, directory, name + '.wav')
+        digest = file_hash(source)
+        old = old_tracks.get(source)
+        if (old is not None and old['hash'] == digest and old['rate'] == rate
+                and old['channels'] == channels and old['output'] == output
+                and os.path.exists(old['output'])):
+            tracks[source] = old
+        else:
+            pending[source] = (output, digest)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(process_file, source, output, rate, channels): source
+                   for source, (output, digest) in pending.items()}
+        for future in concurrent.futures.as_completed(futures):
+            source = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"Failed to process {source}: {e}")
+                continue
+            entry['hash'] = pending[source][1]
+            entry['source'] = source
+            tracks[source] = entry
+            print(f"Processed {source} -> {entry['output']}")
+
+    # 원본이 지워진 파일은 변환본도 지움 (다른 원본이 같은 변환본을 쓰게 된 경우는 남김)
+    outputs = {entry['output'] for entry in tracks.values()}
+    for source, old in old_tracks.items():
+        if (source not in tracks and source not in pending and old['output'] not in outputs
+                and os.path.exists(old['output'])):
+            os.remove(old['output'])
+
+    manifest['tracks'] = tracks
+    save_manifest(manifest)
+    print(f"{len(pending)} processed, {len(tracks)} tracks in manifest")
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', default=48000, type=int, help="output " +
+                        "sample rate, should match the device (default: 48000)")
+    parser.add_argument('--channels', default=2, type=int, help="output " +
+                        "channel count (default: 2)")
+    parser.add_argument('--jobs', default=None, type=int, help="worker " +
+                        "processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    preprocess(args.rate, args.channels, args.jobs)
\ No newline at end of file
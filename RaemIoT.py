@@ -4,16 +4,28 @@
 from __future__ import print_function
 
 import argparse
+import os
 import dbus
 import dbus.exceptions
 import dbus.mainloop.glib
 import dbus.service
 import time
 import threading
-import board
-import neopixel
 from AudioPlayer import AudioPlayer
 from LEDController import LEDController
+from AudioReactive import AudioReactive
+from MediaClock import MediaClock
+from Supervisor import Supervisor
+from Sessions import SessionManager, PRIORITY_NORMAL, PRIORITY_SCENE, PRIORITY_ALARM, FOREVER
+from SceneStore import SceneStore
+from AssetUpload import AssetUpload, UploadError
+from Catalog import Catalog
+from SleepTimer import SleepTimer
+from Trace import TraceWriter, PCM_STEP
+from Realtime import Realtime
+from Advertising import AdvertisingManager, compact_uuids, ALARM_WINDOW
+from AlarmTimeline import AlarmTimeline, PREOPEN
+from Components import Container, resource_usage, format_usage, context_switches
 
 try:
     from gi.repository import GObject  # python3
@@ -23,6 +35,16 @@ except ImportError:
 mainloop = None
 player = None
 ledController = None
+audioReactive = None
+supervisor = None
+sessions = SessionManager(clock=MediaClock.getInstance().now)
+sceneStore = None
+catalog = None
+sleepTimer = None
+advertising = None
+alarmTimeline = None
+media_server = None
+components = Container()
 
 BLUEZ_SERVICE_NAME = 'org.bluez'
 LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
@@ -71,6 +93,8 @@ class Advertisement(dbus.service.Object):
         self.local_name = None
         self.include_tx_power = False
         self.data = None
+        self.min_interval = None
+        self.max_interval = None
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_properties(self):
@@ -96,6 +120,10 @@ class Advertisement(dbus.service.Object):
         if self.data is not None:
             properties['Data'] = dbus.Dictionary(
                 self.data, signature='yv')
+        if self.min_interval is not None:
+            properties['MinInterval'] = dbus.UInt32(self.min_interval)
+        if self.max_interval is not None:
+            properties['MaxInterval'] = dbus.UInt32(self.max_interval)
         return {LE_ADVERTISEMENT_IFACE: properties}
 
     def get_path(self):
@@ -126,6 +154,11 @@ class Advertisement(dbus.service.Object):
             self.local_name = ""
         self.local_name = dbus.String(name)
 
+    def set_interval(self, min_interval, max_interval):
+        # advertising interval in milliseconds (BlueZ MinInterval/MaxInterval)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
     def add_data(self, ad_type, data):
         if not self.data:
             self.data = dbus.Dictionary({}, signature='yv')
@@ -159,6 +192,8 @@ class Application(dbus.service.Object):
         self.add_service(LEDService(bus, 0))
         self.add_service(AudioService(bus, 1))
         self.add_service(AlarmService(bus, 2))
+        self.add_service(SceneService(bus, 3))
+        self.add_service(StatusService(bus, 4))
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
@@ -355,16 +390,16 @@ class Descriptor(dbus.service.Object):
         raise NotSupportedException()
 
 
-class TestAdvertisement(Advertisement):
+class RaemAdvertisement(Advertisement):
 
-    def __init__(self, bus, index):
+    def __init__(self, bus, index, services):
         Advertisement.__init__(self, bus, index, 'peripheral')
-        self.add_service_uuid('180D')
-        self.add_manufacturer_data(0xffff, [0x00, 0x01, 0x02, 0x03])
-        self.add_service_data('9999', [0x00, 0x01, 0x02, 0x03, 0x04])
+        # only what fits in one 31 byte legacy advertisement: the name and
+        # the first primary service UUIDs, so phones can filter scans on it
         self.add_local_name('Raem')
-        self.include_tx_power = True
-        self.add_data(0x26, [0x01, 0x01, 0x00])
+        for uuid in compact_uuids([s.uuid for s in services if s.primary],
+                                  self.local_name):
+            self.add_service_uuid(uuid)
 
 class LEDService(Service):
     LED_SVC_UUID = '123e4567-e89b-12d3-a456-426614174000'
@@ -382,23 +417,30 @@ class LEDCharacteristic(Characteristic):
                 self.LED_CHRC_UUID,
                 ['write', 'writable-auxiliaries'],
                 service)
-        self.red = 0.00
-        self.blue = 0.00
-        self.green = 0.00
     
     def WriteValue(self, value, options):
-        global ledController
+        global ledController, audioReactive
         txt = bytes(value).decode('utf-8')
         print(f"As text: {txt}")
+        claim_session(options, ['light'], PRIORITY_NORMAL)
+        cancel_sleep_timer()
+        if txt == "reactive":
+            # 재생 중인 음악에 맞춰 LED가 반응하는 모드
+            if audioReactive is not None:
+                audioReactive.start()
+            return
+        if audioReactive is not None:
+            audioReactive.stop()
         if "," in txt:
             colorValues = txt.split(",")
-            self.red = float(colorValues[0])
-            self.green = float(colorValues[1])
-            self.blue = float(colorValues[2])
+            red = float(colorValues[0])
+            green = float(colorValues[1])
+            blue = float(colorValues[2])
+            zone = colorValues[3] if len(colorValues) > 3 else None
             
             ledController.start()
             if ledController is not None:
-                ledController.update_color(self.red, self.green, self.blue, -1)
+                ledController.update_color(red, green, blue, -1, zone)
         else:
             if ledController is not None:
                 ledController.stop()
@@ -411,6 +453,9 @@ class AudioService(Service):
         self.add_characteristic(AudioOnCharacteristic(bus, 1, self))
         self.add_characteristic(ChangeVolumeCharacteristic(bus, 2, self))
         self.add_characteristic(AudioOffCharacteristic(bus, 3, self))
+        self.add_characteristic(UploadCharacteristic(bus, 4, self))
+        self.add_characteristic(CatalogCharacteristic(bus, 5, self))
+        self.add_characteristic(SleepTimerCharacteristic(bus, 6, self))
 
 class AudioOnCharacteristic(Characteristic):
     AUDIO_ON_CHRC_UUID = '123e4567-e89b-12d3-a456-426614175001'
@@ -421,8 +466,6 @@ class AudioOnCharacteristic(Characteristic):
                 self.AUDIO_ON_CHRC_UUID,
                 ['write', 'writable-auxiliaries'],
                 service)
-        self.file_path = ""
-        self.volume = 0
     
     def WriteValue(self, value, options):
         global player
@@ -430,17 +473,16 @@ class AudioOnCharacteristic(Characteristic):
         print(f"As text: {txt}")
         if "," in txt:
             audioValues = txt.split(",")
+            claim_session(options, ['audio'], PRIORITY_NORMAL)
+            cancel_sleep_timer()
             
-            if audioValues[2] == 'music':
-                self.file_path = f'./SleepMusic/{audioValues[0]}.wav'
-            elif audioValues[2] == 'alarm':
-                self.file_path = f'./Alarm/{audioValues[0]}.wav'
+            file_path = track_path(audioValues[0], audioValues[2])
                 
-            self.volume = int(audioValues[1])
+            volume = int(audioValues[1])
             
             player.start()
             if player is not None:
-                player.update_music(self.file_path, self.volume)
+                player.update_music(file_path, volume)
             # time.sleep(4)
             # player.stop_audio()
         else:
@@ -455,7 +497,6 @@ class ChangeVolumeCharacteristic(Characteristic):
                 self.CNG_VOL_CHRC_UUID,
                 ['write', 'writable-auxiliaries'],
                 service)
-        self.volume = 0
     
     def WriteValue(self, value, options):
         global player
@@ -464,9 +505,11 @@ class ChangeVolumeCharacteristic(Characteristic):
         if "," in txt:
             print("Wrong value in ChangeVolumeCharacteristic")
         else:
-            self.volume = int(txt)
+            claim_session(options, ['audio'], PRIORITY_NORMAL)
+            cancel_sleep_timer()
+            volume = int(txt)
             if player is not None:
-                player.set_volume(self.volume)
+                player.set_volume(volume)
 
 class AudioOffCharacteristic(Characteristic):
     AUDIO_OFF_CHRC_UUID = '123e4567-e89b-12d3-a456-426614175003'
@@ -483,9 +526,108 @@ class AudioOffCharacteristic(Characteristic):
         print(value)
         txt = bytes(value).decode('utf-8')
         print(f"As text: {txt}")
+        claim_session(options, ['audio'], PRIORITY_NORMAL)
         if player is not None:
             player.stop()
 
+class UploadCharacteristic(Characteristic):
+    UPLOAD_CHRC_UUID = '123e4567-e89b-12d3-a456-426614175004'
+
+    def __init__(self, bus, index, service):
+        Characteristic.__init__(
+                self, bus, index,
+                self.UPLOAD_CHRC_UUID,
+                ['read', 'write', 'write-without-response', 'notify'],
+                service)
+        self.uploads = {} # device -> AssetUpload, so uploads from two phones never mix
+        self.last_acks = {}
+        self.notifying = False
+
+    def upload(self, options):
+        device = sessions.session(options).device
+        upload = self.uploads.get(device)
+        if upload is None:
+            upload = AssetUpload({'alarm': './Alarm', 'music': './SleepMusic'})
+            upload.add_listener(update_catalog)
+            self.uploads[device] = upload
+        return device, upload
+
+    def ReadValue(self, options):
+        # 마지막 ack (상태, 받은 offset) - 연결이 끊긴 뒤 어디서부터 이어 보낼지 확인용
+        device = sessions.session(options).device
+        return dbus.Array(self.last_acks.get(device, b''), signature='y')
+
+    def WriteValue(self, value, options):
+        # 조각마다 offset 이 들어 있어서 write/write-without-response 모두 사용 가능
+        mtu = int(options.get('mtu', 23))
+        device, upload = self.upload(options)
+        try:
+            ack = upload.handle(bytes(value), mtu)
+        except (UploadError, ValueError, OSError) as e:
+            print('Upload error: {}'.format(e))
+            raise FailedException(str(e))
+        if ack is not None:
+            self.last_acks[device] = ack
+            # notifications reach every subscriber, so while another phone is
+            # uploading too each client reads its own ack instead
+            others = [u for d, u in self.uploads.items() if d != device and u.file is not None]
+            if self.notifying and not others:
+                self.PropertiesChanged(GATT_CHRC_IFACE,
+                                       {'Value': dbus.Array(ack, signature='y')},
+                                       [])
+
+    def StartNotify(self):
+        self.notifying = True
+
+    def StopNotify(self):
+        self.notifying = False
+
+class CatalogCharacteristic(Characteristic):
+    CATALOG_CHRC_UUID = '123e4567-e89b-12d3-a456-426614175005'
+
+    def __init__(self, bus, index, service):
+        Characteristic.__init__(
+                self, bus, index,
+                self.CATALOG_CHRC_UUID,
+                ['read', 'write'],
+                service)
+        self.pages = {} # device -> selected page, so clients browse independently
+
+    def ReadValue(self, options):
+        # "page/pages" followed by one "id,name,kind,seconds,format,loudness"
+        # line per track; long reads continue at options['offset']
+        if catalog is None:
+            raise FailedException('Catalog not loaded')
+        device = sessions.session(options).device
+        value = catalog.page(self.pages.get(device, 0))
+        return dbus.Array(value[int(options.get('offset', 0)):], signature='y')
+
+    def WriteValue(self, value, options):
+        # select the page returned by this client's next read
+        device = sessions.session(options).device
+        self.pages[device] = max(0, int(bytes(value).decode('utf-8')))
+
+class SleepTimerCharacteristic(Characteristic):
+    SLEEP_TIMER_CHRC_UUID = '123e4567-e89b-12d3-a456-426614175006'
+
+    def __init__(self, bus, index, service):
+        Characteristic.__init__(
+                self, bus, index,
+                self.SLEEP_TIMER_CHRC_UUID,
+                ['write', 'writable-auxiliaries'],
+                service)
+
+    def WriteValue(self, value, options):
+        # 분 단위. 0이면 타이머 취소
+        txt = bytes(value).decode('utf-8')
+        print(f"As text: {txt}")
+        claim_session(options, ['light', 'audio'], PRIORITY_NORMAL)
+        minutes = float(txt)
+        if minutes > 0:
+            sleepTimer.start(minutes)
+        else:
+            sleepTimer.cancel()
+
 class AlarmService(Service):
     ALARM_SVC_UUID = '123e4567-e89b-12d3-a456-426614176000'
 
@@ -503,13 +645,6 @@ class AlarmOnCharacteristic(Characteristic):
                 self.ALARM_ON_CHRC_UUID,
                 ['write', 'writable-auxiliaries'],
                 service)
-        
-        self.radientSec = 0 #Slowly brightened during this time
-        self.red = 0.00
-        self.green = 0.00
-        self.blue = 0.00
-        self.file_path = ""
-        self.volume = 0
     
     def WriteValue(self, value, options):
         txt = bytes(value).decode('utf-8')
@@ -517,14 +652,23 @@ class AlarmOnCharacteristic(Characteristic):
         if "," in txt:
             audioValues = txt.split(",")
             
-            self.radientSec = int(audioValues[0])
-            self.red = float(audioValues[1])
-            self.green = float(audioValues[2])
-            self.blue = float(audioValues[3])
-            self.file_path = f'./Alarm/{audioValues[4]}.wav'
-            self.volume = int(audioValues[5])
-
-            turnAlarmOn(self.radientSec, self.red, self.green, self.blue, self.file_path, self.volume)
+            radientSec = int(audioValues[0]) #Slowly brightened during this time
+            red = float(audioValues[1])
+            green = float(audioValues[2])
+            blue = float(audioValues[3])
+            file_path = track_path(audioValues[4], 'alarm')
+            volume = int(audioValues[5])
+            # 7번째 값이 'fade' 이면 소리도 빛과 함께 서서히 커짐
+            fade = len(audioValues) > 6 and audioValues[6] == 'fade'
+            # 8번째 값: 몇 초 뒤에 울릴지 (없으면 바로)
+            delay = float(audioValues[7]) if len(audioValues) > 7 else 0
+            # 알람은 울리는 시각부터 일반 색상/음악 변경보다 우선함. 울린 뒤
+            # ALARM_WINDOW 가 지나면 (아무도 끄지 않았어도) 다른 클라이언트가 다시 쓸 수 있음
+            fire_at = MediaClock.getInstance().now() + delay
+            claim_session(options, ['light', 'audio'], PRIORITY_ALARM, start=fire_at,
+                          until=fire_at + radientSec + ALARM_WINDOW)
+
+            turnAlarmOn(radientSec, red, green, blue, file_path, volume, fade, delay)
             
         else:
             print("Wrong value in AlarmOnCharacteristic")
@@ -542,35 +686,192 @@ class AlarmOffCharacteristic(Characteristic):
     def WriteValue(self, value, options):
         txt = bytes(value).decode('utf-8')
         print(f"As text: {txt}")
+        sequence = claim_session(options, ['light', 'audio'], PRIORITY_ALARM)
         turnAlarmOff()
+        # only our own claim: an alarm another client set meanwhile stays
+        sessions.release(['light', 'audio'], PRIORITY_ALARM, sequence)
 
-def turnAlarmOn(second, r, g, b, file_path, volume):
-    global player, ledController
-    steps = second * 10
-    
-    ledController.start()
-    if ledController is not None:
-        ledController.update_color(r, g, b, steps)
+class SceneService(Service):
+    SCENE_SVC_UUID = '123e4567-e89b-12d3-a456-426614177000'
 
-    time.sleep(second + 0.1) # led 켜질때까지 대기
-    
-    player.start()
-    if player is not None:
-        player.update_music(file_path, volume)
+    def __init__(self, bus, index):
+        Service.__init__(self, bus, index, self.SCENE_SVC_UUID, True)
+        self.add_characteristic(SceneCharacteristic(bus, 1, self))
+
+class SceneCharacteristic(Characteristic):
+    SCENE_CHRC_UUID = '123e4567-e89b-12d3-a456-426614177001'
+
+    def __init__(self, bus, index, service):
+        Characteristic.__init__(
+                self, bus, index,
+                self.SCENE_CHRC_UUID,
+                ['write', 'writable-auxiliaries'],
+                service)
     
+    def WriteValue(self, value, options):
+        # "이름"                       : 저장된 장면 적용
+        # "r,g,b,초,음악,종류,볼륨[,zone]" : 장면을 바로 적용
+        # "save,이름,r,g,b,초,음악,종류,볼륨[,zone]" : 장면 저장
+        txt = bytes(value).decode('utf-8')
+        print(f"As text: {txt}")
+        values = txt.split(",")
+        if values[0] == 'save' and len(values) >= 9:
+            sceneStore.save(values[1], SceneStore.parse(values[2:], track_path))
+            return
+        if len(values) >= 7:
+            scene = SceneStore.parse(values, track_path)
+        else:
+            scene = sceneStore.get(txt)
+            if scene is None:
+                print(f"Unknown scene: {txt}")
+                raise InvalidArgsException()
+        # 장면은 전환이 끝날 때까지만 다른 클라이언트의 일반 명령보다 우선함
+        now = MediaClock.getInstance().now()
+        claim_session(options, ['light', 'audio'], PRIORITY_SCENE,
+                      until=now + scene['transition'])
+        cancel_sleep_timer()
+        applyScene(scene)
+
+class StatusService(Service):
+    STATUS_SVC_UUID = '123e4567-e89b-12d3-a456-426614178000'
+
+    def __init__(self, bus, index):
+        Service.__init__(self, bus, index, self.STATUS_SVC_UUID, True)
+        self.add_characteristic(ResourceCharacteristic(bus, 1, self))
+
+class ResourceCharacteristic(Characteristic):
+    RESOURCE_CHRC_UUID = '123e4567-e89b-12d3-a456-426614178001'
+
+    def __init__(self, bus, index, service):
+        Characteristic.__init__(
+                self, bus, index,
+                self.RESOURCE_CHRC_UUID,
+                ['read'],
+                service)
+
+    def ReadValue(self, options):
+        # "threads,fds,rss_kB" of the daemon process, to spot leaks from the app
+        usage = resource_usage()
+        rss = usage['rss'] // 1024 if usage['rss'] is not None else -1
+        fds = usage['fds'] if usage['fds'] is not None else -1
+        value = '{},{},{}'.format(usage['threads'], fds, rss).encode('utf-8')
+        return dbus.Array(value[int(options.get('offset', 0)):], signature='y')
+
+def track_path(name, kind):
+    # "#<id>" refers to a catalog track by its numeric id
+    if catalog is not None:
+        if name.startswith('#'):
+            track = catalog.get(int(name[1:]))
+        else:
+            track = catalog.find(kind, name)
+        if track is not None:
+            return track.path
+    if name.startswith('#'):
+        print(f"Unknown track id: {name}")
+        return ""
+    if kind == 'stream':
+        # played from the media server given with --media-server
+        if media_server is None:
+            print("No media server configured")
+            return ""
+        return f'{media_server}/{name}.wav'
+    folder = {'music': 'SleepMusic', 'alarm': 'Alarm'}.get(kind)
+    if folder is None:
+        return ""
+    # prefer the copy normalized by Preprocess.py (device rate, S16_LE)
+    processed = f'./Processed/{folder}/{name}.wav'
+    if os.path.exists(processed):
+        return processed
+    return f'./{folder}/{name}.wav'
+
+
+def update_catalog(path):
+    if catalog is not None:
+        catalog.update_file(path)
+
+
+def claim_session(options, resources, priority, start=None, until=FOREVER):
+    # per-client session for this write; a command loses to a higher priority
+    # one (e.g. a ringing alarm) owned by another client. Returns the claim's
+    # sequence number
+    session = sessions.session(options)
+    sequence = sessions.claim(session, resources, priority, start, until)
+    if sequence is None:
+        print('Rejected write from {}: {} in use'.format(
+                session.device, ', '.join(resources)))
+        raise NotPermittedException()
+    return sequence
+
+
+def cancel_sleep_timer():
+    # an explicit light or audio command takes over from the wind-down, so
+    # the timer neither fades it nor stops it at the end
+    if sleepTimer is not None:
+        sleepTimer.cancel()
+
+
+def turnAlarmOn(second, r, g, b, file_path, volume, fade=False, delay=0):
+    global alarmTimeline
+    # 프레임 표와 오디오는 지금 준비하고, 울리기 직전에 장치를 열어 둠.
+    # 울리는 시각에는 LED/오디오 스레드가 같은 미디어 시계만 기다림
+    alarmTimeline.schedule(delay, second, r, g, b, file_path, volume, fade)
+    if sleepTimer is not None and sleepTimer.ends_at is not None \
+            and sleepTimer.ends_at > alarmTimeline.fire_at - PREOPEN:
+        # 수면 타이머가 끝나며 장치를 끄기 전에 알람이 먼저 준비됨
+        sleepTimer.cancel()
+
+    if advertising is not None: # 알람이 울리는 동안 앱이 빨리 찾을 수 있게 함
+        advertising.alarm_started(alarmTimeline.fire_at, alarmTimeline.fire_at + second)
+
+
+def applyScene(scene):
+    global audioReactive
+    if audioReactive is not None:
+        audioReactive.stop()
+    SceneStore.apply(scene, player, ledController, MediaClock.getInstance().now())
+
 
 def turnAlarmOff():
-    global player, ledController
+    global player, ledController, audioReactive
+
+    if alarmTimeline is not None:
+        alarmTimeline.cancel()
+
+    if audioReactive is not None:
+        audioReactive.stop()
 
     if ledController is not None:
         ledController.stop()
     
     if player is not None:
         player.stop()
+        player.prepare_music(None)
+
+    if advertising is not None:
+        advertising.alarm_stopped()
     
 
+def process_uptime():
+    # seconds since this process was exec'd, including interpreter start-up
+    # and imports (use with `python -X importtime` to see the import share)
+    try:
+        with open('/proc/self/stat') as stat:
+            start_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            now = float(uptime.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return now - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+def register_ad_cb():
+    print('Advertisement registered {:.2f}s after start'.format(
+            process_uptime()))
+
+
 def register_app_cb():
-    print('GATT application registered')
+    print('GATT application registered {:.2f}s after start'.format(
+            process_uptime()))
     print('-----------------------------------')
 
 
@@ -579,6 +880,45 @@ def register_app_error_cb(error):
     mainloop.quit()
 
 
+def configure_player(idle_timeout, period_size, periods, stream_periods, realtime):
+    player = AudioPlayer.getInstance()
+    player.idle_timeout = idle_timeout
+    player.period_size = period_size
+    player.periods = periods
+    player.stream_periods = stream_periods
+    # audio gets the higher priority; the LED renderer can drop a frame
+    player.realtime = realtime
+    return player
+
+
+def configure_leds(zones, share_fps, realtime):
+    ledController = LEDController.getInstance()
+    ledController.realtime = realtime
+    if zones:
+        ledController.configure_zones(zones)
+    if share_fps:
+        # other local programs send frames with FrameShare.FrameProducer
+        ledController.share_frames(share_fps)
+    return ledController
+
+
+def make_supervisor(watchdog):
+    supervisor = Supervisor(watchdog)
+    supervisor.watch('audio', components.get('audio'))
+    supervisor.watch('led', components.get('led'))
+    return supervisor
+
+
+def glib_schedule(seconds, callback):
+    # run callback once on the main loop
+    GObject.timeout_add(int(seconds * 1000), callback)
+
+
+def device_properties_changed(interface, changed, invalidated, path=None):
+    if 'Connected' in changed:
+        advertising.device_changed(path, bool(changed['Connected']))
+
+
 def find_adapter(bus):
     remote_om = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, '/'),
                                DBUS_OM_IFACE)
@@ -591,14 +931,37 @@ def find_adapter(bus):
     return None
 
 
+def report_power_stats(start_time, start_cpu):
+    # wakeups/sec from context switches, CPU seconds per hour of the whole
+    # run (commands included); `python Components.py idle` measures idle only
+    elapsed = time.monotonic() - start_time
+    cpu = time.process_time() - start_cpu
+    if elapsed > 0:
+        print('Power stats: {:.2f} wakeups/sec, {:.2f} CPU sec/hour of runtime'.format(
+                context_switches() / elapsed, cpu * 3600 / elapsed))
+
+
+def warm_up():
+    # load hardware modules in the background so the first command is fast
+    player.warm_up()
+    ledController.warm_up()
+
+
 def shutdown(timeout):
     print('Advertising for {} seconds...'.format(timeout))
     time.sleep(timeout)
     mainloop.quit()
 
 
-def main(timeout=0):
-    global mainloop, bus, player, ledController
+def main(timeout=0, low_power=False, idle_timeout=0, zones=None, watchdog=0,
+         capture=None, realtime=False, rt_priority=50, cpus=None,
+         period_size=2048, periods=4, workers=False, share_fps=0,
+         server=None, stream_periods=32, capture_full=False):
+    global mainloop, bus, player, ledController, audioReactive, supervisor, media_server
+    global sceneStore, catalog, sleepTimer, advertising, alarmTimeline
+
+    start_time = time.monotonic()
+    start_cpu = time.process_time()
 
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
@@ -617,20 +980,85 @@ def main(timeout=0):
     ad_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter),
                                 LE_ADVERTISING_MANAGER_IFACE)
 
-    test_advertisement = TestAdvertisement(bus, 0)
-
-    
-
-    ad_manager.RegisterAdvertisement(test_advertisement.get_path(), {},
-                                     reply_handler=register_app_cb,
+    advertisement = RaemAdvertisement(bus, 0, app.services)
+    # fast advertising after start, after a disconnect and while an alarm
+    # rings; slow while idle or connected
+    advertising = AdvertisingManager(ad_manager, advertisement, low_power,
+                                     schedule=glib_schedule,
+                                     reply_handler=register_ad_cb,
                                      error_handler=register_app_error_cb)
+    bus.add_signal_receiver(device_properties_changed,
+                            dbus_interface=DBUS_PROP_IFACE,
+                            signal_name='PropertiesChanged',
+                            arg0='org.bluez.Device1',
+                            path_keyword='path')
+    advertising.start()
     
     
     service_manager.RegisterApplication(app.get_path(), {},
                                         reply_handler=register_app_cb,
                                         error_handler=register_app_error_cb)
-    player = AudioPlayer.getInstance()
-    ledController = LEDController.getInstance()
+
+    # hardware modules (alsaaudio, board, neopixel) are only imported here,
+    # after registration was requested, or on first use. Every component is
+    # created once through the container and stopped in reverse order on exit
+    clock = MediaClock.getInstance()
+    if workers:
+        # audio and LEDs run in their own processes so D-Bus marshalling in
+        # this process never holds their GIL (multiprocessing is only loaded
+        # in this mode)
+        from MediaWorker import WorkerProxy
+        audio_rt = (rt_priority, cpus) if realtime else None
+        led_rt = (max(1, rt_priority - 10), cpus) if realtime else None
+        components.register('audio', lambda: WorkerProxy('audio', {
+                'idle_timeout': idle_timeout, 'period_size': period_size,
+                'periods': periods, 'stream_periods': stream_periods,
+                'realtime': audio_rt}), stop='close')
+        components.register('led', lambda: WorkerProxy('led', {
+                'zones': zones, 'realtime': led_rt, 'share_fps': share_fps}),
+                stop='close')
+    else:
+        components.register('audio', lambda: configure_player(
+                idle_timeout, period_size, periods, stream_periods,
+                Realtime(rt_priority, cpus) if realtime else None))
+        components.register('led', lambda: configure_leds(
+                zones, share_fps,
+                Realtime(max(1, rt_priority - 10), cpus) if realtime else None))
+        if realtime:
+            Realtime.shorten_gil_slices()
+    components.register('audioReactive',
+            lambda: AudioReactive(components.get('audio'), components.get('led')))
+    components.register('sleepTimer',
+            lambda: SleepTimer(components.get('audio'), components.get('led'), clock),
+            stop='cancel')
+    components.register('alarmTimeline',
+            lambda: AlarmTimeline(components.get('audio'), components.get('led'), clock),
+            stop='cancel')
+    components.register('supervisor', lambda: make_supervisor(watchdog), start='start')
+
+    player = components.get('audio')
+    ledController = components.get('led')
+    audioReactive = components.get('audioReactive')
+    media_server = server.rstrip('/') if server else None
+    sceneStore = SceneStore()
+    catalog = Catalog()
+    sleepTimer = components.get('sleepTimer')
+    alarmTimeline = components.get('alarmTimeline')
+
+    traceWriter = None
+    if capture and workers:
+        print('--capture is not available with --workers')
+    elif capture:
+        # record every LED frame and PCM period for TraceDiff.py
+        traceWriter = TraceWriter(capture, clock, pcm_step=1 if capture_full else PCM_STEP)
+        traceWriter.start()
+        ledController.capture = traceWriter
+        player.add_tap(traceWriter.pcm_period)
+    catalog.watch()
+
+    supervisor = components.get('supervisor')
+
+    threading.Thread(target=warm_up, daemon=True).start()
     
     if timeout > 0:
         threading.Thread(target=shutdown, args=(timeout,)).start()
@@ -640,9 +1068,36 @@ def main(timeout=0):
     mainloop = GObject.MainLoop()
     mainloop.run()  # blocks until mainloop.quit() is called
 
-    ad_manager.UnregisterAdvertisement(test_advertisement)
+    # the supervisor goes first so nothing is restarted while stopping
+    supervisor.stop()
+    if traceWriter is not None:
+        player.remove_tap(traceWriter.pcm_period)
+        ledController.capture = None
+        traceWriter.stop()
+
+    advertising.stop()
     print('Advertisement unregistered')
-    dbus.service.Object.remove_from_connection(test_advertisement)
+    dbus.service.Object.remove_from_connection(advertisement)
+    advertising.report()
+
+    if low_power:
+        report_power_stats(start_time, start_cpu)
+    if workers:
+        for proxy in (player, ledController):
+            mean, worst = proxy.latency()
+            print('{} worker: {} calls, round trip {:.2f} ms avg, {:.2f} ms max'.format(
+                proxy.kind, proxy.calls, mean * 1000, worst * 1000))
+        print('{} audio underruns'.format(player.underruns))
+    else:
+        ledController.unshare_frames()
+        if realtime:
+            print('LED frame interval {:.1f} ms +/- {:.2f} ms over {} frames, '
+                  '{} audio underruns'.format(
+                    ledController.frame_stats.mean * 1000,
+                    ledController.frame_stats.stddev() * 1000,
+                    ledController.frame_stats.count, player.underruns))
+    components.stop_all()
+    print('Stopped: {}'.format(format_usage(resource_usage())))
 
 
 if __name__ == '__main__':
@@ -650,6 +1105,59 @@ if __name__ == '__main__':
     parser.add_argument('--timeout', default=0, type=int, help="advertise " +
                         "for this many seconds then stop, 0=run forever " +
                         "(default: 0)")
+    parser.add_argument('--low-power', action='store_true', help="use slow " +
+                        "advertising intervals and report wakeups/sec and " +
+                        "CPU time per hour on exit")
+    parser.add_argument('--idle-timeout', default=0, type=int, help="keep " +
+                        "the audio device open this many seconds after " +
+                        "playback stops, 0=close immediately (default: 0)")
+    parser.add_argument('--zone', action='append', help="LED zone as " +
+                        "name:pin:start:count[:order], e.g. bed:D18:0:30:GRB; " +
+                        "may be repeated (default: one 30 pixel zone on D18)")
+    parser.add_argument('--watchdog', default=0, type=int, help="also " +
+                        "check worker threads every this many seconds; " +
+                        "failed threads are restarted as soon as they " +
+                        "report it either way, 0=no periodic check " +
+                        "(default: 0)")
+    parser.add_argument('--capture', default=None, help="append every LED " +
+                        "frame and a summary of every PCM period (every " +
+                        "16th frame and a CRC) to this trace file")
+    parser.add_argument('--capture-full-pcm', action='store_true', help="" +
+                        "store every PCM sample in the --capture trace " +
+                        "(about 0.6 GB per playing hour)")
+    parser.add_argument('--realtime', action='store_true', help="run the " +
+                        "audio and LED threads with SCHED_FIFO (or a lower " +
+                        "nice value without privileges) and report frame " +
+                        "jitter and underruns on exit")
+    parser.add_argument('--rt-priority', default=50, type=int, help="" +
+                        "SCHED_FIFO priority of the audio thread (default: 50)")
+    parser.add_argument('--cpus', default=None, help="pin the audio and " +
+                        "LED threads to these CPUs, e.g. 2,3")
+    parser.add_argument('--period-size', default=2048, type=int, help="" +
+                        "ALSA period size in frames (default: 2048)")
+    parser.add_argument('--periods', default=4, type=int, help="ALSA " +
+                        "periods per buffer (default: 4)")
+    parser.add_argument('--workers', action='store_true', help="run the " +
+                        "audio player and LED renderer in separate " +
+                        "processes and report command round trip time and " +
+                        "underruns on exit")
+    parser.add_argument('--share-frames', default=0, type=int, help="let " +
+                        "other programs send LED frames through shared " +
+                        "memory, composited at this many frames/sec, " +
+                        "0=off (default: 0)")
+    parser.add_argument('--media-server', default=None, help="stream " +
+                        "tracks of kind 'stream' from this server, e.g. " +
+                        "http://192.168.0.10:8000 or unix:/run/media.sock:")
+    parser.add_argument('--stream-buffer', default=32, type=int, help="" +
+                        "network jitter buffer in periods (default: 32)")
     args = parser.parse_args()
 
-    main(args.timeout)
+    cpus = None
+    if args.cpus:
+        cpus = {int(cpu) for cpu in args.cpus.split(',')}
+
+    main(args.timeout, args.low_power, args.idle_timeout, args.zone,
+         args.watchdog, args.capture, args.realtime, args.rt_priority, cpus,
+         args.period_size, args.periods, args.workers,
+         args.share_frames, args.media_server, args.stream_buffer,
+         args.capture_full_pcm)
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# 사용법(부하 중 지터/언더런 측정): python Realtime.py bench [--seconds 10] [--cpu-threads 2]
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+class Realtime:
+    # 작업 스레드(오디오, LED)의 스케줄링 설정. 권한이 없으면 가능한 만큼만 적용
+    def __init__(self, priority=0, cpus=None, niceness=-10):
+        self.priority = priority # SCHED_FIFO 우선순위 (1~99), 0이면 사용 안 함
+        self.cpus = cpus         # 고정할 CPU 번호 목록
+        self.niceness = niceness # SCHED_FIFO 를 못 쓸 때 대신 쓸 nice 값
+
+    def apply(self, name):
+        # 작업 스레드 안에서 호출. 리눅스에서는 스레드마다 따로 적용됨
+        tid = threading.get_native_id()
+        applied = []
+        if self.priority > 0:
+            try:
+                os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(self.priority))
+                applied.append(f'SCHED_FIFO {self.priority}')
+            except (OSError, AttributeError) as e:
+                print(f"{name}: SCHED_FIFO not allowed ({e})")
+        if not applied and self.niceness:
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, self.niceness)
+                applied.append(f'nice {self.niceness}')
+            except (OSError, AttributeError) as e:
+                print(f"{name}: nice {self.niceness} not allowed ({e})")
+        if self.cpus:
+            try:
+                os.sched_setaffinity(tid, self.cpus)
+                applied.append(f'cpus {sorted(self.cpus)}')
+            except (OSError, AttributeError) as e:
+                print(f"{name}: CPU affinity not allowed ({e})")
+        print(f"{name} thread scheduling: {', '.join(applied) or 'default'}")
+
+    @staticmethod
+    def shorten_gil_slices(interval=0.001):
+        # GLib/D-Bus 스레드가 GIL 을 오래 잡고 있지 않도록 전환 간격을 줄임 (기본 5ms)
+        sys.setswitchinterval(interval)
+
+
+class IntervalStats:
+    # 프레임 간격의 평균과 표준편차 (Welford 방식으로 누적, 메모리 고정)
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last = None
+
+    def add(self, now):
+        if self.last is not None:
+            interval = now - self.last
+            self.count += 1
+            delta = interval - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (interval - self.mean)
+        self.last = now
+
+    def reset_gap(self):
+        # 페이드가 끝나 쉬는 동안의 간격은 지터에 넣지 않음
+        self.last = None
+
+    def stddev(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+
+def cpu_load(stop):
+    # 순수 파이썬 계산: GIL 을 계속 원하는 스레드
+    x = 0
+    while not stop.is_set():
+        for i in range(10000):
+            x = (x * 31 + i) % 1000003
+
+
+def ble_load(stop, ledController, rate=200):
+    # GLib/D-Bus 스레드 흉내: 초당 rate 번 GATT 요청을 풀고(마샬링) 컨트롤러 잠금을 잡음
+    # (프레임을 더 그리게 하면 페이드 간격 측정이 섞이므로 색은 바꾸지 않음)
+    i = 0
+    while not stop.is_set():
+        message = json.dumps({'device': f'/org/bluez/hci0/dev_{i % 8}', 'value': list(range(64))})
+        json.loads(message)
+        ledController.colors()
+        i += 1
+        time.sleep(1.0 / rate)
+
+
+def bench(path, seconds, cpu_threads, period_size, periods, priority, cpus):
+    # 가짜 장치로 LED 페이드와 재생을 돌리며 부하 없음 / 부하 / 부하 + 실시간 설정을 비교
+    from Components import use_fake_backends, PacedPCM
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController
+    use_fake_backends(PacedPCM)
+    player = AudioPlayer.getInstance()
+    ledController = LEDController.getInstance()
+    ledController.configure_zones(['main:D18:0:60'])
+    player.period_size = period_size
+    player.periods = periods
+    default_interval = sys.getswitchinterval()
+
+    for name, loaded, realtime in (('idle', False, False), ('loaded', True, False),
+                                   ('loaded + realtime', True, True)):
+        if realtime:
+            player.realtime = Realtime(priority, cpus)
+            ledController.realtime = Realtime(max(1, priority - 10), cpus)
+            Realtime.shorten_gil_slices()
+        ledController.frame_stats = IntervalStats()
+        player.underruns = 0
+        stop = threading.Event()
+        threads = []
+        if loaded:
+            threads = [threading.Thread(target=cpu_load, args=(stop,)) for _ in range(cpu_threads)]
+            threads.append(threading.Thread(target=ble_load, args=(stop, ledController)))
+        for thread in threads:
+            thread.start()
+
+        ledController.start()
+        start = ledController.clock.now()
+        ledController.fade_to(255, 128, 0, start, start + seconds)
+        player.start()
+        player.update_music(path, 50)
+        time.sleep(seconds)
+        output = player.output
+        device_underruns = output.underruns if output is not None else 0
+        player.stop()
+        ledController.stop()
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        stats = ledController.frame_stats
+        print(f"{name:>17}: LED frame interval {stats.mean * 1000:.1f} ms +/- "
+              f"{stats.stddev() * 1000:.2f} ms over {stats.count} frames, "
+              f"{player.underruns} underruns counted ({device_underruns} on the device)")
+        player.realtime = None
+        ledController.realtime = None
+        sys.setswitchinterval(default_interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--track', default='./Alarm/GM.wav', help="WAV " +
+                        "played during the bench (default: ./Alarm/GM.wav)")
+    parser.add_argument('--seconds', default=10, type=float, help="length " +
+                        "of each run (default: 10)")
+    parser.add_argument('--cpu-threads', default=2, type=int, help="busy " +
+                        "Python threads in the loaded runs (default: 2)")
+    parser.add_argument('--period-size', default=256, type=int, help="" +
+                        "ALSA period size in frames; small to expose " +
+                        "underruns (default: 256)")
+    parser.add_argument('--periods', default=2, type=int, help="ALSA " +
+                        "periods per buffer (default: 2)")
+    parser.add_argument('--rt-priority', default=50, type=int, help="" +
+                        "SCHED_FIFO priority of the audio thread (default: 50)")
+    parser.add_argument('--cpus', default=None, help="pin the audio and " +
+                        "LED threads to these CPUs, e.g. 2,3")
+    args = parser.parse_args()
+
+    cpus = None
+    if args.cpus:
+        cpus = {int(cpu) for cpu in args.cpus.split(',')}
+    bench(args.track, args.seconds, args.cpu_threads, args.period_size, args.periods,
+          args.rt_priority, cpus)
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# 사용법(장면 적용 시간을 따로 쓰는 경우와 비교): python SceneStore.py bench [--interval 30]
+
+import argparse
+import json
+import os
+import threading
+import time
+
+class SceneStore:
+    # 빛, 음악, 볼륨을 한 번에 적용하는 장면(scene)을 이름으로 저장
+    def __init__(self, path='./Scenes/scenes.json'):
+        self.path = path
+        self.scenes = {}
+        self.store_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.scenes = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"No scenes loaded: {e}")
+            self.scenes = {}
+
+    def get(self, name):
+        with self.store_lock:
+            return self.scenes.get(name)
+
+    def save(self, name, scene):
+        with self.store_lock:
+            self.scenes[name] = scene
+            # 임시 파일에 쓴 뒤 교체해서 전원이 나가도 파일이 깨지지 않게 함
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.scenes, f)
+            os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def parse(fields, track_path):
+        # fields: r,g,b,전환시간(초),음악이름,종류(music/alarm),볼륨[,zone]
+        # 음악이름이 '-' 이면 음악을 끔
+        scene = {
+            'color': [float(fields[0]), float(fields[1]), float(fields[2])],
+            'transition': float(fields[3]),
+            'track': None,
+            'volume': int(fields[6]),
+            'zone': fields[7] if len(fields) > 7 else None,
+        }
+        if fields[4] != '-':
+            scene['track'] = track_path(fields[4], fields[5])
+        return scene
+
+    @staticmethod
+    def apply(scene, player, ledController, start):
+        # 빛과 소리를 같은 시각(start) 기준으로 한 번에 예약해서 따로따로 바뀌어 보이지 않게 함
+        transition = scene['transition']
+        r, g, b = scene['color']
+        ledController.start()
+        ledController.fade_to(r, g, b, start, start + transition, scene['zone'])
+
+        if scene['track'] is None:
+            player.stop()
+        elif player.is_playing and player.audio_file_path == scene['track']:
+            player.set_volume(scene['volume'])
+        else:
+            player.start()
+            player.update_music(scene['track'], scene['volume'], start, transition)
+
+
+def next_event(interval, origin):
+    # BLE 쓰기는 다음 연결 이벤트에 전달됨. 그때까지 기다리고 그 시각을 돌려줌
+    now = time.monotonic()
+    event = origin + (int((now - origin) / interval) + 1) * interval
+    time.sleep(event - now)
+    return event
+
+
+def bench(path, interval, runs):
+    # 쓰기 한 번에 장면을 적용하는 것과 LED, AudioOn, 볼륨을 차례로 쓰는 것을 비교
+    # 적용 시간: 첫 쓰기를 보낸 뒤 마지막 값이 반영될 때까지
+    # 어긋남: 빛이 바뀌기 시작한 시각과 소리가 시작되는 시각의 차이
+    from Components import use_fake_backends, PacedPCM
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController
+    use_fake_backends(PacedPCM)
+    player = AudioPlayer.getInstance()
+    ledController = LEDController.getInstance()
+    scene = {'color': [255.0, 96.0, 0.0], 'transition': 2.0, 'track': path,
+             'volume': 40, 'zone': None}
+    results = {'sequential': ([], []), 'scene': ([], [])}
+    for run in range(runs):
+        for mode, (applied, skew) in results.items():
+            origin = time.monotonic()
+            if mode == 'scene':
+                event = next_event(interval, origin)
+                start = ledController.clock.now()
+                SceneStore.apply(scene, player, ledController, start)
+                light_at = sound_at = start
+            else:
+                # LEDCharacteristic, AudioOnCharacteristic, ChangeVolumeCharacteristic 순서
+                event = next_event(interval, origin)
+                r, g, b = scene['color']
+                ledController.start()
+                ledController.update_color(r, g, b, int(scene['transition'] * 10))
+                light_at = ledController.clock.now()
+                event = next_event(interval, event)
+                player.start()
+                player.update_music(path, 100)
+                sound_at = ledController.clock.now()
+                event = next_event(interval, event)
+                player.set_volume(scene['volume'])
+            applied.append(time.monotonic() - origin)
+            skew.append(abs(sound_at - light_at))
+            player.stop()
+            ledController.stop()
+    for mode, (applied, skew) in results.items():
+        print(f"{mode:>10}: applied {sum(applied) / runs * 1000:.1f} ms avg, "
+              f"{max(applied) * 1000:.1f} ms max; light/sound skew "
+              f"{sum(skew) / runs * 1000:.1f} ms avg")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--track', default='./Alarm/alarm.wav', help="WAV " +
+                        "used by the scene (default: ./Alarm/alarm.wav)")
+    parser.add_argument('--interval', default=30, type=float, help="BLE " +
+                        "connection interval in ms (default: 30)")
+    parser.add_argument('--runs', default=10, type=int, help="scenes per " +
+                        "path (default: 10)")
+    args = parser.parse_args()
+
+    bench(args.track, args.interval / 1000.0, args.runs)
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# 사용법(여러 클라이언트 부하 시험): python Sessions.py load [--clients 100] [--seconds 5]
+
+import argparse
+import collections
+import itertools
+import random
+import sys
+import threading
+import time
+
+PRIORITY_NORMAL = 0 # 색상, 음악, 볼륨 변경
+PRIORITY_SCENE = 1
+PRIORITY_ALARM = 2
+
+MAX_SESSIONS = 128 # 넘어도 쓰는 중인 세션은 지우지 않음
+SESSION_IDLE = 60.0 # 이만큼 쓰지 않았고 점유도 없는 세션만 지움(초)
+FOREVER = float('inf')
+
+# start~until(시계 기준) 동안만 다른 클라이언트의 낮은 우선순위 명령을 막음
+Claim = collections.namedtuple('Claim', ['priority', 'sequence', 'device', 'start', 'until'])
+
+class ClientSession:
+    # BLE 클라이언트(central) 하나. WriteValue options 의 'device' 로 구분
+    def __init__(self, device):
+        self.device = device
+        self.last_used = 0.0
+
+
+class SessionManager:
+    # 여러 클라이언트의 명령 순서(시퀀스 번호)와 우선순위를 조정
+    def __init__(self, max_sessions=MAX_SESSIONS, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.sessions = collections.OrderedDict()
+        self.claims = {}
+        self.sequence = itertools.count(1)
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def session(self, options):
+        device = str(options.get('device', 'local'))
+        with self.lock:
+            now = self.clock()
+            session = self.sessions.pop(device, None)
+            if session is None:
+                session = ClientSession(device)
+            session.last_used = now
+            self.sessions[device] = session
+            if len(self.sessions) > self.max_sessions:
+                self.evict(now)
+        return session
+
+    def evict(self, now):
+        # 오래 쓰지 않은 세션부터 정리. 최근에 썼거나 아직 끝나지 않은 점유가 있으면 남김
+        holding = {claim.device for claim in self.claims.values() if now < claim.until}
+        for device, session in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            if now - session.last_used < SESSION_IDLE:
+                break # 이후는 모두 더 최근에 쓴 세션
+            if device not in holding:
+                del self.sessions[device]
+                self.evicted += 1
+
+    def claim(self, session, resources, priority, start=None, until=FOREVER):
+        # 우선순위가 같거나 높으면 마지막에 쓴 클라이언트가 이김
+        # 다른 클라이언트가 더 높은 우선순위로 점유 중이면 None 을 반환
+        # start 가 미래이면 (예약된 알람) 그때까지는 다른 명령을 막지 않음
+        with self.lock:
+            now = self.clock()
+            for resource in resources:
+                claim = self.claims.get(resource)
+                if (claim is not None and claim.priority > priority and claim.device != session.device
+                        and claim.start <= now < claim.until):
+                    return None
+            sequence = next(self.sequence)
+            for resource in resources:
+                claim = self.claims.get(resource)
+                if claim is not None and claim.priority > priority and now < claim.until:
+                    continue # 더 높은 점유(예약된 알람 포함)는 낮은 명령으로 지워지지 않음
+                self.claims[resource] = Claim(priority, sequence, session.device,
+                                              now if start is None else start, until)
+            return sequence
+
+    def release(self, resources, priority, sequence=None):
+        # 해당 우선순위 이하의 점유를 풀어 일반 명령이 다시 통하게 함
+        # sequence 를 주면 그 명령의 점유일 때만 풂 (뒤에 온 명령의 점유는 남김)
+        with self.lock:
+            for resource in resources:
+                claim = self.claims.get(resource)
+                if (claim is not None and claim.priority <= priority
+                        and (sequence is None or claim.sequence == sequence)):
+                    del self.claims[resource]
+
+    def holder(self, resource):
+        # 지금 효력이 있는 점유 (없으면 None)
+        with self.lock:
+            claim = self.claims.get(resource)
+            now = self.clock()
+            if claim is None or not claim.start <= now < claim.until:
+                return None
+            return claim
+
+
+def load(clients, seconds, alarm_seconds, seed=1):
+    # 여러 폰이 동시에 색/음악/장면을 쓰고, 그중 하나가 알람을 거는 상황
+    # 처리량, 지연, 알람 중에 낮은 명령이 통했는지(중재 오류)를 셈
+    from Components import use_fake_backends
+    from LEDController import LEDController
+    use_fake_backends()
+    ledController = LEDController.getInstance()
+    sessions = SessionManager()
+    stop = threading.Event()
+    latencies = []
+    counts = collections.Counter()
+    counts_lock = threading.Lock()
+
+    def client(index):
+        rng = random.Random(seed + index)
+        options = {'device': f'/org/bluez/hci0/dev_{index:02X}'}
+        local = []
+        local_counts = collections.Counter()
+        while not stop.is_set():
+            before = time.perf_counter()
+            session = sessions.session(options)
+            resources, priority = ['light'], PRIORITY_NORMAL
+            if rng.random() < 0.1:
+                resources = ['light', 'audio']
+            sequence = sessions.claim(session, resources, priority)
+            if sequence is None:
+                local_counts['rejected'] += 1
+            else:
+                # 알람이 이 명령보다 먼저 점유했는데도 통과했다면 중재 오류
+                holder = sessions.holder('light')
+                if (holder is not None and holder.priority > priority
+                        and holder.device != session.device and holder.sequence < sequence):
+                    local_counts['wrong'] += 1
+                ledController.update_color(rng.randrange(256), rng.randrange(256),
+                                           rng.randrange(256), -1)
+                local_counts['accepted'] += 1
+            local.append(time.perf_counter() - before)
+            time.sleep(rng.uniform(0.0005, 0.002)) # BLE 연결 이벤트 사이 간격
+        with counts_lock:
+            latencies.extend(local)
+            counts.update(local_counts)
+
+    def alarm_client():
+        # 중간쯤 알람을 걸고 alarm_seconds 뒤 만료되게 함
+        # 그 직전에 다른 폰이 알람 끄기를 시작해서, 끝날 때 자기 점유만 풀어야 함
+        time.sleep(seconds / 3)
+        off = sessions.session({'device': '/org/bluez/hci0/dev_OFF'})
+        off_sequence = sessions.claim(off, ['light', 'audio'], PRIORITY_ALARM)
+        session = sessions.session({'device': '/org/bluez/hci0/dev_ALARM'})
+        now = sessions.clock()
+        sessions.claim(session, ['light', 'audio'], PRIORITY_ALARM, now, now + alarm_seconds)
+        sessions.release(['light', 'audio'], PRIORITY_ALARM, off_sequence)
+        # 알람 도중 클라이언트가 많아도 알람의 세션과 점유가 남아 있어야 함
+        time.sleep(alarm_seconds / 2)
+        holder = sessions.holder('light')
+        if holder is None or holder.device != session.device or session.device not in sessions.sessions:
+            with counts_lock:
+                counts['lost'] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    threads.append(threading.Thread(target=alarm_client))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    total = counts['accepted'] + counts['rejected']
+    print(f"{clients} clients, {seconds:.0f} s: {total / seconds:.0f} writes/sec, "
+          f"claim+apply {latencies[len(latencies) // 2] * 1e6:.0f} us median, "
+          f"{latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us p99")
+    print(f"{counts['accepted']} accepted, {counts['rejected']} rejected during the "
+          f"{alarm_seconds:.1f} s alarm, {counts['wrong']} accepted against the alarm, "
+          f"{len(sessions.sessions)} sessions kept, {sessions.evicted} evicted, "
+          f"{counts['lost']} active claims lost")
+    # 알람이 끝난 뒤에는 다시 통해야 함
+    after = sessions.claim(sessions.session({'device': 'late'}), ['light'], PRIORITY_NORMAL)
+    # 모든 클라이언트가 끝까지 쓰고 있었으므로 지워진 세션이 없어야 함
+    ok = (counts['wrong'] == 0 and counts['rejected'] > 0 and after is not None
+          and counts['lost'] == 0 and sessions.evicted == 0)
+    print("Arbitration held" if ok else "Arbitration failed")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['load'])
+    parser.add_argument('--clients', default=100, type=int, help="simulated " +
+                        "centrals writing at the same time (default: 100)")
+    parser.add_argument('--seconds', default=5, type=float, help="test " +
+                        "length (default: 5)")
+    parser.add_argument('--alarm-seconds', default=1.0, type=float, help="" +
+                        "how long the alarm claim lasts (default: 1)")
+    args = parser.parse_args()
+
+    sys.exit(0 if load(args.clients, args.seconds, args.alarm_seconds) else 1)
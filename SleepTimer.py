@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# 사용법(가상 시계로 줄어드는 곡선 확인): python SleepTimer.py selftest [--minutes 30]
+
+import argparse
+import math
+import sys
+import threading
+import time
+
+RESOLUTION = 1.0 # 곡선을 계산하는 간격(초)
+
+class SleepTimer:
+    # N분 동안 볼륨과 밝기를 함께 줄인 뒤 오디오 장치와 LED 스트립을 해제
+    def __init__(self, player, ledController, clock):
+        self.player = player
+        self.ledController = ledController
+        self.clock = clock
+        self.cancel_event = threading.Event()
+        self.timer_thread = None
+        self.events = []
+        self.ends_at = None # 끝나고 장치를 놓아줄 시각 (돌고 있지 않으면 None)
+
+    def curve(self, progress):
+        # 처음과 끝이 부드러운 코사인 곡선 (1 -> 0)
+        return 0.5 * (1.0 + math.cos(math.pi * progress))
+
+    def schedule(self, minutes, volume, colors):
+        # 값이 실제로 바뀌는 시각만 미리 계산해 둠. 실행 중에는 그 시각에만 깨어남
+        start = self.clock.now()
+        duration = minutes * 60.0
+        count = max(1, int(duration / RESOLUTION))
+        events = []
+        last = None
+        for step in range(1, count + 1):
+            factor = self.curve(step / count)
+            level = int(round(volume * factor))
+            scaled = {zone: tuple(int(c * factor) for c in color) for zone, color in colors.items()}
+            if (level, scaled) != last:
+                events.append((start + duration * step / count, level, scaled))
+                last = (level, scaled)
+        return events
+
+    def start(self, minutes):
+        self.cancel()
+        volume = self.player.volume
+        colors = self.ledController.colors()
+        self.events = self.schedule(minutes, volume, colors)
+        # 끝의 값이 모두 0 이 된 뒤로는 바뀌는 것이 없으므로 그때 끝남
+        self.ends_at = self.events[-1][0]
+        self.cancel_event.clear()
+        self.timer_thread = threading.Thread(target=self.run, args=(minutes,))
+        self.timer_thread.daemon = True
+        self.timer_thread.start()
+        print(f"Sleep timer: {minutes} min, {len(self.events)} updates")
+
+    def run(self, minutes):
+        level = None
+        for deadline, volume, colors in self.events:
+            if self.clock.wait_until(deadline, self.cancel_event):
+                return
+            if volume != level and self.player.is_playing:
+                level = volume
+                self.player.set_volume(volume)
+            for zone, color in colors.items():
+                self.ledController.update_color(color[0], color[1], color[2], -1, zone)
+
+        # 끝나면 재생을 멈추고 장치와 스트립을 놓아줌
+        self.ends_at = None
+        self.player.stop()
+        self.player.cancel_idle_timer()
+        self.player.close_output()
+        self.ledController.stop()
+        if minutes > 0:
+            print(f"Sleep timer done: {time.thread_time() * 1000 / minutes:.2f} ms CPU per minute")
+
+    def cancel(self):
+        if self.timer_thread is not None:
+            self.cancel_event.set()
+            if self.timer_thread is not threading.current_thread():
+                self.timer_thread.join()
+            self.timer_thread = None
+        self.ends_at = None
+
+
+class RecordingPlayer:
+    # 가상 시계 시각과 함께 호출을 기록하는 AudioPlayer 대역
+    def __init__(self, clock, volume):
+        self.clock = clock
+        self.volume = volume
+        self.is_playing = True
+        self.calls = []
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.calls.append((self.clock.now(), 'volume', volume))
+
+    def stop(self):
+        self.is_playing = False
+        self.calls.append((self.clock.now(), 'stop', None))
+
+    def cancel_idle_timer(self):
+        pass
+
+    def close_output(self):
+        self.calls.append((self.clock.now(), 'close', None))
+
+
+class RecordingLEDs:
+    def __init__(self, clock, colors):
+        self.clock = clock
+        self.targets = dict(colors)
+        self.calls = []
+
+    def colors(self):
+        return dict(self.targets)
+
+    def update_color(self, r, g, b, steps, zone=None):
+        self.targets[zone] = (r, g, b)
+        self.calls.append((self.clock.now(), 'color', (zone, (r, g, b))))
+
+    def stop(self):
+        self.calls.append((self.clock.now(), 'stop', None))
+
+
+def selftest(minutes, volume=80):
+    # 가상 시계로 타이머 전체를 바로 돌려 보고 곡선, 깨어나는 횟수, 끝 처리, 취소를 확인
+    from MediaClock import MediaClock, SimulatedClock
+    sim = SimulatedClock()
+    # 취소 시험에서 sim.sleep 을 바꿔 끼울 수 있게 매번 찾아서 부름
+    clock = MediaClock(sim.now, lambda seconds: sim.sleep(seconds))
+    ok = True
+
+    def check(name, passed, detail=''):
+        nonlocal ok
+        ok = ok and passed
+        print(f"{name}: {'ok' if passed else 'FAILED'} {detail}")
+
+    # 끝까지 돌리기
+    player = RecordingPlayer(clock, volume)
+    leds = RecordingLEDs(clock, {'bed': (255, 160, 60), 'ceiling': (90, 90, 255)})
+    timer = SleepTimer(player, leds, clock)
+    start = clock.now()
+    timer.start(minutes)
+    timer.timer_thread.join()
+    duration = minutes * 60.0
+    volumes = [(t, v) for t, kind, v in player.calls if kind == 'volume']
+    levels = [v for _, v in volumes]
+    check("volume only goes down to 0", levels == sorted(levels, reverse=True) and levels[-1] == 0,
+          f"({len(levels)} changes)")
+    half = min(volumes, key=lambda tv: abs(tv[0] - (start + duration / 2)))[1]
+    check("volume follows the cosine curve", abs(half - volume / 2) <= 1,
+          f"(at half time {half}, expected {volume / 2:.0f})")
+    brightness = [max(c) for t, kind, (zone, c) in
+                  ((t, k, v) for t, k, v in leds.calls if k == 'color') if zone == 'bed']
+    check("light only goes down to black", brightness == sorted(brightness, reverse=True)
+          and brightness[-1] == 0)
+    check("wakes only when a value changes", len(timer.events) <= duration / RESOLUTION,
+          f"({len(timer.events)} wakeups in {duration:.0f} s)")
+    end, level, colors = timer.events[-1]
+    stops = [(t, kind) for t, kind, _ in player.calls + leds.calls if kind in ('stop', 'close')]
+    check("releases audio and LEDs once, when everything reached 0",
+          len(stops) == 3 and all(t == end for t, _ in stops) and level == 0
+          and not any(any(c) for c in colors.values()) and end <= start + duration,
+          f"({end - start:.0f} s after start)")
+
+    # 중간에 다른 명령으로 취소
+    player = RecordingPlayer(clock, volume)
+    leds = RecordingLEDs(clock, {None: (255, 255, 255)})
+    timer = SleepTimer(player, leds, clock)
+    cancel_at = clock.now() + duration / 3
+    sleep = sim.sleep
+    def sleep_and_cancel(seconds):
+        sleep(seconds)
+        if sim.now() >= cancel_at:
+            timer.cancel_event.set()
+    sim.sleep = sleep_and_cancel
+    timer.start(minutes)
+    timer.timer_thread.join()
+    sim.sleep = sleep
+    late = [c for c in player.calls + leds.calls if c[0] > cancel_at or c[1] in ('stop', 'close')]
+    check("cancel stops all changes and keeps devices running", not late and player.is_playing,
+          f"({len(late)} calls after cancel)")
+
+    print("Sleep timer passed" if ok else "Sleep timer failed")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['selftest'])
+    parser.add_argument('--minutes', default=30, type=float, help="simulated " +
+                        "timer length (default: 30)")
+    args = parser.parse_args()
+
+    sys.exit(0 if selftest(args.minutes) else 1)
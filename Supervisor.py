@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# 사용법(장애 주입 확인): python Supervisor.py selftest [--track ./Alarm/GM.wav]
+
+import argparse
+import sys
+import threading
+import time
+
+class Supervisor:
+    # 작업 스레드(오디오, LED)가 죽으면 같은 프로세스 안에서 상태를 복원하며 재시작
+    def __init__(self, interval=30):
+        self.interval = interval # 0이면 실패 알림만 기다림 (주기적으로 깨어나지 않음)
+        self.components = {}
+        self.snapshots = {}
+        self.restarts = {}
+        self.last_restart = {}
+        self.wakeup = threading.Event()
+        self.is_running = False
+        self.watch_thread = None
+
+    def watch(self, name, component):
+        # component 는 is_failed(), snapshot(), restore(snapshot), on_failure 를 가짐
+        component.on_failure = self.notify
+        self.components[name] = component
+        self.restarts[name] = 0
+        self.last_restart[name] = 0.0
+
+    def notify(self, component):
+        self.wakeup.set()
+
+    def start(self):
+        if not self.is_running:
+            self.is_running = True
+            self.watch_thread = threading.Thread(target=self.run)
+            self.watch_thread.daemon = True
+            self.watch_thread.start()
+
+    def run(self):
+        while self.is_running:
+            self.wakeup.wait(self.interval or None)
+            self.wakeup.clear()
+            if self.is_running:
+                self.check()
+
+    def check(self):
+        for name, component in self.components.items():
+            if component.is_failed():
+                self.restart(name, component)
+            else:
+                self.snapshots[name] = component.snapshot()
+
+    def restart(self, name, component):
+        if time.monotonic() - self.last_restart[name] < 1.0:
+            # 장치가 계속 실패하는 경우 재시작을 무한 반복하지 않도록 잠시 쉼
+            time.sleep(1.0)
+        start = time.monotonic()
+        # 실패한 객체의 필드는 메모리에 그대로 남아 있으므로 지금 상태를 우선 사용
+        try:
+            snapshot = component.snapshot()
+        except Exception:
+            snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            # 예: 주기적 확인(--watchdog)을 끈 채 작업 프로세스가 죽음. 상태 없이라도 다시 띄움
+            print(f"No snapshot for {name}, restarting without its state")
+        try:
+            component.restore(snapshot)
+        except Exception as e:
+            print(f"Failed to restart {name}: {e}")
+            return
+        self.restarts[name] += 1
+        self.last_restart[name] = time.monotonic()
+        elapsed = (time.monotonic() - start) * 1000
+        print(f"Restarted {name} in {elapsed:.1f} ms (restart #{self.restarts[name]})")
+
+    def stop(self):
+        if self.is_running:
+            self.is_running = False
+            self.wakeup.set()
+            if self.watch_thread is not None:
+                self.watch_thread.join()
+                self.watch_thread = None
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def selftest(path, limit):
+    # 가짜 장치에서 ALSA 쓰기 오류와 LED 렌더 예외를 일으키고
+    # 감시자가 limit 초 안에 같은 재생 위치와 페이드 지점부터 이어가는지 확인
+    from Components import use_fake_backends, PacedPCM
+    import AudioPlayer as audio_module
+    from AudioPlayer import AudioPlayer
+    from LEDController import LEDController, FRAME_INTERVAL
+    use_fake_backends(PacedPCM)
+    player = AudioPlayer.getInstance()
+    ledController = LEDController.getInstance()
+    supervisor = Supervisor(0)
+    supervisor.watch('audio', player)
+    supervisor.watch('led', ledController)
+    supervisor.start()
+    ok = True
+
+    # 오디오: 재생 중 장치 쓰기가 실패
+    player.start()
+    player.update_music(path, 50)
+    time.sleep(1.0)
+    failed = {}
+    output = player.output
+    def failing_write(data):
+        failed['at'] = time.monotonic()
+        failed['position'] = player.position
+        raise audio_module.alsaaudio.ALSAAudioError('injected write error')
+    output.write = failing_write
+    resumed = wait_for(lambda: player.output is not None and player.output is not output
+                       and player.output.writes, 2.0)
+    if not resumed:
+        print("Audio: not restarted")
+        ok = False
+    else:
+        elapsed = player.output.writes[0][0] - failed['at']
+        # 첫 쓰기 직후에는 버퍼를 채우느라 몇 주기 앞서 있을 수 있음
+        drift = player.position - failed['position']
+        audio_ok = (supervisor.restarts['audio'] == 1 and elapsed < limit
+                    and 0 <= drift <= player.period_size * (player.periods + 1))
+        print(f"Audio: restarted in {elapsed * 1000:.1f} ms, failed at frame "
+              f"{failed['position']}, resumed at {player.resume_position} "
+              f"({'ok' if audio_ok else 'FAILED'})")
+        ok = ok and audio_ok
+    player.stop()
+
+    # LED: 페이드 중 스트립 출력에서 예외
+    ledController.start()
+    ledController.update_color(255, 0, 0, 50) # 5초 페이드
+    time.sleep(1.0)
+    zone = ledController.zones['all']
+    strip = ledController.strips['D18']
+    def failing_show():
+        failed['at'] = time.monotonic()
+        raise RuntimeError('injected render error')
+    strip.show = failing_show
+    resumed = wait_for(lambda: ledController.strips.get('D18', strip) is not strip, 2.0)
+    if not resumed:
+        print("LED: not restarted")
+        ok = False
+    else:
+        elapsed = time.monotonic() - failed['at']
+        now = ledController.clock.now()
+        # 페이드는 절대 시각 기준이라 재시작 뒤에도 지금 시각에 맞는 밝기여야 함
+        expected = 255 * (now - zone.fade_start) / (zone.fade_end - zone.fade_start)
+        led_ok = (supervisor.restarts['led'] == 1 and elapsed < limit
+                  and abs(zone.color[0] - expected) <= 255 * FRAME_INTERVAL / 5 + 1)
+        print(f"LED: restarted in {elapsed * 1000:.1f} ms, red {zone.color[0]:.0f} "
+              f"(expected {expected:.0f}) ({'ok' if led_ok else 'FAILED'})")
+        ok = ok and led_ok
+
+    supervisor.stop()
+    ledController.stop()
+    print("Fault injection passed" if ok else "Fault injection failed")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['selftest'])
+    parser.add_argument('--track', default='./Alarm/GM.wav', help="WAV " +
+                        "played during the audio fault (default: ./Alarm/GM.wav)")
+    parser.add_argument('--limit', default=0.1, type=float, help="maximum " +
+                        "seconds from fault to resumed output (default: 0.1)")
+    args = parser.parse_args()
+
+    sys.exit(0 if selftest(args.track, args.limit) else 1)
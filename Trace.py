@@ -0,0 +1,131 @@
+import queue
+import struct
+import threading
+import zlib
+
+# 파일 형식: MAGIC 다음에 레코드가 이어짐
+# 레코드: 종류(B) 시각(d, 미디어 시계) 길이(I) + 내용
+#   LED 프레임: 핀 이름 길이(B) + 핀 이름 + RGB 바이트(픽셀 x 3)
+#   PCM 주기  : 채널 수(B) + 샘플레이트(I) + S16_LE 데이터
+#   PCM 요약  : 채널 수(B) + 샘플레이트(I) + 프레임 수(I) + 원본 CRC32(I) + 간격(H)
+#               + 간격 프레임마다 하나씩 뽑은 S16_LE 데이터
+#   버림      : 이 레코드 앞에서 버려진 레코드 수(I)
+MAGIC = b'RAEMTRC1'
+RECORD = struct.Struct('<BdI')
+PCM_SUMMARY = struct.Struct('<BIIIH')
+LED_FRAME = 1
+PCM_PERIOD = 2
+PCM_DIGEST = 3
+DROPPED = 4
+
+PCM_STEP = 16 # 기본은 16 프레임마다 하나만 저장 (전체 PCM 의 1/16, 원본은 CRC 로 확인)
+MAX_BYTES = 1 << 30 # 이 크기를 넘으면 기록을 멈춤
+PUT_TIMEOUT = 0.002 # 큐가 가득 차면 렌더/재생 스레드가 이만큼만 기다림(초)
+FRAME_CODES = {2: 'H', 4: 'I', 8: 'Q'} # 프레임 크기(바이트) -> memoryview 형식
+
+class TraceWriter:
+    # LED 프레임과 PCM 주기를 추가 전용 파일에 기록. 실제 쓰기는 별도 스레드가 함
+    # pcm_step=1 이면 PCM 을 모두 저장
+    def __init__(self, path, clock, max_pending=1024, pcm_step=PCM_STEP, max_bytes=MAX_BYTES):
+        self.path = path
+        self.clock = clock
+        self.pcm_step = pcm_step
+        self.max_bytes = max_bytes
+        self.pending = queue.Queue(max_pending)
+        self.dropped = 0
+        self.marked = 0 # 파일에 DROPPED 레코드로 기록한 버림 수
+        self.dropped_lock = threading.Lock()
+        self.written = 0
+        self.full = False
+        self.is_running = False
+        self.writer_thread = None
+
+    def start(self):
+        if not self.is_running:
+            self.is_running = True
+            self.writer_thread = threading.Thread(target=self.run)
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+    def put(self, record):
+        # 렌더/재생 스레드에서 호출됨. 큐가 가득 차면 잠깐만 기다리고, 그래도 안 되면 버린 수를 셈
+        # (버린 수는 다음 레코드 앞에 기록되어 TraceDiff 가 어긋난 트레이스를 알아봄)
+        try:
+            self.pending.put(record, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def led_frame(self, now, pin, frame):
+        # frame 은 렌더할 때마다 새로 만드는 리스트라서 그대로 넘겨도 안전
+        self.put((LED_FRAME, now, pin, frame))
+
+    def pcm_period(self, view, channels, rate):
+        # AudioPlayer 의 tap. view 는 변경되지 않는 bytes 를 가리키므로 복사하지 않음
+        self.put((PCM_PERIOD, self.clock.now(), channels, rate, view))
+
+    def encode(self, record):
+        if record[0] == LED_FRAME:
+            _, now, pin, frame = record
+            name = pin.encode('utf-8')
+            payload = bytes([len(name)]) + name + bytes(min(255, max(0, c)) for pixel in frame for c in pixel)
+            return RECORD.pack(LED_FRAME, now, len(payload)) + payload
+        _, now, channels, rate, view = record
+        if self.pcm_step == 1:
+            return RECORD.pack(PCM_PERIOD, now, 5 + len(view)) + struct.pack('<BI', channels, rate) + view
+        data = memoryview(view).cast('B')
+        frame_size = 2 * channels
+        frames = len(data) // frame_size
+        code = FRAME_CODES.get(frame_size)
+        if code is not None: # 프레임 하나를 정수 하나로 보고 간격마다 뽑음 (C 에서 처리)
+            picked = data[:frames * frame_size].cast(code)[::self.pcm_step].tobytes()
+        else:
+            picked = b''.join(data[i * frame_size:(i + 1) * frame_size].tobytes()
+                              for i in range(0, frames, self.pcm_step))
+        header = PCM_SUMMARY.pack(channels, rate, frames, zlib.crc32(view), self.pcm_step)
+        return RECORD.pack(PCM_DIGEST, now, len(header) + len(picked)) + header + picked
+
+    def run(self):
+        with open(self.path, 'ab', buffering=1 << 16) as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            size = f.tell()
+            while True:
+                record = self.pending.get()
+                if record is None:
+                    break
+                with self.dropped_lock:
+                    dropped = self.dropped - self.marked
+                    self.marked = self.dropped
+                data = self.encode(record)
+                if dropped:
+                    data = RECORD.pack(DROPPED, record[1], 4) + struct.pack('<I', dropped) + data
+                if size + len(data) > self.max_bytes:
+                    if not self.full:
+                        self.full = True
+                        print(f"Trace {self.path} reached {self.max_bytes // (1 << 20)} MB, capture stopped")
+                    continue
+                f.write(data)
+                size += len(data)
+                self.written += 1
+
+    def stop(self):
+        if self.is_running:
+            self.is_running = False
+            self.pending.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+            print(f"Trace {self.path}: {self.written} records, {self.dropped} dropped")
+
+
+def read_trace(path):
+    # (종류, 시각, 내용) 을 순서대로 돌려줌
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            kind, now, length = RECORD.unpack(header)
+            yield kind, now, f.read(length)
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# 캡처한 트레이스(Trace.py)를 비교하거나 다시 재생
+# 사용법: python TraceDiff.py diff a.trace b.trace [--tolerance 2]
+#        python TraceDiff.py replay a.trace
+#        python TraceDiff.py bench [out.trace]   (캡처를 켰을 때의 비용)
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+from Trace import (read_trace, TraceWriter, LED_FRAME, PCM_PERIOD, PCM_DIGEST, DROPPED,
+                   PCM_SUMMARY, PCM_STEP)
+
+
+def load(path):
+    # LED 프레임은 핀별로 (시각 배열, 프레임 x 픽셀 x 3 배열)
+    # PCM 은 주기마다 (채널, 샘플레이트, 프레임 수, CRC32, 간격, 뽑은 샘플 프레임 x 채널 배열)
+    # 캡처 중에 버려진 레코드 수도 셈
+    led = {}
+    pcm = []
+    dropped = 0
+    for kind, now, payload in read_trace(path):
+        if kind == LED_FRAME:
+            length = payload[0]
+            pin = payload[1:1 + length].decode('utf-8')
+            times, frames = led.setdefault(pin, ([], []))
+            times.append(now)
+            frames.append(np.frombuffer(payload, dtype=np.uint8, offset=1 + length))
+        elif kind == PCM_PERIOD:
+            channels, rate = struct.unpack_from('<BI', payload)
+            samples = np.frombuffer(payload, dtype='<i2', offset=5).reshape(-1, channels)
+            pcm.append((channels, rate, len(samples), zlib.crc32(payload[5:]), 1, samples))
+        elif kind == PCM_DIGEST:
+            channels, rate, frames, crc, step = PCM_SUMMARY.unpack_from(payload)
+            samples = np.frombuffer(payload, dtype='<i2', offset=PCM_SUMMARY.size)
+            pcm.append((channels, rate, frames, crc, step, samples.reshape(-1, channels)))
+        elif kind == DROPPED:
+            dropped += struct.unpack('<I', payload)[0]
+    strips = {}
+    for pin, (times, frames) in led.items():
+        width = max(len(f) for f in frames)
+        stacked = np.zeros((len(frames), width), dtype=np.uint8)
+        for i, frame in enumerate(frames):
+            stacked[i, :len(frame)] = frame
+        strips[pin] = (np.array(times), stacked.reshape(len(frames), -1, 3))
+    return strips, pcm, dropped
+
+
+def compare_pcm(pcm_a, pcm_b, tolerance):
+    # 둘 다 전체 PCM 이면 샘플 단위로, 아니면 주기마다 같은 간격으로 뽑은 샘플과 CRC 로 비교
+    # 돌려주는 값: (같은지, 설명)
+    if all(period[4] == 1 for period in pcm_a + pcm_b):
+        audio_a = np.concatenate([p[5].ravel() for p in pcm_a]) if pcm_a else np.zeros(0, dtype='<i2')
+        audio_b = np.concatenate([p[5].ravel() for p in pcm_b]) if pcm_b else np.zeros(0, dtype='<i2')
+        count = min(len(audio_a), len(audio_b))
+        delta = np.abs(audio_a[:count].astype(np.int32) - audio_b[:count].astype(np.int32))
+        bad = np.flatnonzero(delta > tolerance)
+        text = (f"PCM: {len(audio_a)} vs {len(audio_b)} samples, "
+                f"max sample diff {int(delta.max()) if count else 0}")
+        if len(bad):
+            text += f"\n  first differing sample: {bad[0]} ({len(bad)} samples differ)"
+        return not len(bad) and len(audio_a) == len(audio_b), text
+
+    step = max(period[4] for period in pcm_a + pcm_b)
+    count = min(len(pcm_a), len(pcm_b))
+    bad = []
+    worst = 0
+    for i in range(count):
+        channels_a, rate_a, frames_a, crc_a, step_a, samples_a = pcm_a[i]
+        channels_b, rate_b, frames_b, crc_b, step_b, samples_b = pcm_b[i]
+        if (channels_a, rate_a, frames_a) != (channels_b, rate_b, frames_b):
+            bad.append(i)
+            continue
+        picked_a = samples_a[::step // step_a].astype(np.int32)
+        picked_b = samples_b[::step // step_b].astype(np.int32)
+        count_ab = min(len(picked_a), len(picked_b))
+        delta = int(np.abs(picked_a[:count_ab] - picked_b[:count_ab]).max()) if count_ab else 0
+        worst = max(worst, delta)
+        # 허용 오차가 없으면 뽑지 않은 샘플도 CRC 로 확인
+        if delta > tolerance or (tolerance == 0 and crc_a != crc_b):
+            bad.append(i)
+    text = (f"PCM: {len(pcm_a)} vs {len(pcm_b)} periods, compared every {step} frames "
+            f"and by CRC, max sample diff {worst}")
+    if bad:
+        text += f"\n  first differing period: {bad[0]} ({len(bad)} periods differ)"
+    return not bad and len(pcm_a) == len(pcm_b), text
+
+
+def diff(path_a, path_b, tolerance):
+    strips_a, pcm_a, dropped_a = load(path_a)
+    strips_b, pcm_b, dropped_b = load(path_b)
+    same = True
+    for path, dropped in ((path_a, dropped_a), (path_b, dropped_b)):
+        if dropped:
+            # 버려진 프레임 뒤로는 두 트레이스의 프레임 번호가 어긋남
+            print(f"{path}: {dropped} records were dropped during capture, frames are not aligned")
+            same = False
+
+    for pin in sorted(set(strips_a) | set(strips_b)):
+        if pin not in strips_a or pin not in strips_b:
+            print(f"LED {pin}: only in {path_a if pin in strips_a else path_b}")
+            same = False
+            continue
+        times_a, frames_a = strips_a[pin]
+        times_b, frames_b = strips_b[pin]
+        if frames_a.shape[1:] != frames_b.shape[1:]:
+            print(f"LED {pin}: layout differs, {frames_a.shape[1]} vs {frames_b.shape[1]} pixels")
+            same = False
+            continue
+        count = min(len(frames_a), len(frames_b))
+        # 시각은 각 트레이스의 첫 프레임 기준으로 비교
+        timing = np.abs((times_a[:count] - times_a[0]) - (times_b[:count] - times_b[0]))
+        delta = np.abs(frames_a[:count].astype(np.int16) - frames_b[:count].astype(np.int16))
+        per_frame = delta.reshape(count, -1).max(axis=1)
+        bad = np.flatnonzero(per_frame > tolerance)
+        print(f"LED {pin}: {len(frames_a)} vs {len(frames_b)} frames, "
+              f"max color diff {int(per_frame.max()) if count else 0}, "
+              f"max timing diff {timing.max() * 1000 if count else 0:.1f} ms")
+        if len(bad) or len(frames_a) != len(frames_b):
+            same = False
+            if len(bad):
+                print(f"  first differing frame: {bad[0]} ({len(bad)} frames differ)")
+
+    pcm_same, text = compare_pcm(pcm_a, pcm_b, tolerance)
+    print(text)
+    same = same and pcm_same
+
+    print("Traces match" if same else "Traces differ")
+    return same
+
+
+def replay(path):
+    # 기록된 시각 간격대로 LED 프레임과 소리를 다시 내보냄
+    import alsaaudio
+    import board
+    import neopixel
+
+    strips = {}
+    output = None
+    output_params = None
+    start = None
+    first = None
+    for kind, now, payload in read_trace(path):
+        if first is None:
+            first, start = now, time.monotonic()
+        if kind == LED_FRAME:
+            # 오디오는 ALSA 가 속도를 맞추므로 LED 프레임 앞에서만 기다림
+            delay = (now - first) - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+            length = payload[0]
+            pin = payload[1:1 + length].decode('utf-8')
+            data = payload[1 + length:]
+            strip = strips.get(pin)
+            if strip is None:
+                strip = strips[pin] = neopixel.NeoPixel(getattr(board, pin), len(data) // 3,
+                                                        auto_write=False, pixel_order=neopixel.RGB)
+            strip[0:len(data) // 3] = [tuple(data[i:i + 3]) for i in range(0, len(data), 3)]
+            strip.show()
+        elif kind in (PCM_PERIOD, PCM_DIGEST):
+            channels, rate = struct.unpack_from('<BI', payload)
+            data = payload[5:]
+            if kind == PCM_DIGEST:
+                # 뽑아 둔 샘플을 간격만큼 반복해서 길이와 시각을 맞춤 (음질은 낮음)
+                _, _, count, _, step = PCM_SUMMARY.unpack_from(payload)
+                picked = np.frombuffer(payload, dtype='<i2', offset=PCM_SUMMARY.size)
+                data = np.repeat(picked.reshape(-1, channels), step, axis=0)[:count].tobytes()
+            if output_params != (channels, rate):
+                output = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device='sysdefault:CARD=Audio')
+                output.setchannels(channels)
+                output.setrate(rate)
+                output.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+                output.setperiodsize(2048)
+                output_params = (channels, rate)
+            output.write(data)
+    for strip in strips.values():
+        strip.deinit()
+    if output is not None:
+        output.close()
+
+
+def bench(path, frames, pixels, period_size=2048, rate=44100):
+    # 렌더/재생 스레드가 실제로 부담하는 비용(큐에 넣기)과 렌더 한 번에 더해지는 시간,
+    # 현장에서 계속 켜 둘 때 시간당 파일 크기
+    import types
+    import LEDController as led_module
+    from Components import FakeNeoPixel
+    from MediaClock import MediaClock
+    led_module.board = types.SimpleNamespace(D18='D18')
+    led_module.neopixel = types.SimpleNamespace(NeoPixel=FakeNeoPixel, RGB='RGB')
+    ledController = led_module.LEDController.getInstance()
+    ledController.configure_zones([f'all:D18:0:{pixels}'])
+    clock = MediaClock.getInstance()
+    writer = TraceWriter(path, clock)
+    writer.start()
+
+    start = clock.now()
+    ledController.fade_to(255, 128, 0, start - 1800, start + 1800) # 중간 밝기에서 페이드 중
+    renders = {}
+    for capture in (None, writer):
+        ledController.capture = capture
+        before = time.perf_counter()
+        for _ in range(frames):
+            ledController.render(clock.now())
+        renders[capture is not None] = (time.perf_counter() - before) / frames
+    ledController.capture = None
+
+    period = memoryview(bytes(period_size * 4))
+    before = time.perf_counter()
+    for _ in range(frames):
+        writer.pcm_period(period, 2, rate)
+        time.sleep(0) # 실제 재생 스레드처럼 쓰기 사이에 GIL 을 넘김
+    pcm_cost = (time.perf_counter() - before) / frames
+    writer.stop()
+
+    led_bytes = 14 + 4 + pixels * 3 # 레코드 헤더 + 핀 이름 + RGB
+    full_bytes = 14 + 5 + period_size * 4
+    digest_bytes = 14 + PCM_SUMMARY.size + -(-period_size // PCM_STEP) * 4
+    per_hour = {name: (led_bytes / 0.1 + size * rate / period_size) * 3600
+                for name, size in (('full', full_bytes), ('digest', digest_bytes))}
+    print(f"LED render ({pixels} pixels): {renders[False] * 1e6:.0f} us without capture, "
+          f"{renders[True] * 1e6:.0f} us with capture "
+          f"({(renders[True] - renders[False]) * 1e6:+.0f} us per frame)")
+    print(f"PCM tap: {pcm_cost * 1e6:.1f} us per {period_size} frame period "
+          f"({pcm_cost / (period_size / rate) * 100:.3f}% of real time)")
+    # 측정은 실제보다 훨씬 빠르게 몰아서 넣으므로 버려지는 것은 큐가 넘친 경우의 동작 확인용
+    print(f"{writer.written} records written, {writer.dropped} dropped at burst rate, "
+          f"{os.path.getsize(path) / 1e6:.1f} MB; continuous capture is about "
+          f"{per_hour['digest'] / 1e6:.0f} MB per playing hour (PCM every {PCM_STEP} frames "
+          f"+ CRC; {per_hour['full'] / 1e9:.2f} GB with full PCM), "
+          f"{led_bytes / 0.1 * 3600 / 1e6:.0f} MB per fading hour without audio")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['diff', 'replay', 'bench'])
+    parser.add_argument('traces', nargs='*')
+    parser.add_argument('--tolerance', default=0, type=int, help="allowed " +
+                        "per channel / per sample difference (default: 0)")
+    parser.add_argument('--frames', default=2000, type=int, help="LED " +
+                        "frames and PCM periods for bench (default: 2000)")
+    parser.add_argument('--pixels', default=60, type=int, help="strip " +
+                        "length for bench (default: 60)")
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        if args.traces:
+            bench(args.traces[0], args.frames, args.pixels)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                bench(os.path.join(directory, 'bench.trace'), args.frames, args.pixels)
+    elif not args.traces:
+        parser.error(f'{args.command} needs a trace')
+    elif args.command == 'diff':
+        if len(args.traces) != 2:
+            parser.error('diff needs two traces')
+        sys.exit(0 if diff(args.traces[0], args.traces[1], args.tolerance) else 1)
+    else:
+        replay(args.traces[0])
\ No newline at end of file
@@ -7,12 +7,13 @@ import wave
 
 class LEDController:
     _instance = None
+    _lock = threading.Lock()
 
     @staticmethod
     def getInstance() :
-        if LEDController._instance is None:
-            return LEDController()
-        else :
+        with LEDController._lock:
+            if LEDController._instance is None:
+                LEDController._instance = LEDController()
             return LEDController._instance
         
     def __init__(self):
@@ -84,12 +85,13 @@ class LEDController:
 
 class AudioPlayer:
     _instance = None
+    _lock = threading.Lock()
 
     @staticmethod
     def getInstance():
-        if AudioPlayer._instance is None:
-            return AudioPlayer()
-        else:
+        with AudioPlayer._lock:
+            if AudioPlayer._instance is None:
+                AudioPlayer._instance = AudioPlayer()
             return AudioPlayer._instance
 
     def __init__(self):
@@ -190,7 +192,7 @@ class AudioPlayer:
             print("Audio stopped")
 
 player = AudioPlayer.getInstance()
-ledController = LEDController.getInstance
+ledController = LEDController.getInstance()
 
 def turnAlarmOn(second, r, g, b, file_path, volume):
     global player, ledController